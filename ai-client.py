@@ -1,12 +1,18 @@
 import requests
 import json
+import time
 import logging
 from typing import List, Dict, Any, Optional
-from config import load_config
+from config import get_config, AUTO_MODEL
 from database import add_usage_stats
+from metrics import observe, inc, OPENROUTER_DURATION, OPENROUTER_REQUESTS, OPENROUTER_TOKENS
+from tracing import start_span, SPAN_KIND_CLIENT
+from model_registry import get_model_registry
+from model_router import route_model, latency_stats
+from quotas import get_quota_manager
 
 logger = logging.getLogger(__name__)
-config = load_config()
+config = get_config()
 
 class AIClient:
     """Клиент для работы с OpenRouter API"""
@@ -14,14 +20,15 @@ class AIClient:
     def __init__(self, api_key: str = None):
         """Инициализация клиента"""
         self.api_key = api_key or config.OPENROUTER_API_KEY
-        self.base_url = "https://openrouter.ai/api/v1"
+        self.base_url = config.OPENROUTER_BASE_URL
     
     def generate_response(self, 
                          user_id: int,
                          messages: List[Dict], 
                          model: str = None, 
                          temperature: float = None,
-                         max_tokens: int = None) -> Optional[str]:
+                         max_tokens: int = None,
+                         conversation_mode: str = None) -> Optional[str]:
         """
         Генерация ответа на основе сообщений
         
@@ -31,44 +38,35 @@ class AIClient:
             model: Модель для генерации ответа
             temperature: Температура генерации (0.0-1.0)
             max_tokens: Максимальное количество токенов
-            
+            conversation_mode: Режим разговора (для статистики кеширования промптов)
+        
         Returns:
             Сгенерированный ответ или None в случае ошибки
         """
+        registry = get_model_registry()
         model = model or config.DEFAULT_MODEL
-        temperature = temperature if temperature is not None else config.DEFAULT_TEMP
         max_tokens = max_tokens or config.DEFAULT_MAX_TOKENS
+        if model == AUTO_MODEL:
+            model = route_model(messages, max_tokens, conversation_mode)
+        # Модели, пропавшие из каталога OpenRouter, заменяются доступными из настроек
+        model = registry.resolve(model, [config.DEFAULT_MODEL, *config.AVAILABLE_MODELS])
+        temperature = temperature if temperature is not None else config.DEFAULT_TEMP
+        max_tokens = registry.max_completion_tokens(model, max_tokens)
         
         try:
             payload = {
                 "model": model,
-                "messages": messages,
+                "messages": self._mark_cacheable_prefix(messages, model),
                 "temperature": temperature,
-                "max_tokens": max_tokens
-            }
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
+                "max_tokens": max_tokens,
+                "usage": {"include": True}
             }
             
-            response = requests.post(
-                url=f"{self.base_url}/chat/completions",
-                headers=headers,
-                data=json.dumps(payload)
-            )
-            
-            response.raise_for_status()
-            result = response.json()
+            started = time.monotonic()
+            result = self._post_completion(payload, "chat")
             
             # Сохраняем статистику использования
-            if "usage" in result and "total_tokens" in result["usage"]:
-                add_usage_stats(
-                    user_id=user_id,
-                    model=model,
-                    tokens_used=result["usage"]["total_tokens"],
-                    request_type="chat"
-                )
+            self._record_usage(user_id, model, result, "chat", started, conversation_mode)
             
             # Извлекаем текст ответа
             if "choices" in result and len(result["choices"]) > 0:
@@ -77,7 +75,7 @@ class AIClient:
             
             logger.error(f"Неожиданный формат ответа: {result}")
             return None
-            
+        
         except requests.exceptions.RequestException as e:
             logger.error(f"Ошибка при отправке запроса к OpenRouter API: {e}")
             return None
@@ -103,19 +101,12 @@ class AIClient:
             prompt: Текстовый запрос к изображению
             model: Модель для обработки изображения
             temperature: Температура генерации (0.0-1.0)
-            
+        
         Returns:
             Текстовый результат обработки изображения или None в случае ошибки
         """
-        model = model or config.DEFAULT_MODEL
         temperature = temperature if temperature is not None else config.DEFAULT_TEMP
         
-        # Проверяем, поддерживает ли модель работу с изображениями
-        # Для примера: модели Gemini, Claude поддерживают мультимодальные входы
-        if not self._model_supports_images(model):
-            logger.warning(f"Модель {model} не поддерживает обработку изображений. Используем gemini-pro-vision")
-            model = "google/gemini-2.0-pro-exp-02-05:free"
-        
         messages = [
             {
                 "role": "user",
@@ -134,35 +125,29 @@ class AIClient:
             }
         ]
         
+        model = model or config.DEFAULT_MODEL
+        if model == AUTO_MODEL:
+            model = route_model(messages)
+        # Модель без изображений на входе заменяется первой подходящей из настроек
+        model = get_model_registry().resolve(
+            model,
+            [config.DEFAULT_MODEL, *config.AVAILABLE_MODELS],
+            need_images=True
+        )
+        
         try:
             payload = {
                 "model": model,
                 "messages": messages,
-                "temperature": temperature
-            }
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
+                "temperature": temperature,
+                "usage": {"include": True}
             }
             
-            response = requests.post(
-                url=f"{self.base_url}/chat/completions",
-                headers=headers,
-                data=json.dumps(payload)
-            )
-            
-            response.raise_for_status()
-            result = response.json()
+            started = time.monotonic()
+            result = self._post_completion(payload, "image")
             
             # Сохраняем статистику использования
-            if "usage" in result and "total_tokens" in result["usage"]:
-                add_usage_stats(
-                    user_id=user_id,
-                    model=model,
-                    tokens_used=result["usage"]["total_tokens"],
-                    request_type="image"
-                )
+            self._record_usage(user_id, model, result, "image", started)
             
             # Извлекаем текст ответа
             if "choices" in result and len(result["choices"]) > 0:
@@ -171,7 +156,7 @@ class AIClient:
             
             logger.error(f"Неожиданный формат ответа: {result}")
             return None
-            
+        
         except requests.exceptions.RequestException as e:
             logger.error(f"Ошибка при отправке запроса к OpenRouter API: {e}")
             return None
@@ -182,16 +167,123 @@ class AIClient:
             logger.error(f"Непредвиденная ошибка при обработке изображения: {e}")
             return None
     
-    def _model_supports_images(self, model: str) -> bool:
-        """Проверка поддержки обработки изображений моделью"""
-        # Примерный список моделей, которые поддерживают обработку изображений
-        vision_models = [
-            "google/gemini-2.0-pro-exp-02-05",
-            "google/gemini-pro-vision",
-            "anthropic/claude-3",
-            "anthropic/claude-3-haiku",
-            "anthropic/claude-3-opus",
-            "anthropic/claude-3-sonnet"
+    def _post_completion(self, payload: Dict, request_type: str) -> Dict:
+        """Запрос к /chat/completions с учетом времени ответа и статуса в метриках"""
+        model = payload["model"]
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        started = time.perf_counter()
+        status = "error"
+        with start_span("openrouter.chat_completion", SPAN_KIND_CLIENT, model=model, request_type=request_type) as span:
+            try:
+                response = requests.post(
+                    url=f"{self.base_url}/chat/completions",
+                    headers=headers,
+                    data=json.dumps(payload)
+                )
+                status = str(response.status_code)
+                span.set_attribute("http.status_code", response.status_code)
+                
+                response.raise_for_status()
+                result = response.json()
+                
+                usage = result.get("usage") or {}
+                span.set_attribute("tokens.prompt", usage.get("prompt_tokens"))
+                span.set_attribute("tokens.completion", usage.get("completion_tokens"))
+                span.set_attribute("tokens.total", usage.get("total_tokens"))
+                span.set_attribute("tokens.cached", (usage.get("prompt_tokens_details") or {}).get("cached_tokens"))
+                return result
+            finally:
+                elapsed = time.perf_counter() - started
+                observe(OPENROUTER_DURATION, elapsed, (model, request_type))
+                inc(OPENROUTER_REQUESTS, (model, status))
+                # Задержки по моделям для автовыбора модели
+                latency_stats.record(model, elapsed * 1000, status == "200")
+    
+    def _model_supports_prompt_cache(self, model: str) -> bool:
+        """Проверка, нужны ли модели явные точки кеширования промпта (cache_control)"""
+        # OpenAI, DeepSeek и другие кешируют префикс автоматически, без разметки
+        cache_control_models = [
+            "anthropic/",
+            "google/gemini"
         ]
         
-        return any(model.startswith(vm) for vm in vision_models)
+        return any(model.startswith(cm) for cm in cache_control_models)
+    
+    def _mark_cacheable_prefix(self, messages: List[Dict], model: str) -> List[Dict]:
+        """
+        Разметка неизменной части запроса для кеширования промпта провайдером
+        
+        Точки кеширования ставятся на системный промпт режима и на последний
+        ответ ассистента в истории: все, что до него, повторяется в следующем
+        запросе и читается из кеша, а новая реплика пользователя (и добавленные
+        перед ней фрагменты памяти) идут после префикса.
+        
+        Args:
+            messages: Список сообщений
+            model: Модель для генерации ответа
+        
+        Returns:
+            Копия сообщений с cache_control (исходный список не изменяется)
+        """
+        if not config.PROMPT_CACHE_ENABLED or not self._model_supports_prompt_cache(model):
+            return messages
+        
+        breakpoints = set()
+        if messages and messages[0].get("role") == "system":
+            breakpoints.add(0)
+        assistant_indexes = [i for i, message in enumerate(messages) if message.get("role") == "assistant"]
+        if assistant_indexes:
+            breakpoints.add(assistant_indexes[-1])
+        
+        marked = []
+        for i, message in enumerate(messages):
+            if i not in breakpoints:
+                marked.append(message)
+                continue
+            
+            content = message.get("content")
+            if isinstance(content, str):
+                content = [{"type": "text", "text": content}]
+            
+            # Провайдеры принимают cache_control только в текстовых частях
+            text_parts = [j for j, part in enumerate(content or []) if part.get("type") == "text"]
+            if not text_parts:
+                marked.append(message)
+                continue
+            
+            content = list(content)
+            content[text_parts[-1]] = dict(content[text_parts[-1]], cache_control={"type": "ephemeral"})
+            marked.append(dict(message, content=content))
+        
+        return marked
+    
+    def _record_usage(self, user_id: int, model: str, result: Dict, request_type: str,
+                      started: float, conversation_mode: str = None) -> None:
+        """Сохранение статистики использования, включая токены, прочитанные из кеша промпта"""
+        usage = result.get("usage") or {}
+        if "total_tokens" not in usage:
+            return
+        
+        prompt_details = usage.get("prompt_tokens_details") or {}
+        
+        inc(OPENROUTER_TOKENS, (model, "prompt"), usage.get("prompt_tokens") or 0)
+        inc(OPENROUTER_TOKENS, (model, "completion"), usage.get("completion_tokens") or 0)
+        inc(OPENROUTER_TOKENS, (model, "cached"), prompt_details.get("cached_tokens") or 0)
+        
+        add_usage_stats(
+            user_id=user_id,
+            model=model,
+            tokens_used=usage["total_tokens"],
+            request_type=request_type,
+            prompt_tokens=usage.get("prompt_tokens") or 0,
+            cached_tokens=prompt_details.get("cached_tokens") or 0,
+            latency_ms=int((time.monotonic() - started) * 1000),
+            conversation_mode=conversation_mode
+        )
+        
+        # Счетчик квоты обновляется сразу, не дожидаясь сверки с usage_stats
+        get_quota_manager().record(user_id, usage["total_tokens"])
@@ -0,0 +1,56 @@
+import logging
+import threading
+from utils import create_backup
+from config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+class BackupManager:
+    """Периодическое резервное копирование базы данных в фоновом потоке"""
+    
+    def __init__(self, check_interval: int = None):
+        """Инициализация менеджера"""
+        self.check_interval = check_interval or config.BACKUP_INTERVAL_HOURS * 3600
+        self.is_running = False
+        self.thread = None
+        self.last_backup = None
+        self._stop_event = threading.Event()
+    
+    def start(self):
+        """Запуск резервного копирования"""
+        if self.is_running:
+            logger.warning("Резервное копирование уже запущено")
+            return
+        
+        self.is_running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="backup")
+        self.thread.daemon = True
+        self.thread.start()
+        
+        logger.info("Резервное копирование запущено")
+    
+    def stop(self):
+        """Остановка резервного копирования"""
+        if not self.is_running:
+            logger.warning("Резервное копирование не запущено")
+            return
+        
+        self.is_running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5.0)
+        
+        logger.info("Резервное копирование остановлено")
+    
+    def _run(self):
+        """Основной цикл резервного копирования"""
+        # Первая копия делается через интервал, а не при старте, чтобы не нагружать запуск
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                backup_file = create_backup()
+                if backup_file:
+                    self.last_backup = backup_file
+            except Exception as e:
+                logger.error(f"Ошибка при резервном копировании: {e}")
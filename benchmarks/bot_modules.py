@@ -0,0 +1,51 @@
+"""
+Импорт модулей бота, файлы которых названы через дефис.
+
+Часть модулей лежит в файлах ai-client.py, handlers/image-handler-py.py и
+т.п., а импортируются они как ai_client, handlers.image_handler. Бенчмарки
+подключают поиск модулей, который отдает эти файлы под именами из импортов;
+модули по-прежнему загружаются лениво, в момент первого импорта.
+
+Пример:
+    from benchmarks.bot_modules import install
+    install()
+    import main
+"""
+
+import os
+import sys
+import importlib.util
+from importlib.abc import MetaPathFinder
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Имя модуля в импортах -> файл относительно корня репозитория
+DASHED_MODULES = {
+    "ai_client": "ai-client.py",
+    "voice_handler": "voice-handler.py",
+    "scheduled_service": "scheduled-service.py",
+    "handlers.image_handler": os.path.join("handlers", "image-handler-py.py"),
+    "handlers.callback_handler": os.path.join("handlers", "callback-handler-py.py")
+}
+
+class DashedModuleFinder(MetaPathFinder):
+    """Поиск модулей бота из DASHED_MODULES"""
+    
+    def __init__(self, root: str = REPO_ROOT):
+        """Инициализация поиска"""
+        self.root = root
+    
+    def find_spec(self, fullname, path=None, target=None):
+        """Спецификация модуля из файла с дефисом или None для остальных модулей"""
+        filename = DASHED_MODULES.get(fullname)
+        if filename is None:
+            return None
+        return importlib.util.spec_from_file_location(fullname, os.path.join(self.root, filename))
+
+def install(root: str = REPO_ROOT) -> None:
+    """Подключение поиска модулей (повторный вызов ничего не меняет)"""
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    
+    if not any(isinstance(finder, DashedModuleFinder) for finder in sys.meta_path):
+        sys.meta_path.append(DashedModuleFinder(root))
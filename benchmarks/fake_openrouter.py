@@ -0,0 +1,277 @@
+"""
+Имитация OpenRouter API для нагрузочного тестирования.
+
+Отвечает на POST /chat/completions в формате OpenAI/OpenRouter с настраиваемой
+задержкой, долей ошибок и длиной ответа; при "stream": true отдает ответ
+частями в формате SSE. GET /models возвращает небольшой список моделей.
+
+Запуск отдельно (например, для ручной проверки бота без расходов на API):
+    python -m benchmarks.fake_openrouter --port 8081 --latency-ms 800
+    OPENROUTER_BASE_URL=http://127.0.0.1:8081/api/v1 python main.py
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+# Ответ GET /models - тот же файл, что подставляется вместо OpenRouter через MODEL_REGISTRY_FIXTURE
+MODELS_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "openrouter_models.json")
+
+with open(MODELS_FIXTURE, "r", encoding="utf-8") as f:
+    MODELS = json.load(f)["data"]
+
+WORDS = ("модель", "ответ", "нагрузка", "бот", "сообщение", "история", "запрос", "токен", "очередь", "данные")
+
+class _HTTPServer(ThreadingHTTPServer):
+    """Многопоточный сервер с длинной очередью соединений (тысячи одновременных запросов)"""
+    daemon_threads = True
+    request_queue_size = 1024
+
+class FakeOpenRouterServer:
+    """HTTP-сервер, имитирующий OpenRouter, в фоновом потоке"""
+    
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 latency_ms: float = 500.0,
+                 jitter_ms: float = 200.0,
+                 error_rate: float = 0.0,
+                 response_chars: int = 400,
+                 stream_chunk_ms: float = 20.0,
+                 seed: int = None):
+        """
+        Инициализация сервера
+        
+        Args:
+            host: Адрес
+            port: Порт (0 - любой свободный)
+            latency_ms: Средняя задержка ответа
+            jitter_ms: Разброс задержки (равномерный, +-)
+            error_rate: Доля ответов с ошибкой 500 или 429
+            response_chars: Длина текста ответа
+            stream_chunk_ms: Пауза между частями потокового ответа
+            seed: Начальное значение генератора случайных чисел
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.response_chars = response_chars
+        self.stream_chunk_ms = stream_chunk_ms
+        self.random = random.Random(seed)
+        
+        self._lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "streamed": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0
+        }
+        
+        self._server = _HTTPServer((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def base_url(self) -> str:
+        """Адрес для OPENROUTER_BASE_URL"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+    
+    def start(self) -> "FakeOpenRouterServer":
+        """Запуск в фоновом потоке"""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openrouter", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self) -> None:
+        """Остановка сервера"""
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def _count(self, **values) -> None:
+        """Обновление счетчиков"""
+        with self._lock:
+            for name, value in values.items():
+                self.stats[name] += value
+    
+    def _delay(self) -> float:
+        """Задержка очередного ответа в секундах"""
+        with self._lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms)
+            return max(0.0, self.latency_ms + jitter) / 1000.0
+    
+    def _fail(self) -> Optional[int]:
+        """Код ошибки для очередного ответа (None - ответ успешный)"""
+        with self._lock:
+            if self.random.random() >= self.error_rate:
+                return None
+            return self.random.choice((500, 429))
+    
+    def _text(self) -> str:
+        """Текст ответа заданной длины"""
+        with self._lock:
+            words = []
+            length = 0
+            while length < self.response_chars:
+                word = self.random.choice(WORDS)
+                words.append(word)
+                length += len(word) + 1
+        return " ".join(words)[:self.response_chars]
+    
+    def complete(self, payload: Dict):
+        """
+        Ответ на запрос /chat/completions
+        
+        Returns:
+            (код ответа, тело ответа или список частей потокового ответа)
+        """
+        delay = self._delay()
+        status = self._fail()
+        
+        prompt_chars = len(json.dumps(payload.get("messages", []), ensure_ascii=False))
+        prompt_tokens = max(1, prompt_chars // 4)
+        
+        if status is not None:
+            time.sleep(delay)
+            self._count(requests=1, errors=1)
+            return status, {"error": {"code": status, "message": "Fake OpenRouter error"}}
+        
+        text = self._text()
+        completion_tokens = max(1, len(text) // 4)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0}
+        }
+        self._count(requests=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        
+        time.sleep(delay)
+        
+        response_id = f"gen-fake-{self.random.getrandbits(48):012x}"
+        model = payload.get("model", "fake/model")
+        
+        if payload.get("stream"):
+            self._count(streamed=1)
+            words = text.split(" ")
+            chunks = [
+                {"id": response_id, "model": model, "choices": [{"index": 0, "delta": {"content": word + " "}}]}
+                for word in words
+            ]
+            chunks.append({
+                "id": response_id, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage
+            })
+            return 200, chunks
+        
+        return 200, {
+            "id": response_id,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        }
+    
+    def _handler_class(self):
+        """Класс обработчика запросов, привязанный к серверу"""
+        fake = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_GET(self):
+                """Список моделей"""
+                if self.path.split("?")[0].rstrip("/").endswith("/models"):
+                    self._send_json(200, {"data": MODELS})
+                else:
+                    self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+            
+            def do_POST(self):
+                """Генерация ответа"""
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                
+                if not self.path.split("?")[0].endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+                    return
+                
+                try:
+                    payload = json.loads(body or b"{}")
+                except json.JSONDecodeError:
+                    self._send_json(400, {"error": {"code": 400, "message": "Invalid JSON"}})
+                    return
+                
+                status, result = fake.complete(payload)
+                if isinstance(result, list):
+                    self._send_stream(result)
+                else:
+                    self._send_json(status, result)
+            
+            def _send_json(self, status: int, data: Dict) -> None:
+                """Ответ в формате JSON"""
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def _send_stream(self, chunks) -> None:
+                """Потоковый ответ в формате SSE"""
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                
+                for chunk in chunks:
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    time.sleep(fake.stream_chunk_ms / 1000.0)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+            
+            def log_message(self, format, *args):
+                """Запросы не пишем в лог"""
+        
+        return Handler
+
+def main():
+    """Запуск имитации OpenRouter из командной строки"""
+    parser = argparse.ArgumentParser(description="Имитация OpenRouter API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--jitter-ms", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--response-chars", type=int, default=400)
+    args = parser.parse_args()
+    
+    server = FakeOpenRouterServer(
+        host=args.host,
+        port=args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        response_chars=args.response_chars
+    ).start()
+    
+    print(f"Имитация OpenRouter: {server.base_url}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
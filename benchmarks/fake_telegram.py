@@ -0,0 +1,273 @@
+"""
+Эмулятор Telegram Bot API для нагрузочного тестирования.
+
+Бот подключается к нему через Application.builder().base_url(...) и работает
+как с настоящим API: получает обновления через getUpdates (long polling) и
+отправляет ответы через sendMessage, editMessageText и другие методы.
+Синтетические обновления добавляются методами push_*, а о каждом ответе бота
+в чат сообщается функции on_reply.
+"""
+
+import re
+import json
+import time
+import threading
+from collections import Counter
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "LoadTestBot",
+    "username": "load_test_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False
+}
+
+# Методы, вызов которых считается ответом пользователю
+REPLY_METHODS = {"sendMessage", "editMessageText", "sendDocument", "sendPhoto", "sendVoice"}
+
+MULTIPART_FIELD_RE = re.compile(rb'name="([^"]+)"\r\n\r\n(.*?)\r\n--', re.DOTALL)
+
+class _HTTPServer(ThreadingHTTPServer):
+    """Многопоточный сервер с длинной очередью соединений (тысячи одновременных запросов)"""
+    daemon_threads = True
+    request_queue_size = 1024
+
+class FakeTelegramServer:
+    """HTTP-сервер, имитирующий Bot API, в фоновом потоке"""
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 on_reply: Callable[[int, str, float], None] = None):
+        """
+        Инициализация эмулятора
+        
+        Args:
+            host: Адрес
+            port: Порт (0 - любой свободный)
+            on_reply: Вызывается с (chat_id, метод, time.monotonic()) при ответе бота в чат
+        """
+        self.on_reply = on_reply
+        
+        self._updates: List[Dict] = []
+        self._next_update_id = 1
+        self._next_message_id: Dict[int, int] = {}
+        self._condition = threading.Condition()
+        
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        
+        self._server = _HTTPServer((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def base_url(self) -> str:
+        """Адрес для Application.builder().base_url()"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+    
+    def start(self) -> "FakeTelegramServer":
+        """Запуск в фоновом потоке"""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self) -> None:
+        """Остановка сервера (ожидающие getUpdates завершаются)"""
+        with self._condition:
+            self._condition.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def pending_updates(self) -> int:
+        """Обновления, еще не полученные ботом"""
+        with self._condition:
+            return len(self._updates)
+    
+    def _message_id(self, chat_id: int) -> int:
+        """Следующий ID сообщения в чате"""
+        message_id = self._next_message_id.get(chat_id, 1)
+        self._next_message_id[chat_id] = message_id + 1
+        return message_id
+    
+    def _user(self, user_id: int) -> Dict:
+        """Пользователь с ID user_id"""
+        return {
+            "id": user_id,
+            "is_bot": False,
+            "first_name": f"User{user_id}",
+            "username": f"user{user_id}",
+            "language_code": "ru"
+        }
+    
+    def _push(self, update: Dict) -> int:
+        """Добавление обновления в очередь getUpdates"""
+        with self._condition:
+            update["update_id"] = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append(update)
+            self._condition.notify_all()
+            return update["update_id"]
+    
+    def push_message(self, user_id: int, text: str) -> int:
+        """Текстовое сообщение (или команда) от пользователя в личном чате"""
+        with self._condition:
+            message_id = self._message_id(user_id)
+        
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+            "from": self._user(user_id),
+            "text": text
+        }
+        if text.startswith("/"):
+            command = text.split(" ", 1)[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        
+        return self._push({"message": message})
+    
+    def push_callback(self, user_id: int, data: str) -> int:
+        """Нажатие inline-кнопки под сообщением бота"""
+        with self._condition:
+            message_id = self._message_id(user_id)
+        
+        return self._push({
+            "callback_query": {
+                "id": f"{user_id}-{message_id}",
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+                    "from": BOT_USER,
+                    "text": "⚙️ Настройки"
+                }
+            }
+        })
+    
+    def get_updates(self, offset: int = 0, limit: int = 100, timeout: float = 0) -> List[Dict]:
+        """Long polling: обновления с ID >= offset, ожидание до timeout секунд"""
+        deadline = time.monotonic() + timeout
+        
+        with self._condition:
+            # Обновления с ID меньше offset бот подтвердил
+            if offset:
+                self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._condition.wait(remaining)
+            
+            return self._updates[:limit]
+    
+    def call(self, method: str, params: Dict[str, Any]) -> Any:
+        """Выполнение метода Bot API, возвращает поле result ответа"""
+        with self._calls_lock:
+            self.calls[method] += 1
+        
+        if method == "getUpdates":
+            return self.get_updates(
+                offset=int(params.get("offset") or 0),
+                limit=int(params.get("limit") or 100),
+                timeout=float(params.get("timeout") or 0)
+            )
+        
+        if method == "getMe":
+            return BOT_USER
+        
+        chat_id = params.get("chat_id")
+        if chat_id is not None:
+            chat_id = int(chat_id)
+        
+        result: Any = True
+        if method in REPLY_METHODS or method == "editMessageReplyMarkup":
+            with self._condition:
+                message_id = params.get("message_id") or self._message_id(chat_id)
+            result = {
+                "message_id": int(message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "from": BOT_USER,
+                "text": params.get("text") or params.get("caption") or ""
+            }
+        
+        if method in REPLY_METHODS and chat_id is not None and self.on_reply is not None:
+            self.on_reply(chat_id, method, time.monotonic())
+        
+        return result
+    
+    def _handler_class(self):
+        """Класс обработчика запросов, привязанный к эмулятору"""
+        fake = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_GET(self):
+                """Вызов метода через GET"""
+                self._dispatch({})
+            
+            def do_POST(self):
+                """Вызов метода через POST"""
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                self._dispatch(_parse_params(self.headers.get("Content-Type", ""), body))
+            
+            def _dispatch(self, params: Dict) -> None:
+                """Разбор пути /bot<token>/<method> и ответ"""
+                path, _, query = self.path.partition("?")
+                for name, values in parse_qs(query).items():
+                    params.setdefault(name, _decode_value(values[0]))
+                
+                method = path.rstrip("/").rsplit("/", 1)[-1]
+                try:
+                    data = {"ok": True, "result": fake.call(method, params)}
+                except Exception as e:
+                    data = {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}
+                
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(200 if data["ok"] else 400)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                """Запросы не пишем в лог"""
+        
+        return Handler
+
+def _decode_value(value: str) -> Any:
+    """Значение параметра: python-telegram-bot передает сложные значения в JSON"""
+    try:
+        return json.loads(value)
+    except (json.JSONDecodeError, ValueError):
+        return value
+
+def _parse_params(content_type: str, body: bytes) -> Dict[str, Any]:
+    """Параметры метода из тела запроса (JSON, форма или multipart)"""
+    if not body:
+        return {}
+    
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    
+    if content_type.startswith("multipart/form-data"):
+        # Поля с файлами (filename=...) регулярному выражению не соответствуют
+        return {
+            name.decode(): _decode_value(value.decode("utf-8", errors="replace"))
+            for name, value in MULTIPART_FIELD_RE.findall(body)
+        }
+    
+    return {
+        name: _decode_value(values[0])
+        for name, values in parse_qs(body.decode("utf-8"), keep_blank_values=True).items()
+    }
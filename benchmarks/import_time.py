@@ -0,0 +1,199 @@
+"""
+Время холодного импорта модулей бота.
+
+Каждый замер - отдельный процесс `python -X importtime -c "import <модуль>"`,
+поэтому кеш sys.modules не влияет на результат (байт-код .pyc при этом уже
+скомпилирован, как в контейнере после первого запуска). В отчете медиана
+суммарного времени импорта по нескольким запускам и самые медленные
+вложенные импорты.
+
+Дополнительно проверяется, что импорт не тянет тяжелые необязательные
+зависимости (распознавание речи, Pillow, NumPy, sentence-transformers): они
+загружаются при первом использовании. Такой модуль в sys.modules, как и рост
+медианы больше --threshold относительно базовой линии, считается регрессией
+(код возврата 1).
+
+Пример:
+    python -m benchmarks.import_time --save-baseline
+    python -m benchmarks.import_time --module main --module database --top 15
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.microbench import BENCHMARK_DIR, compare_with_baseline, format_time
+
+DEFAULT_MODULES = ("main",)
+
+# Модули, которые не должны загружаться при запуске бота
+LAZY_MODULES = ("speech_recognition", "pydub", "PIL", "numpy", "sentence_transformers")
+
+def measure_import(module: str, workdir: str) -> Dict:
+    """
+    Импорт модуля в новом процессе
+    
+    Returns:
+        {"total": секунды, "imports": {пакет: {"self": с, "cumulative": с}}, "loaded": [модули]}
+    """
+    # Модули из файлов с дефисом в имени (ai-client.py и др.) подключаются через bot_modules
+    code = (
+        "import sys, json\n"
+        "from benchmarks.bot_modules import install\n"
+        "install()\n"
+        f"import {module}\n"
+        "sys.stdout.write(json.dumps(sorted(sys.modules)))\n"
+    )
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    # Конфигурация не должна зависеть от .env и user_config.json разработчика
+    env.setdefault("TELEGRAM_TOKEN", "0:import-time")
+    env.setdefault("OPENROUTER_API_KEY", "import-time")
+    
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=workdir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{result.stderr[-2000:]}")
+    
+    imports = {}
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        name = fields[2].strip()
+        self_us, cumulative_us = int(fields[0]), int(fields[1])
+        imports[name] = {"self": self_us / 1e6, "cumulative": cumulative_us / 1e6}
+        if name == module:
+            total = cumulative_us / 1e6
+    
+    return {"total": total, "imports": imports, "loaded": json.loads(result.stdout)}
+
+def run_module(module: str, runs: int, workdir: str) -> Dict:
+    """Несколько холодных импортов модуля: статистика и вложенные импорты медианного запуска"""
+    # Первый запуск прогревает .pyc и дисковый кеш и в статистику не входит
+    measure_import(module, workdir)
+    
+    samples = [measure_import(module, workdir) for _ in range(runs)]
+    totals = [sample["total"] for sample in samples]
+    median_sample = sorted(samples, key=lambda sample: sample["total"])[len(samples) // 2]
+    
+    return {
+        "min": min(totals),
+        "max": max(totals),
+        "mean": statistics.fmean(totals),
+        "median": statistics.median(totals),
+        "stddev": statistics.stdev(totals) if len(totals) > 1 else 0.0,
+        "runs": runs,
+        "imports": median_sample["imports"],
+        "eager_heavy": [name for name in median_sample["loaded"] if name in LAZY_MODULES]
+    }
+
+def slowest_imports(imports: Dict[str, Dict], top: int) -> List[tuple]:
+    """Самые медленные импорты по собственному времени"""
+    return sorted(imports.items(), key=lambda item: item[1]["self"], reverse=True)[:top]
+
+def print_results(results: Dict[str, Dict], comparison: Dict[str, Dict], top: int) -> None:
+    """Таблица результатов и самые медленные вложенные импорты"""
+    print(f"{'Модуль':<32}{'min':>12}{'median':>12}{'mean':>12}{'stddev':>12}{'vs base':>10}")
+    for name, stats in results.items():
+        line = (f"{name:<32}{format_time(stats['min']):>12}{format_time(stats['median']):>12}"
+                f"{format_time(stats['mean']):>12}{format_time(stats['stddev']):>12}")
+        if name in comparison:
+            line += f"{comparison[name]['ratio']:>9.2f}x"
+            if comparison[name]["regression"]:
+                line += "  РЕГРЕССИЯ"
+        print(line)
+    
+    for name, stats in results.items():
+        print(f"\n{name}: самые медленные импорты (собственное / суммарное время)")
+        for package, timing in slowest_imports(stats["imports"], top):
+            print(f"  {package:<48}{format_time(timing['self']):>12}{format_time(timing['cumulative']):>12}")
+        if stats["eager_heavy"]:
+            print(f"  Загружены при импорте: {', '.join(stats['eager_heavy'])}")
+
+def main():
+    """Замер времени импорта из командной строки"""
+    parser = argparse.ArgumentParser(description="Время холодного импорта модулей бота")
+    parser.add_argument("--module", action="append", default=None,
+                        help="Импортируемый модуль (можно несколько раз, по умолчанию main)")
+    parser.add_argument("--runs", type=int, default=7, help="Запусков на модуль")
+    parser.add_argument("--top", type=int, default=10, help="Сколько самых медленных импортов показать")
+    parser.add_argument("--baseline", default=os.path.join(BENCHMARK_DIR, "baselines", "import_time.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="Сохранить результаты как базовую линию")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Допустимый рост медианы (0.2 = 20%%)")
+    parser.add_argument("--output", default=None, help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+    
+    modules = args.module or list(DEFAULT_MODULES)
+    baseline_path = os.path.abspath(args.baseline)
+    
+    results = {}
+    # Импорт выполняется во временном каталоге, чтобы не читать .env и файлы бота
+    with tempfile.TemporaryDirectory(prefix="import_time_") as workdir:
+        for module in modules:
+            results[module] = run_module(module, max(1, args.runs), workdir)
+    
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    
+    comparison = compare_with_baseline(results, baseline, args.threshold) if baseline else {}
+    print_results(results, comparison, args.top)
+    
+    report = {
+        "created_at": int(time.time()),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor()
+        },
+        "benchmarks": {
+            name: {key: value for key, value in stats.items() if key != "imports"}
+            for name, stats in results.items()
+        }
+    }
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(dict(report, comparison=comparison, imports={
+                name: dict(slowest_imports(stats["imports"], args.top)) for name, stats in results.items()
+            }), f, ensure_ascii=False, indent=2)
+    
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        if baseline:
+            report["benchmarks"] = dict(baseline.get("benchmarks", {}), **report["benchmarks"])
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nБазовая линия сохранена в {baseline_path}")
+    elif baseline is None:
+        print(f"\nБазовой линии нет ({baseline_path}), сохраните ее с --save-baseline")
+    
+    failures = [name for name, item in comparison.items() if item["regression"]]
+    eager = [name for name, stats in results.items() if stats["eager_heavy"]]
+    if eager:
+        print(f"\nТяжелые зависимости загружаются при импорте: {', '.join(eager)}")
+    if failures and not args.save_baseline:
+        print(f"\nРегрессии больше {args.threshold:.0%}: {', '.join(failures)}")
+    if eager or (failures and not args.save_baseline):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+"""
+Сквозное нагрузочное тестирование бота.
+
+Бот из main.py (build_application) запускается против эмулятора Telegram Bot API
+и имитации OpenRouter на локальных портах. Синтетические пользователи пишут
+боту в личные чаты: каждый отправляет следующее сообщение только после ответа
+на предыдущее, одновременно активны не больше --concurrency пользователей.
+Задержка ответа считается от появления обновления в getUpdates до первого
+ответного sendMessage/editMessageText в чат.
+
+В отчете: пропускная способность, p50/p95/p99 по обработчикам, таймауты,
+вызовы Bot API, запросы к OpenRouter и рост базы данных.
+
+Пример:
+    python -m benchmarks.load_test --users 2000 --messages 5 --concurrency 200 \\
+        --latency-ms 800 --error-rate 0.02 --concurrent-updates 64 --output report.json
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import asyncio
+import sqlite3
+import logging
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fake_telegram import FakeTelegramServer
+from benchmarks.fake_openrouter import FakeOpenRouterServer
+from benchmarks.bot_modules import install as install_bot_modules
+
+# Сценарии: имя обработчика (как в метриках main.py) -> тип обновления
+SCENARIOS = ("text", "command_stats", "command_search", "command_summary", "callback")
+DEFAULT_MIX = "text=85,command_stats=5,command_search=4,command_summary=3,callback=3"
+
+TEXTS = (
+    "Привет! Как дела?",
+    "Объясни, что такое индекс в базе данных",
+    "Напиши короткое стихотворение про осень",
+    "Какие есть способы ускорить SQL-запрос?",
+    "Переведи на английский: нагрузочное тестирование",
+    "Придумай пять названий для кофейни",
+    "Чем отличается процесс от потока?",
+    "Расскажи интересный факт о космосе"
+)
+SEARCH_WORDS = ("индекс", "осень", "кофейни", "космосе", "потока")
+TEMPERATURES = ("0.2", "0.5", "0.7", "0.9")
+
+USER_ID_BASE = 100000
+
+def parse_mix(mix: str) -> List[Tuple[str, float]]:
+    """Разбор доли сценариев вида "text=85,callback=15" """
+    weights = []
+    for item in mix.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Неизвестный сценарий {name}, доступны: {', '.join(SCENARIOS)}")
+        weights.append((name, float(weight or 1)))
+    return weights
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль q (0-100) методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+class LoadDriver:
+    """Синтетические пользователи: сообщение - ожидание ответа - следующее сообщение"""
+    
+    def __init__(self,
+                 telegram: FakeTelegramServer,
+                 users: int,
+                 messages_per_user: int,
+                 concurrency: int,
+                 mix: List[Tuple[str, float]],
+                 think_time: float = 0.0,
+                 reply_timeout: float = 60.0,
+                 ramp_up: float = 0.0,
+                 duration: float = None,
+                 seed: int = None):
+        """
+        Инициализация нагрузки
+        
+        Args:
+            telegram: Эмулятор Bot API
+            users: Всего пользователей
+            messages_per_user: Сообщений от каждого пользователя
+            concurrency: Одновременно активных пользователей
+            mix: Доли сценариев
+            think_time: Пауза пользователя между ответом и следующим сообщением (секунды)
+            reply_timeout: Время ожидания ответа, после которого сообщение считается потерянным
+            ramp_up: За сколько секунд подключаются первые concurrency пользователей
+            duration: Ограничение длительности теста (секунды)
+            seed: Начальное значение генератора случайных чисел
+        """
+        self.telegram = telegram
+        self.users = users
+        self.messages_per_user = messages_per_user
+        self.concurrency = max(1, min(concurrency, users))
+        self.think_time = think_time
+        self.reply_timeout = reply_timeout
+        self.ramp_up = ramp_up
+        self.duration = duration
+        self.random = random.Random(seed)
+        self.scenarios = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        
+        self._condition = threading.Condition()
+        self._schedule: List[Tuple[float, int]] = []
+        self._waiting: Dict[int, Tuple[str, float]] = {}
+        self._remaining: Dict[int, int] = {}
+        self._next_user = 0
+        self._active = 0
+        self._thread: Optional[threading.Thread] = None
+        self.done = threading.Event()
+        
+        self.latencies: Dict[str, List[float]] = {name: [] for name in SCENARIOS}
+        self.sent = Counter()
+        self.timeouts = Counter()
+        self.extra_replies = 0
+        self.started_at = 0.0
+        self.finished_at = 0.0
+    
+    def start(self) -> None:
+        """Подключение первых пользователей и запуск потока отправки"""
+        with self._condition:
+            self.started_at = time.monotonic()
+            for i in range(self.concurrency):
+                self._add_user(self.started_at + self.ramp_up * i / self.concurrency)
+        
+        self._thread = threading.Thread(target=self._run, name="load-driver", daemon=True)
+        self._thread.start()
+    
+    def wait(self) -> None:
+        """Ожидание окончания теста"""
+        self.done.wait()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def on_reply(self, chat_id: int, method: str, when: float) -> None:
+        """Ответ бота в чат (вызывается из потока эмулятора)"""
+        with self._condition:
+            entry = self._waiting.pop(chat_id, None)
+            if entry is None:
+                # Следующие части длинного ответа или ответ после таймаута
+                self.extra_replies += 1
+                return
+            
+            scenario, sent_at = entry
+            self.latencies[scenario].append((when - sent_at) * 1000)
+            self._next_message(chat_id, when)
+    
+    def _add_user(self, due: float) -> None:
+        """Подключение следующего пользователя (под блокировкой)"""
+        user_id = USER_ID_BASE + self._next_user
+        self._next_user += 1
+        self._active += 1
+        self._remaining[user_id] = self.messages_per_user
+        heapq.heappush(self._schedule, (due, user_id))
+    
+    def _next_message(self, user_id: int, now: float) -> None:
+        """Планирование следующего сообщения пользователя или замена его новым (под блокировкой)"""
+        self._remaining[user_id] -= 1
+        if self._remaining[user_id] > 0:
+            heapq.heappush(self._schedule, (now + self.think_time, user_id))
+        else:
+            del self._remaining[user_id]
+            self._active -= 1
+            if self._next_user < self.users:
+                self._add_user(now)
+        
+        self._condition.notify()
+    
+    def _send(self, user_id: int, now: float) -> None:
+        """Отправка очередного обновления от пользователя (под блокировкой)"""
+        scenario = self.random.choices(self.scenarios, self.weights)[0]
+        self._waiting[user_id] = (scenario, now)
+        self.sent[scenario] += 1
+        
+        if scenario == "text":
+            self.telegram.push_message(user_id, self.random.choice(TEXTS))
+        elif scenario == "command_stats":
+            self.telegram.push_message(user_id, "/stats")
+        elif scenario == "command_search":
+            self.telegram.push_message(user_id, f"/search {self.random.choice(SEARCH_WORDS)}")
+        elif scenario == "command_summary":
+            self.telegram.push_message(user_id, "/summary")
+        elif scenario == "callback":
+            self.telegram.push_callback(user_id, f"temp_{self.random.choice(TEMPERATURES)}")
+    
+    def _expire(self, now: float) -> None:
+        """Сообщения без ответа дольше reply_timeout считаются потерянными (под блокировкой)"""
+        expired = [
+            (user_id, scenario) for user_id, (scenario, sent_at) in self._waiting.items()
+            if now - sent_at > self.reply_timeout
+        ]
+        for user_id, scenario in expired:
+            del self._waiting[user_id]
+            self.timeouts[scenario] += 1
+            self._next_message(user_id, now)
+    
+    def _run(self) -> None:
+        """Цикл отправки запланированных сообщений"""
+        last_expire = 0.0
+        
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                
+                if self.duration and now - self.started_at > self.duration:
+                    break
+                if self._active == 0:
+                    break
+                
+                if now - last_expire > 0.5:
+                    self._expire(now)
+                    last_expire = now
+                
+                while self._schedule and self._schedule[0][0] <= now:
+                    _, user_id = heapq.heappop(self._schedule)
+                    self._send(user_id, now)
+                
+                wait = 0.5
+                if self._schedule:
+                    wait = min(wait, max(0.0, self._schedule[0][0] - now))
+                self._condition.wait(wait)
+            
+            self.finished_at = time.monotonic()
+            self.done.set()
+    
+    def report(self) -> Dict:
+        """Итоги нагрузки"""
+        with self._condition:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+            handlers = {}
+            for scenario in SCENARIOS:
+                values = self.latencies[scenario]
+                if not values and not self.sent[scenario]:
+                    continue
+                handlers[scenario] = {
+                    "sent": self.sent[scenario],
+                    "replied": len(values),
+                    "timeouts": self.timeouts[scenario],
+                    "p50_ms": round(percentile(values, 50), 1),
+                    "p95_ms": round(percentile(values, 95), 1),
+                    "p99_ms": round(percentile(values, 99), 1),
+                    "max_ms": round(max(values), 1) if values else 0.0
+                }
+            
+            replied = sum(len(values) for values in self.latencies.values())
+            return {
+                "elapsed_seconds": round(elapsed, 2),
+                "users_started": self._next_user,
+                "updates_sent": sum(self.sent.values()),
+                "replies": replied,
+                "unanswered": len(self._waiting),
+                "timeouts": sum(self.timeouts.values()),
+                "extra_replies": self.extra_replies,
+                "throughput_per_second": round(replied / elapsed, 2) if elapsed > 0 else 0.0,
+                "handlers": handlers
+            }
+
+def database_stats(db_path: str) -> Dict:
+    """Размер файлов базы данных и число строк в основных таблицах"""
+    size = sum(
+        os.path.getsize(db_path + suffix)
+        for suffix in ("", "-wal", "-shm")
+        if os.path.exists(db_path + suffix)
+    )
+    
+    rows = {}
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            for table in ("users", "messages", "usage_stats"):
+                try:
+                    rows[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                except sqlite3.Error:
+                    pass
+        finally:
+            conn.close()
+    
+    return {"bytes": size, "rows": rows}
+
+async def run_bot(args, telegram: FakeTelegramServer, driver: LoadDriver) -> Tuple[Dict, Dict]:
+    """Запуск бота против эмулятора на время нагрузки, возвращает статистику базы до и после"""
+    # Модули бота импортируются после настройки окружения: конфигурация читается при импорте
+    install_bot_modules()
+    import main as bot
+    from database import init_db, shutdown_db
+    
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    
+    config = bot.init_config()
+    if args.no_outbound_limits:
+        config.OUTBOUND_QUEUE_ENABLED = False
+    
+    init_db()
+    # Каталог моделей загружается из имитации OpenRouter до начала нагрузки
+    bot.get_model_registry()
+    db_before = database_stats(config.DB_PATH)
+    
+    application = bot.build_application(
+        config,
+        base_url=telegram.base_url,
+        concurrent_updates=args.concurrent_updates
+    )
+    
+    await application.initialize()
+    await application.start()
+    await application.updater.start_polling(poll_interval=0.0, timeout=5)
+    
+    driver.start()
+    await asyncio.to_thread(driver.wait)
+    
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    shutdown_db()
+    
+    return db_before, database_stats(config.DB_PATH)
+
+def print_report(report: Dict) -> None:
+    """Вывод отчета в консоль"""
+    load = report["load"]
+    print()
+    print(f"Длительность: {load['elapsed_seconds']} с, пользователей: {load['users_started']}")
+    print(f"Обновлений: {load['updates_sent']}, ответов: {load['replies']}, "
+          f"таймаутов: {load['timeouts']}, без ответа: {load['unanswered']}")
+    print(f"Пропускная способность: {load['throughput_per_second']} ответов/с")
+    print()
+    
+    print(f"{'Обработчик':<18}{'отпр.':>8}{'отв.':>8}{'тайм.':>7}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'max мс':>10}")
+    for name, stats in load["handlers"].items():
+        print(f"{name:<18}{stats['sent']:>8}{stats['replied']:>8}{stats['timeouts']:>7}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+    print()
+    
+    openrouter = report["openrouter"]
+    print(f"OpenRouter: запросов {openrouter['requests']}, ошибок {openrouter['errors']}, "
+          f"токенов {openrouter['prompt_tokens']} + {openrouter['completion_tokens']}")
+    print("Bot API: " + ", ".join(f"{method} {count}" for method, count in report["bot_api_calls"].items()))
+    
+    database = report["database"]
+    print(f"База данных: {database['bytes_before']} -> {database['bytes_after']} байт "
+          f"(+{database['bytes_per_reply']} на ответ), строки: {database['rows_after']}")
+
+def main():
+    """Запуск нагрузочного теста из командной строки"""
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с эмуляцией Telegram и OpenRouter")
+    parser.add_argument("--users", type=int, default=500, help="Всего пользователей")
+    parser.add_argument("--messages", type=int, default=5, help="Сообщений от каждого пользователя")
+    parser.add_argument("--concurrency", type=int, default=100, help="Одновременно активных пользователей")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Доли сценариев: " + ", ".join(SCENARIOS))
+    parser.add_argument("--think-time", type=float, default=0.0, help="Пауза пользователя между сообщениями, с")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="Время подключения первых пользователей, с")
+    parser.add_argument("--duration", type=float, default=None, help="Ограничение длительности теста, с")
+    parser.add_argument("--reply-timeout", type=float, default=60.0, help="Ожидание ответа, с")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Средняя задержка OpenRouter")
+    parser.add_argument("--jitter-ms", type=float, default=200.0, help="Разброс задержки OpenRouter")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ошибок OpenRouter (500/429)")
+    parser.add_argument("--response-chars", type=int, default=400, help="Длина ответов OpenRouter")
+    parser.add_argument("--concurrent-updates", type=int, default=None,
+                        help="Параллельно обрабатываемых обновлений (по умолчанию как в main.py)")
+    parser.add_argument("--no-outbound-limits", action="store_true",
+                        help="Отключить очередь исходящих запросов с лимитами Telegram")
+    parser.add_argument("--workdir", default=None, help="Каталог для базы данных и файлов бота (по умолчанию временный)")
+    parser.add_argument("--output", default=None, help="Сохранить отчет в JSON")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    
+    mix = parse_mix(args.mix)
+    output = os.path.abspath(args.output) if args.output else None
+    
+    openrouter = FakeOpenRouterServer(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        response_chars=args.response_chars,
+        seed=args.seed
+    ).start()
+    telegram = FakeTelegramServer().start()
+    
+    driver = LoadDriver(
+        telegram,
+        users=args.users,
+        messages_per_user=args.messages,
+        concurrency=args.concurrency,
+        mix=mix,
+        think_time=args.think_time,
+        reply_timeout=args.reply_timeout,
+        ramp_up=args.ramp_up,
+        duration=args.duration,
+        seed=args.seed
+    )
+    telegram.on_reply = driver.on_reply
+    
+    # Бот не должен увидеть настоящие ключи и базу данных из .env
+    os.environ["TELEGRAM_TOKEN"] = "123456:LOAD-TEST"
+    os.environ["OPENROUTER_API_KEY"] = "load-test"
+    os.environ["OPENROUTER_BASE_URL"] = openrouter.base_url
+    os.environ["DB_BACKEND"] = "sqlite"
+    
+    temp_dir = None
+    workdir = args.workdir
+    if workdir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix="bot-load-test-")
+        workdir = temp_dir.name
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    
+    try:
+        db_before, db_after = asyncio.run(run_bot(args, telegram, driver))
+    finally:
+        telegram.stop()
+        openrouter.stop()
+    
+    load = driver.report()
+    report = {
+        "parameters": vars(args),
+        "load": load,
+        "openrouter": dict(openrouter.stats),
+        "bot_api_calls": dict(telegram.calls.most_common()),
+        "database": {
+            "bytes_before": db_before["bytes"],
+            "bytes_after": db_after["bytes"],
+            "bytes_per_reply": round((db_after["bytes"] - db_before["bytes"]) / load["replies"], 1) if load["replies"] else 0.0,
+            "rows_after": db_after["rows"]
+        }
+    }
+    
+    print_report(report)
+    
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Отчет сохранен в {output}")
+    
+    if temp_dir is not None:
+        os.chdir(REPO_ROOT)
+        temp_dir.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+Микробенчмарки горячих функций хранилища и utils.
+
+Каждый бенчмарк возвращает функцию без аргументов, которая вызывается
+несколькими раундами (как в pytest-benchmark: раунд из стольких вызовов, чтобы
+он длился не меньше --min-round-ms); в отчете min/median/mean/stddev/max и
+число операций в секунду. Функции database.py работают с синтетической базой
+SQLite заданного размера (--rows строк в messages, половина от этого - в
+usage_stats), которая строится один раз и переиспользуется из --data-dir.
+
+Результаты сохраняются как базовая линия в JSON (--save-baseline) и
+сравниваются с ней при следующих запусках: медиана, выросшая больше чем на
+--threshold, отмечается как регрессия, и команда завершается с кодом 1.
+
+Пример:
+    python -m benchmarks.microbench --rows 1000000 --save-baseline
+    python -m benchmarks.microbench --rows 1000000 --threshold 0.15
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import statistics
+from typing import Callable, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+BENCHMARK_DIR = os.path.join(REPO_ROOT, "benchmarks")
+
+WORDS = (
+    "привет", "модель", "ответ", "история", "запрос", "индекс", "база", "данных", "сообщение", "бот",
+    "python", "telegram", "query", "cache", "token", "latency", "model", "answer", "summary", "export"
+)
+MODELS = ("google/gemini-2.0-pro-exp-02-05:free", "anthropic/claude-3-haiku:free", "meta-llama/llama-3-70b-instruct:free")
+REQUEST_TYPES = ("chat", "chat", "chat", "image", "summary")
+
+BUILD_BATCH = 50000
+
+class BenchContext:
+    """Параметры синтетических данных, доступные бенчмаркам"""
+    
+    def __init__(self, rows: int, users: int, seed: int):
+        """Инициализация контекста"""
+        self.rows = rows
+        self.users = users
+        self.random = random.Random(seed)
+        # Пользователь из середины диапазона: его сообщения разбросаны по всей таблице
+        self.user_id = 1 + users // 2
+        # Отдельный пользователь для бенчмарков записи (его данные удаляются после запуска)
+        self.writer_id = users + 1
+        self.cleanup: List[Callable[[], None]] = []
+
+_benchmarks: Dict[str, Callable[[BenchContext], Callable[[], object]]] = {}
+
+def benchmark(name: str):
+    """Регистрация бенчмарка: функция получает контекст и возвращает измеряемый вызов"""
+    def decorator(func):
+        _benchmarks[name] = func
+        return func
+    return decorator
+
+@benchmark("database.get_chat_history")
+def bench_get_chat_history(ctx: BenchContext):
+    """Последние 10 сообщений пользователя (каждый запрос к модели)"""
+    from database import get_chat_history
+    return lambda: get_chat_history(ctx.user_id, 10)
+
+@benchmark("database.add_message")
+def bench_add_message(ctx: BenchContext):
+    """Добавление сообщения так, как его вызывают обработчики (через буфер записи)"""
+    from database import add_message, flush_writes, clear_chat_history
+    ctx.cleanup.append(lambda: clear_chat_history(ctx.writer_id))
+    ctx.cleanup.append(flush_writes)
+    return lambda: add_message(ctx.writer_id, "user", "Сообщение для бенчмарка записи")
+
+@benchmark("database.add_message_flushed")
+def bench_add_message_flushed(ctx: BenchContext):
+    """Добавление сообщения с немедленной записью на диск (полная стоимость вставки)"""
+    from database import add_message, flush_writes, clear_chat_history
+    ctx.cleanup.append(lambda: clear_chat_history(ctx.writer_id))
+    
+    def call():
+        add_message(ctx.writer_id, "user", "Сообщение для бенчмарка записи")
+        flush_writes()
+    
+    return call
+
+@benchmark("database.get_user_stats")
+def bench_get_user_stats(ctx: BenchContext):
+    """Статистика /stats"""
+    from database import get_user_stats
+    return lambda: get_user_stats(ctx.user_id)
+
+@benchmark("database.export_chat_history")
+def bench_export_chat_history(ctx: BenchContext):
+    """Экспорт всей истории пользователя в JSON"""
+    from database import export_chat_history
+    return lambda: export_chat_history(ctx.user_id, "json")
+
+@benchmark("database.get_pending_scheduled_messages")
+def bench_get_pending_scheduled_messages(ctx: BenchContext):
+    """Выборка планировщика (выполняется каждые несколько секунд)"""
+    from database import get_pending_scheduled_messages
+    return get_pending_scheduled_messages
+
+@benchmark("utils.rate_limit")
+def bench_rate_limit(ctx: BenchContext):
+    """Проверка частоты запросов по очереди для разных пользователей"""
+    from utils import rate_limit
+    
+    # Файл ограничений с записями для всех пользователей, как у работающего бота
+    now = time.time()
+    with open("rate_limits.json", "w") as f:
+        json.dump({f"{user_id}_message": [now - 30] for user_id in range(1, ctx.users + 1)}, f)
+    ctx.cleanup.append(lambda: os.remove("rate_limits.json"))
+    
+    user_ids = [ctx.random.randint(1, ctx.users) for _ in range(1000)]
+    position = [0]
+    
+    def call():
+        position[0] = (position[0] + 1) % len(user_ids)
+        return rate_limit(user_ids[position[0]], "message", limit_per_minute=10 ** 9)
+    
+    return call
+
+@benchmark("utils.estimate_tokens")
+def bench_estimate_tokens(ctx: BenchContext):
+    """Оценка токенов ответа длиной ~4000 символов"""
+    from utils import estimate_tokens
+    text = " ".join(ctx.random.choice(WORDS) for _ in range(500))[:4000]
+    return lambda: estimate_tokens(text)
+
+def _random_text(rng: random.Random) -> str:
+    """Случайный текст сообщения от 3 до 60 слов"""
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 60)))
+
+def build_database(rows: int, users: int, seed: int) -> None:
+    """
+    Заполнение синтетической базы в текущем каталоге
+    
+    Args:
+        rows: Строк в messages (в usage_stats - вдвое меньше, в scheduled_messages - 1%)
+        users: Число пользователей
+        seed: Начальное значение генератора случайных чисел
+    """
+    from database import init_db, rebuild_stats_rollups
+    from config import get_config
+    
+    config = get_config()
+    rng = random.Random(seed)
+    init_db()
+    
+    conn = sqlite3.connect(config.DB_PATH)
+    conn.execute("PRAGMA synchronous = OFF")
+    cursor = conn.cursor()
+    
+    now = int(time.time())
+    cursor.executemany(
+        "INSERT OR IGNORE INTO users (user_id, username, first_name, created_at, last_active) VALUES (?, ?, ?, ?, ?)",
+        [(user_id, f"user{user_id}", f"User{user_id}", now - 365 * 86400, now) for user_id in range(1, users + 1)]
+    )
+    
+    # Сообщения идут по времени, пользователи чередуются, как в настоящей базе
+    started = now - 365 * 86400
+    step = 365 * 86400 / max(rows, 1)
+    for offset in range(0, rows, BUILD_BATCH):
+        count = min(BUILD_BATCH, rows - offset)
+        messages = []
+        usage = []
+        for i in range(offset, offset + count):
+            user_id = rng.randint(1, users)
+            timestamp = int(started + i * step)
+            role = "user" if i % 2 == 0 else "assistant"
+            messages.append((user_id, role, _random_text(rng), timestamp, "text", None))
+            if role == "assistant":
+                usage.append((user_id, rng.choice(MODELS), rng.randint(50, 2000), rng.choice(REQUEST_TYPES), timestamp))
+        
+        cursor.executemany(
+            "INSERT INTO messages (user_id, role, content, timestamp, message_type, media_id) VALUES (?, ?, ?, ?, ?, ?)",
+            messages
+        )
+        cursor.executemany(
+            "INSERT INTO usage_stats (user_id, model, tokens_used, request_type, timestamp) VALUES (?, ?, ?, ?, ?)",
+            usage
+        )
+        conn.commit()
+        print(f"  сообщений: {offset + count}/{rows}", end="\r", flush=True)
+    
+    # Запланированные: большая часть уже отправлена, часть ждет отправки
+    scheduled = [
+        (rng.randint(1, users), _random_text(rng), now + rng.randint(-86400, 86400), int(rng.random() < 0.9), now)
+        for _ in range(max(rows // 100, 10))
+    ]
+    cursor.executemany(
+        "INSERT INTO scheduled_messages (user_id, content, scheduled_time, is_sent, created_at) VALUES (?, ?, ?, ?, ?)",
+        scheduled
+    )
+    conn.commit()
+    conn.close()
+    
+    print()
+    rebuild_stats_rollups()
+
+def run_benchmark(func: Callable[[], object], rounds: int, min_round_time: float, warmup_rounds: int = 1) -> Dict:
+    """
+    Измерение функции
+    
+    Returns:
+        Статистика времени одного вызова в секундах
+    """
+    # Калибровка: число вызовов в раунде, чтобы раунд длился не меньше min_round_time
+    iterations = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_round_time or iterations >= 100000:
+            break
+        iterations *= 10 if elapsed < min_round_time / 10 else 2
+    
+    for _ in range(warmup_rounds):
+        for _ in range(iterations):
+            func()
+    
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        timings.append((time.perf_counter() - started) / iterations)
+    
+    mean = statistics.fmean(timings)
+    return {
+        "min": min(timings),
+        "max": max(timings),
+        "mean": mean,
+        "median": statistics.median(timings),
+        "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "rounds": rounds,
+        "iterations": iterations,
+        "ops": 1.0 / mean if mean > 0 else 0.0
+    }
+
+def compare_with_baseline(results: Dict[str, Dict], baseline: Dict, threshold: float) -> Dict[str, Dict]:
+    """Сравнение медиан с базовой линией: {имя: {"ratio": ..., "regression": bool}}"""
+    comparison = {}
+    for name, stats in results.items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if not base or not base.get("median"):
+            continue
+        ratio = stats["median"] / base["median"]
+        comparison[name] = {"ratio": ratio, "regression": ratio > 1.0 + threshold}
+    return comparison
+
+def format_time(seconds: float) -> str:
+    """Время в удобных единицах"""
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.2f} µs"
+
+def print_results(results: Dict[str, Dict], comparison: Dict[str, Dict]) -> None:
+    """Таблица результатов"""
+    print(f"{'Бенчмарк':<42}{'min':>12}{'median':>12}{'mean':>12}{'stddev':>12}{'ops/s':>12}{'vs base':>10}")
+    for name, stats in results.items():
+        line = (f"{name:<42}{format_time(stats['min']):>12}{format_time(stats['median']):>12}"
+                f"{format_time(stats['mean']):>12}{format_time(stats['stddev']):>12}{stats['ops']:>12.1f}")
+        if name in comparison:
+            ratio = comparison[name]["ratio"]
+            line += f"{ratio:>9.2f}x"
+            if comparison[name]["regression"]:
+                line += "  РЕГРЕССИЯ"
+        print(line)
+
+def main():
+    """Запуск микробенчмарков из командной строки"""
+    parser = argparse.ArgumentParser(description="Микробенчмарки функций хранилища и utils")
+    parser.add_argument("--rows", type=int, default=10000, help="Строк в messages синтетической базы (10k - 10M)")
+    parser.add_argument("--users", type=int, default=None, help="Пользователей (по умолчанию rows / 1000)")
+    parser.add_argument("--filter", default=None, help="Запускать только бенчмарки, содержащие подстроку")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--min-round-ms", type=float, default=10.0, help="Минимальная длительность раунда")
+    parser.add_argument("--data-dir", default=os.path.join(BENCHMARK_DIR, "data"),
+                        help="Каталог синтетических баз (переиспользуются между запусками)")
+    parser.add_argument("--rebuild", action="store_true", help="Построить синтетическую базу заново")
+    parser.add_argument("--baseline", default=None,
+                        help="Файл базовой линии (по умолчанию benchmarks/baselines/microbench_<rows>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Сохранить результаты как базовую линию")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Допустимый рост медианы (0.2 = 20%%)")
+    parser.add_argument("--output", default=None, help="Сохранить результаты в JSON")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    
+    users = args.users or max(10, args.rows // 1000)
+    baseline_path = os.path.abspath(args.baseline or os.path.join(BENCHMARK_DIR, "baselines", f"microbench_{args.rows}.json"))
+    output = os.path.abspath(args.output) if args.output else None
+    
+    # База бенчмарка - bot_data.db в собственном каталоге; конфигурация читается при импорте database
+    workdir = os.path.join(os.path.abspath(args.data_dir), f"rows_{args.rows}_users_{users}")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    os.environ["DB_BACKEND"] = "sqlite"
+    
+    if args.rebuild:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists("bot_data.db" + suffix):
+                os.remove("bot_data.db" + suffix)
+    
+    if not os.path.exists("bot_data.db"):
+        print(f"Построение синтетической базы: {args.rows} сообщений, {users} пользователей")
+        started = time.perf_counter()
+        build_database(args.rows, users, args.seed)
+        print(f"База построена за {time.perf_counter() - started:.1f} с: {workdir}")
+    
+    ctx = BenchContext(args.rows, users, args.seed)
+    results = {}
+    try:
+        for name, factory in _benchmarks.items():
+            if args.filter and args.filter not in name:
+                continue
+            func = factory(ctx)
+            results[name] = run_benchmark(func, args.rounds, args.min_round_ms / 1000.0)
+    finally:
+        for cleanup in reversed(ctx.cleanup):
+            cleanup()
+    
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    
+    comparison = compare_with_baseline(results, baseline, args.threshold) if baseline else {}
+    print()
+    print_results(results, comparison)
+    
+    report = {
+        "rows": args.rows,
+        "users": users,
+        "created_at": int(time.time()),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "sqlite": sqlite3.sqlite_version
+        },
+        "benchmarks": results
+    }
+    
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(dict(report, comparison=comparison), f, ensure_ascii=False, indent=2)
+    
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        # Бенчмарки, не запускавшиеся в этот раз (--filter), остаются из прошлой линии
+        if baseline:
+            report["benchmarks"] = dict(baseline.get("benchmarks", {}), **results)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nБазовая линия сохранена в {baseline_path}")
+    elif baseline is None:
+        print(f"\nБазовой линии нет ({baseline_path}), сохраните ее с --save-baseline")
+    
+    regressions = [name for name, item in comparison.items() if item["regression"]]
+    if regressions and not args.save_baseline:
+        print(f"\nРегрессии больше {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
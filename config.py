@@ -1,7 +1,79 @@
 import os
 import json
+import logging
+import threading
+from functools import wraps
+from contextvars import ContextVar
+from types import MappingProxyType
+from typing import Dict, Optional
 from dotenv import load_dotenv
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+
+logger = logging.getLogger(__name__)
+
+USER_CONFIG_PATH = "user_config.json"
+
+# Значение настройки модели, при котором модель выбирается для каждого запроса
+AUTO_MODEL = "auto"
+
+# Значения по умолчанию для полей, которые можно переопределить в user_config.json
+DEFAULT_MODELS = (
+    "google/gemini-2.0-pro-exp-02-05:free",
+    "anthropic/claude-3-haiku:free",
+    "anthropic/claude-3-opus:free",
+    "anthropic/claude-3-sonnet:free",
+    "meta-llama/llama-3-70b-instruct:free",
+    "mistralai/mistral-large:free"
+)
+
+DEFAULT_CONVERSATION_MODES = {
+    "creative": {
+        "description": "Творческий режим для генерации идей",
+        "system_prompt": "Ты креативный ассистент. Предлагай необычные и оригинальные идеи.",
+        "temperature": 0.9,
+        "latency_target_ms": 8000
+    },
+    "analytical": {
+        "description": "Аналитический режим для решения задач",
+        "system_prompt": "Ты аналитический ассистент. Анализируй информацию глубоко и точно.",
+        "temperature": 0.2,
+        "latency_target_ms": 15000
+    },
+    "concise": {
+        "description": "Лаконичный режим для кратких ответов",
+        "system_prompt": "Ты лаконичный ассистент. Отвечай кратко и по существу.",
+        "temperature": 0.5,
+        "latency_target_ms": 3000
+    },
+    "friendly": {
+        "description": "Дружелюбный режим для неформального общения",
+        "system_prompt": "Ты дружелюбный ассистент. Общаешься в неформальном тоне, используешь эмодзи.",
+        "temperature": 0.8,
+        "latency_target_ms": 5000
+    },
+    "expert": {
+        "description": "Экспертный режим для глубоких знаний",
+        "system_prompt": "Ты эксперт. Предоставляешь подробные и глубокие объяснения.",
+        "temperature": 0.3,
+        "latency_target_ms": 30000
+    }
+}
+
+DEFAULT_TEMPLATES = {
+    "summary": "Кратко изложи основные моменты следующего текста: {text}",
+    "explain": "Объясни простыми словами: {text}",
+    "code_review": "Проанализируй этот код и предложи улучшения: {text}",
+    "translate_en": "Переведи на английский: {text}",
+    "translate_ru": "Переведи на русский: {text}",
+    "brainstorm": "Предложи 5 идей на тему: {text}"
+}
+
+# Лимиты токенов по тарифам (0 - без ограничения)
+DEFAULT_QUOTA_TIERS = {
+    "standard": {"daily": 200000, "monthly": 3000000},
+    "premium": {"daily": 1000000, "monthly": 20000000},
+    "unlimited": {"daily": 0, "monthly": 0}
+}
 
 @dataclass
 class Config:
@@ -11,6 +83,128 @@ class Config:
     DEFAULT_TEMP: float = 0.7
     DEFAULT_MAX_TOKENS: int = 1000
     DB_PATH: str = "bot_data.db"
+    OPENROUTER_BASE_URL: str = "https://openrouter.ai/api/v1"
+    
+    # Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics
+    METRICS_ENABLED: bool = False
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 9100
+    
+    # Администраторы бота (ADMIN_USER_IDS в окружении, через запятую)
+    ADMIN_USER_IDS: list = None
+    
+    # Профилирование: /profile и SIGUSR1 пишут свернутые стеки в PROFILER_DIR
+    PROFILER_DIR: str = "logs"
+    PROFILER_SAMPLE_MS: float = 5.0
+    PROFILER_SIGNAL_SECONDS: int = 30
+    PROFILER_MAX_SECONDS: int = 300
+    
+    # Временная шкала обновлений, обрабатывавшихся дольше порога (PROFILER_DIR/slow_updates)
+    SLOW_UPDATE_ENABLED: bool = True
+    SLOW_UPDATE_THRESHOLD_MS: int = 10000
+    SLOW_UPDATE_SAMPLE_MS: int = 200
+    
+    # Трассировка обновлений (спаны обработчика, хранилища, OpenRouter и Bot API)
+    TRACING_ENABLED: bool = False
+    TRACING_SAMPLE_RATE: float = 0.1          # Доля обновлений, для которых пишется трасса
+    TRACING_EXPORTER: str = "file"            # "file" (JSON Lines в формате OTLP) или "otlp" (OTLP/HTTP)
+    TRACING_FILE: str = "logs/traces.jsonl"
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+    TRACING_SERVICE_NAME: str = "telegram-ai-bot"
+    TRACING_BATCH_SIZE: int = 512
+    TRACING_FLUSH_INTERVAL: float = 5.0       # Секунд между выгрузками спанов
+    
+    # Очередь исходящих запросов к Telegram (лимиты Bot API)
+    OUTBOUND_QUEUE_ENABLED: bool = True
+    OUTBOUND_GLOBAL_RATE: float = 30.0        # Сообщений в секунду на бота
+    OUTBOUND_CHAT_RATE: float = 1.0           # Сообщений в секунду в личный чат
+    OUTBOUND_CHAT_BURST: int = 3
+    OUTBOUND_GROUP_RATE_PER_MIN: float = 20.0 # Сообщений в минуту в группу
+    OUTBOUND_MAX_RETRIES: int = 3             # Повторов после RetryAfter
+    
+    # Доставка длинных ответов
+    RESPONSE_CHUNK_SIZE: int = 4000           # Не больше лимита Telegram в 4096 символов
+    RESPONSE_PAGINATION_ENABLED: bool = True
+    RESPONSE_PAGINATE_AFTER: int = 3          # Ответ из большего числа частей показывается постранично
+    RESPONSE_PAGES_CACHE_SIZE: int = 1000
+    RESPONSE_PAGES_TTL_HOURS: int = 24
+    
+    # Резюме дополняется окнами: сообщений в окне и окон за один вызов /summary
+    SUMMARY_MAX_NEW_MESSAGES: int = 50
+    SUMMARY_MAX_WINDOWS: int = 5
+    
+    # Разметка cache_control для кеширования префикса промпта (Anthropic, Gemini)
+    PROMPT_CACHE_ENABLED: bool = True
+    
+    # Бэкенд хранилища: "sqlite" (по умолчанию) или "postgres"
+    DB_BACKEND: str = "sqlite"
+    DATABASE_URL: str = None
+    DB_POOL_MIN_SIZE: int = 1
+    DB_POOL_MAX_SIZE: int = 10
+    
+    # Отложенная пакетная запись сообщений и статистики
+    WRITE_BUFFER_ENABLED: bool = True
+    WRITE_BUFFER_FLUSH_MS: int = 200
+    WRITE_BUFFER_MAX_ROWS: int = 100
+    WRITE_BUFFER_MAX_PENDING: int = 10000     # Дальше вставки пишутся синхронно
+    WRITE_BUFFER_JOURNAL: bool = True         # Журнал очереди на диске (<DB_PATH>.buffer)
+    
+    # Политики хранения данных (0 - без ограничения)
+    RETENTION_ENABLED: bool = True
+    RETENTION_INTERVAL_HOURS: int = 24
+    RETENTION_KEEP_MESSAGES: int = 2000
+    RETENTION_USAGE_DAYS: int = 180
+    RETENTION_MEDIA_DIR: str = "user_images"
+    RETENTION_BATCH_SIZE: int = 500
+    RETENTION_BATCH_PAUSE_MS: int = 50
+    
+    # Групповые чаты: ответ только на упоминание бота или ответ на его сообщение
+    GROUP_MODE_ENABLED: bool = True
+    GROUP_HISTORY_LIMIT: int = 10             # Сообщений общей истории чата в запросе
+    GROUP_BUFFER_SIZE: int = 50               # Последних сообщений чата в памяти
+    GROUP_BUFFER_MAX_CHATS: int = 1000        # Чатов (тем) в памяти
+    GROUP_CONTEXT_MESSAGES: int = 20          # Сообщений из буфера в запросе
+    GROUP_MESSAGE_MAX_CHARS: int = 500        # Длина сообщения в буфере
+    
+    # Резервное копирование базы данных
+    BACKUP_ENABLED: bool = True
+    BACKUP_DIR: str = "backups"
+    BACKUP_INTERVAL_HOURS: int = 6
+    BACKUP_KEEP: int = 7
+    BACKUP_FULL_EVERY: int = 4                # Каждая N-я копия полная, остальные - только изменения
+    
+    # Долговременная память (поиск по прошлым разговорам)
+    MEMORY_ENABLED: bool = False
+    MEMORY_DIR: str = "memory"
+    MEMORY_MODEL: str = None        # Модель sentence-transformers; без нее - векторизация хешированием
+    MEMORY_HASH_DIM: int = 512
+    MEMORY_MAX_ITEMS: int = 2000    # Фрагментов на пользователя
+    MEMORY_CACHE_USERS: int = 200   # Индексов, одновременно загруженных в память
+    MEMORY_TOP_K: int = 3
+    MEMORY_MIN_SCORE: float = 0.25
+    MEMORY_SKIP_RECENT: int = 5     # Последние пары реплик и так попадают в историю чата
+    
+    # Каталог моделей OpenRouter (/models): длина контекста, модальности, цены
+    MODEL_REGISTRY_ENABLED: bool = True
+    MODEL_REGISTRY_CACHE_FILE: str = "cache/openrouter_models.json"
+    MODEL_REGISTRY_TTL_HOURS: float = 6
+    MODEL_REGISTRY_FIXTURE: str = None        # Файл ответа /models вместо запроса к OpenRouter
+    
+    # Автовыбор модели (настройка модели "auto"), см. model_router.py
+    AUTO_SMALL_MESSAGE_TOKENS: int = 30       # Реплика не длиннее - дешевая быстрая модель
+    AUTO_LARGE_PROMPT_TOKENS: int = 24000     # Запрос длиннее - модель с большим контекстом
+    AUTO_RESERVED_CONTEXT: int = 500000       # Модели с таким контекстом - только для больших запросов
+    
+    # Квоты токенов по пользователям (тарифы и назначения - в user_config.json)
+    QUOTA_ENABLED: bool = True
+    QUOTA_DEFAULT_TIER: str = "standard"
+    QUOTA_RECONCILE_SECONDS: int = 300        # Сверка счетчиков с usage_stats
+    QUOTA_TIERS: dict = None
+    QUOTA_USER_TIERS: dict = None             # ID пользователя -> тариф
+    
+    # Перечитывание user_config.json без перезапуска
+    CONFIG_WATCH_ENABLED: bool = True
+    CONFIG_WATCH_INTERVAL: float = 5.0        # Секунд между проверками файла
     
     # Конфигурация для дополнительных функций
     AVAILABLE_MODELS: list = None
@@ -18,79 +212,335 @@ class Config:
     TEMPLATES: dict = None
     
     def __post_init__(self):
-        self.AVAILABLE_MODELS = [
-            "google/gemini-2.0-pro-exp-02-05:free",
-            "anthropic/claude-3-haiku:free",
-            "anthropic/claude-3-opus:free",
-            "anthropic/claude-3-sonnet:free",
-            "meta-llama/llama-3-70b-instruct:free",
-            "mistralai/mistral-large:free"
-        ]
-        
-        self.CONVERSATION_MODES = {
-            "creative": {
-                "description": "Творческий режим для генерации идей",
-                "system_prompt": "Ты креативный ассистент. Предлагай необычные и оригинальные идеи.",
-                "temperature": 0.9
-            },
-            "analytical": {
-                "description": "Аналитический режим для решения задач",
-                "system_prompt": "Ты аналитический ассистент. Анализируй информацию глубоко и точно.",
-                "temperature": 0.2
-            },
-            "concise": {
-                "description": "Лаконичный режим для кратких ответов",
-                "system_prompt": "Ты лаконичный ассистент. Отвечай кратко и по существу.",
-                "temperature": 0.5
-            },
-            "friendly": {
-                "description": "Дружелюбный режим для неформального общения",
-                "system_prompt": "Ты дружелюбный ассистент. Общаешься в неформальном тоне, используешь эмодзи.",
-                "temperature": 0.8
-            },
-            "expert": {
-                "description": "Экспертный режим для глубоких знаний",
-                "system_prompt": "Ты эксперт. Предоставляешь подробные и глубокие объяснения.",
-                "temperature": 0.3
-            }
-        }
-        
-        self.TEMPLATES = {
-            "summary": "Кратко изложи основные моменты следующего текста: {text}",
-            "explain": "Объясни простыми словами: {text}",
-            "code_review": "Проанализируй этот код и предложи улучшения: {text}",
-            "translate_en": "Переведи на английский: {text}",
-            "translate_ru": "Переведи на русский: {text}",
-            "brainstorm": "Предложи 5 идей на тему: {text}"
-        }
+        if self.AVAILABLE_MODELS is None:
+            self.AVAILABLE_MODELS = list(DEFAULT_MODELS)
+        if self.CONVERSATION_MODES is None:
+            self.CONVERSATION_MODES = {name: dict(mode) for name, mode in DEFAULT_CONVERSATION_MODES.items()}
+        if self.TEMPLATES is None:
+            self.TEMPLATES = dict(DEFAULT_TEMPLATES)
+        if self.QUOTA_TIERS is None:
+            self.QUOTA_TIERS = {name: dict(limits) for name, limits in DEFAULT_QUOTA_TIERS.items()}
+        if self.QUOTA_USER_TIERS is None:
+            self.QUOTA_USER_TIERS = {}
+
+# Поля из user_config.json, которые применяются без перезапуска
+RELOADABLE_FIELDS = (
+    "DEFAULT_MODEL", "DEFAULT_TEMP", "DEFAULT_MAX_TOKENS",
+    "AVAILABLE_MODELS", "CONVERSATION_MODES", "TEMPLATES",
+    "QUOTA_DEFAULT_TIER", "QUOTA_TIERS", "QUOTA_USER_TIERS"
+)
+
+_config: Optional[Config] = None
+_config_lock = threading.Lock()
+_request_config: ContextVar[Optional[Config]] = ContextVar("request_config", default=None)
+
+def read_user_config(path: str = USER_CONFIG_PATH) -> Dict:
+    """Содержимое user_config.json (пустой словарь, если файла нет)"""
+    if not os.path.exists(path):
+        return {}
+    
+    with open(path, "r", encoding="utf-8") as f:
+        user_config = json.load(f)
+    
+    if not isinstance(user_config, dict):
+        raise ValueError(f"{path}: ожидается JSON-объект")
+    
+    return user_config
+
+def apply_user_config(config: Config, user_config: Dict) -> None:
+    """Применение пользовательских настроек к конфигурации"""
+    if "DEFAULT_MODEL" in user_config:
+        config.DEFAULT_MODEL = user_config["DEFAULT_MODEL"]
+    if "DEFAULT_TEMP" in user_config:
+        config.DEFAULT_TEMP = user_config["DEFAULT_TEMP"]
+    if "DEFAULT_MAX_TOKENS" in user_config:
+        config.DEFAULT_MAX_TOKENS = user_config["DEFAULT_MAX_TOKENS"]
+    
+    # Список моделей заменяется целиком
+    if "AVAILABLE_MODELS" in user_config:
+        config.AVAILABLE_MODELS = list(user_config["AVAILABLE_MODELS"])
+    
+    # Режимы и шаблоны дополняют встроенные (одноименные переопределяются)
+    if "CONVERSATION_MODES" in user_config:
+        for name, mode in user_config["CONVERSATION_MODES"].items():
+            config.CONVERSATION_MODES[name] = dict(config.CONVERSATION_MODES.get(name, {}), **mode)
+    if "TEMPLATES" in user_config:
+        config.TEMPLATES.update(user_config["TEMPLATES"])
+    
+    # Тарифы дополняют встроенные, назначения тарифов заменяются целиком
+    if "QUOTA_DEFAULT_TIER" in user_config:
+        config.QUOTA_DEFAULT_TIER = user_config["QUOTA_DEFAULT_TIER"]
+    if "QUOTA_TIERS" in user_config:
+        for name, limits in user_config["QUOTA_TIERS"].items():
+            config.QUOTA_TIERS[name] = dict(config.QUOTA_TIERS.get(name, {}), **limits)
+    if "QUOTA_USER_TIERS" in user_config:
+        # Ключи JSON-объекта - строки
+        config.QUOTA_USER_TIERS = {int(user_id): tier for user_id, tier in user_config["QUOTA_USER_TIERS"].items()}
+
+def validate_config(config: Config) -> None:
+    """
+    Проверка настраиваемых полей конфигурации
+    
+    Raises:
+        ValueError: Со списком всех найденных ошибок
+    """
+    errors = []
+    
+    models = config.AVAILABLE_MODELS
+    if not models or not all(isinstance(model, str) and model for model in models):
+        errors.append("AVAILABLE_MODELS должен быть непустым списком идентификаторов моделей")
+    elif config.DEFAULT_MODEL != AUTO_MODEL and config.DEFAULT_MODEL not in models:
+        errors.append(f"DEFAULT_MODEL {config.DEFAULT_MODEL!r} отсутствует в AVAILABLE_MODELS")
+    
+    if not isinstance(config.DEFAULT_TEMP, (int, float)) or not 0 <= config.DEFAULT_TEMP <= 2:
+        errors.append("DEFAULT_TEMP должен быть числом от 0 до 2")
+    if not isinstance(config.DEFAULT_MAX_TOKENS, int) or config.DEFAULT_MAX_TOKENS <= 0:
+        errors.append("DEFAULT_MAX_TOKENS должен быть положительным целым числом")
+    
+    if not config.CONVERSATION_MODES:
+        errors.append("CONVERSATION_MODES не может быть пустым")
+    for name, mode in (config.CONVERSATION_MODES or {}).items():
+        if not isinstance(mode, dict):
+            errors.append(f"Режим {name!r}: ожидается объект")
+            continue
+        for key in ("description", "system_prompt"):
+            if not isinstance(mode.get(key), str) or not mode.get(key):
+                errors.append(f"Режим {name!r}: не задано поле {key}")
+        temperature = mode.get("temperature")
+        if not isinstance(temperature, (int, float)) or not 0 <= temperature <= 2:
+            errors.append(f"Режим {name!r}: temperature должна быть числом от 0 до 2")
+        latency_target = mode.get("latency_target_ms")
+        if latency_target is not None and (not isinstance(latency_target, (int, float)) or latency_target <= 0):
+            errors.append(f"Режим {name!r}: latency_target_ms должна быть положительным числом")
+    
+    for name, template in (config.TEMPLATES or {}).items():
+        if not isinstance(template, str) or "{text}" not in template:
+            errors.append(f"Шаблон {name!r} должен быть строкой с подстановкой {{text}}")
+    
+    for name, limits in (config.QUOTA_TIERS or {}).items():
+        for period in ("daily", "monthly"):
+            value = limits.get(period) if isinstance(limits, dict) else None
+            if not isinstance(value, int) or value < 0:
+                errors.append(f"Тариф {name!r}: {period} должен быть неотрицательным целым числом")
+    if config.QUOTA_DEFAULT_TIER not in (config.QUOTA_TIERS or {}):
+        errors.append(f"QUOTA_DEFAULT_TIER {config.QUOTA_DEFAULT_TIER!r} отсутствует в QUOTA_TIERS")
+    for user_id, tier in (config.QUOTA_USER_TIERS or {}).items():
+        if tier not in (config.QUOTA_TIERS or {}):
+            errors.append(f"Пользователю {user_id} назначен неизвестный тариф {tier!r}")
+    
+    if errors:
+        raise ValueError("; ".join(errors))
+
+def _freeze(config: Config) -> Config:
+    """Неизменяемые коллекции в снимке: запросы не могут случайно изменить общую конфигурацию"""
+    config.AVAILABLE_MODELS = tuple(config.AVAILABLE_MODELS)
+    config.CONVERSATION_MODES = MappingProxyType({
+        name: MappingProxyType(dict(mode)) for name, mode in config.CONVERSATION_MODES.items()
+    })
+    config.TEMPLATES = MappingProxyType(dict(config.TEMPLATES))
+    config.QUOTA_TIERS = MappingProxyType({
+        name: MappingProxyType(dict(limits)) for name, limits in config.QUOTA_TIERS.items()
+    })
+    config.QUOTA_USER_TIERS = MappingProxyType(dict(config.QUOTA_USER_TIERS))
+    return config
 
 def load_config():
-    """Загрузка конфигурации из переменных окружения и файлов"""
+    """
+    Загрузка конфигурации из переменных окружения и файлов
+    
+    Каждый вызов заново читает .env и user_config.json; модулям бота нужен
+    общий экземпляр из get_config(). Ошибочный user_config.json не мешает
+    запуску: как и при перечитывании, он отклоняется с записью в лог, а
+    его поля получают встроенные значения.
+    """
     load_dotenv()
     
     config = Config(
         TELEGRAM_TOKEN=os.getenv("TELEGRAM_TOKEN"),
-        OPENROUTER_API_KEY=os.getenv("OPENROUTER_API_KEY")
+        OPENROUTER_API_KEY=os.getenv("OPENROUTER_API_KEY"),
+        OPENROUTER_BASE_URL=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+        DB_BACKEND=os.getenv("DB_BACKEND", "sqlite"),
+        DATABASE_URL=os.getenv("DATABASE_URL"),
+        MODEL_REGISTRY_FIXTURE=os.getenv("MODEL_REGISTRY_FIXTURE"),
+        ADMIN_USER_IDS=[int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()]
     )
     
     # Загрузка пользовательских настроек из файла если он существует
-    user_config_path = "user_config.json"
-    if os.path.exists(user_config_path):
-        with open(user_config_path, "r", encoding="utf-8") as f:
-            user_config = json.load(f)
-            
-            if "DEFAULT_MODEL" in user_config:
-                config.DEFAULT_MODEL = user_config["DEFAULT_MODEL"]
-            if "DEFAULT_TEMP" in user_config:
-                config.DEFAULT_TEMP = user_config["DEFAULT_TEMP"]
-            if "DEFAULT_MAX_TOKENS" in user_config:
-                config.DEFAULT_MAX_TOKENS = user_config["DEFAULT_MAX_TOKENS"]
-                
-            # Загрузка пользовательских шаблонов
-            if "TEMPLATES" in user_config:
-                config.TEMPLATES.update(user_config["TEMPLATES"])
+    settings = Config(TELEGRAM_TOKEN=config.TELEGRAM_TOKEN, OPENROUTER_API_KEY=config.OPENROUTER_API_KEY)
+    try:
+        apply_user_config(settings, read_user_config())
+        validate_config(settings)
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Настройки из {USER_CONFIG_PATH} отклонены, используются встроенные: {e}")
+        return config
     
-    return config
+    return replace(config, **{name: getattr(settings, name) for name in RELOADABLE_FIELDS})
+
+class _ConfigProxy:
+    """
+    Общая конфигурация для модулей бота
+    
+    Атрибуты читаются из снимка, закрепленного за текущим запросом
+    (with_config_snapshot), а вне запроса - из последнего загруженного.
+    """
+    __slots__ = ()
+    
+    def __getattr__(self, name):
+        return getattr(current_config(), name)
+    
+    def __setattr__(self, name, value):
+        setattr(current_config(), name, value)
+    
+    def __repr__(self):
+        return repr(current_config())
+
+_proxy = _ConfigProxy()
+
+def init_config(reload: bool = False) -> _ConfigProxy:
+    """
+    Явная инициализация общей конфигурации (один раз при запуске)
+    
+    Args:
+        reload: Перечитать окружение и файлы, даже если конфигурация уже загружена
+    """
+    global _config
+    with _config_lock:
+        if _config is None or reload:
+            _config = _freeze(load_config())
+    return _proxy
+
+def get_config() -> _ConfigProxy:
+    """Общий экземпляр конфигурации (загружается при первом обращении к атрибуту)"""
+    return _proxy
+
+def current_config() -> Config:
+    """Снимок конфигурации текущего запроса или последний загруженный"""
+    config = _request_config.get()
+    if config is not None:
+        return config
+    if _config is None:
+        init_config()
+    return _config
+
+def with_config_snapshot(func):
+    """Декоратор обработчика: весь запрос работает с одним снимком конфигурации"""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _request_config.set(current_config())
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _request_config.reset(token)
+    
+    return wrapper
+
+def reload_config(path: str = USER_CONFIG_PATH) -> bool:
+    """
+    Перечитать user_config.json и атомарно заменить снимок конфигурации
+    
+    Применяются только RELOADABLE_FIELDS; остальные настройки и изменения,
+    сделанные во время работы, переносятся из текущего снимка. Запросы, уже
+    начатые со старым снимком, завершаются с ним.
+    
+    Returns:
+        True, если новая конфигурация применена
+    """
+    global _config
+    if _config is None:
+        init_config()
+    
+    # Переменные окружения не перечитываются: новые значения берутся только из файла
+    fresh = Config(TELEGRAM_TOKEN=_config.TELEGRAM_TOKEN, OPENROUTER_API_KEY=_config.OPENROUTER_API_KEY)
+    try:
+        apply_user_config(fresh, read_user_config(path))
+        validate_config(fresh)
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Новая конфигурация из {path} отклонена, используется прежняя: {e}")
+        return False
+    
+    changes = {name: getattr(fresh, name) for name in RELOADABLE_FIELDS}
+    with _config_lock:
+        changed = [name for name, value in changes.items() if value != _unfrozen(getattr(_config, name))]
+        _config = _freeze(replace(_config, **changes))
+    
+    if changed:
+        logger.info(f"Конфигурация перечитана из {path}, изменены: {', '.join(changed)}")
+    return True
+
+def _unfrozen(value):
+    """Обычные коллекции вместо неизменяемых (для сравнения снимков)"""
+    if isinstance(value, tuple):
+        return list(value)
+    if isinstance(value, MappingProxyType):
+        return {key: _unfrozen(item) for key, item in value.items()}
+    return value
+
+class ConfigWatcher:
+    """Отслеживание изменений user_config.json в фоновом потоке"""
+    
+    def __init__(self, path: str = USER_CONFIG_PATH, check_interval: float = None):
+        """Инициализация наблюдателя"""
+        self.path = path
+        self.check_interval = check_interval or current_config().CONFIG_WATCH_INTERVAL
+        self.is_running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+        self._signature = self._file_signature()
+    
+    def _file_signature(self):
+        """Время изменения и размер файла (None, если файла нет)"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    def start(self):
+        """Запуск наблюдения"""
+        if self.is_running:
+            logger.warning("Наблюдение за конфигурацией уже запущено")
+            return
+        
+        self.is_running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="config-watcher")
+        self.thread.daemon = True
+        self.thread.start()
+        
+        logger.info(f"Наблюдение за {self.path} запущено")
+    
+    def stop(self):
+        """Остановка наблюдения"""
+        if not self.is_running:
+            return
+        
+        self.is_running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5.0)
+    
+    def check(self) -> bool:
+        """Перечитать конфигурацию, если файл изменился; True - если применена новая"""
+        signature = self._file_signature()
+        if signature == self._signature:
+            return False
+        
+        self._signature = signature
+        return reload_config(self.path)
+    
+    def _run(self):
+        """Основной цикл наблюдения"""
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Ошибка при проверке конфигурации: {e}")
+
+def __getattr__(name):
+    """Поддержка `from config import config` без загрузки при импорте модуля"""
+    if name == "config":
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def save_user_config(updated_config):
     """Сохранение пользовательских настроек в файл"""
@@ -98,8 +548,10 @@ def save_user_config(updated_config):
         "DEFAULT_MODEL": updated_config.DEFAULT_MODEL,
         "DEFAULT_TEMP": updated_config.DEFAULT_TEMP,
         "DEFAULT_MAX_TOKENS": updated_config.DEFAULT_MAX_TOKENS,
-        "TEMPLATES": updated_config.TEMPLATES
+        "AVAILABLE_MODELS": list(updated_config.AVAILABLE_MODELS),
+        "CONVERSATION_MODES": {name: dict(mode) for name, mode in updated_config.CONVERSATION_MODES.items()},
+        "TEMPLATES": dict(updated_config.TEMPLATES)
     }
     
-    with open("user_config.json", "w", encoding="utf-8") as f:
+    with open(USER_CONFIG_PATH, "w", encoding="utf-8") as f:
         json.dump(user_config, f, ensure_ascii=False, indent=2)
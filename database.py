@@ -1,17 +1,444 @@
+import os
 import sqlite3
 import json
 import time
-from config import load_config
+import io
+import csv
+import atexit
+import inspect
+import logging
+import threading
+from config import get_config
+from metrics import timed, DB_DURATION
+from tracing import traced
+from storage import (
+    Storage, SETTINGS_COLUMNS, USAGE_COLUMNS, default_settings, settings_from_row, split_settings, search_terms, weekday,
+    format_chat_history, format_prompt_cache_stats
+)
 from datetime import datetime
-from typing import List, Dict, Optional, Any, Tuple
+from typing import List, Dict, Optional, Any, Tuple, Iterator
 
-config = load_config()
+logger = logging.getLogger(__name__)
+config = get_config()
+
+# Неудачных попыток записи пакета, после которых строки пишутся по одной
+MAX_BATCH_ATTEMPTS = 3
+
+# Журнал отложенной записи лежит рядом с базой: <DB_PATH>.buffer
+JOURNAL_SUFFIX = ".buffer"
+
+# Размер журнала, после которого он переписывается без уже записанных строк
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+
+class WriteBehindBuffer:
+    """
+    Буфер отложенной записи для вставок в messages и usage_stats.
+    
+    Вставки накапливаются в памяти и записываются одной транзакцией каждые
+    flush_ms миллисекунд или при накоплении max_rows строк. Пакет либо
+    фиксируется целиком, либо остается в буфере и повторяется при следующем
+    сбросе; после MAX_BATCH_ATTEMPTS неудач строки пишутся по одной, и строки
+    с ошибкой пропускаются с записью в лог. Строки не отбрасываются: когда в
+    очереди max_pending строк (база не успевает или недоступна), вставка
+    сама записывает очередь синхронно, как без буфера.
+    
+    Каждая строка перед постановкой в очередь дописывается в журнал
+    journal_path, а перед записью пакета журнал сбрасывается на диск (fsync).
+    Строки нумеруются по порядку, и номер последней записанной фиксируется в
+    той же транзакции, что и пакет, поэтому recover() после аварийного
+    завершения процесса дописывает из журнала ровно незаписанные строки. При
+    отключении питания могут потеряться строки последнего окна сброса.
+    """
+    
+    def __init__(self, db_path: str, flush_ms: int = 200, max_rows: int = 100, max_pending: int = 10000,
+                 journal_path: Optional[str] = None):
+        """Инициализация буфера (journal_path=None - без журнала)"""
+        self.db_path = db_path
+        self.journal_path = journal_path
+        self.flush_interval = flush_ms / 1000.0
+        self.max_rows = max_rows
+        self.max_pending = max_pending
+        self._failed_attempts = 0
+        
+        # Строки очереди: (вид, параметры, время постановки, номер)
+        self._pending: List[Tuple[str, tuple, float, int]] = []
+        self._seq = 0
+        self._journal_fd: Optional[int] = None
+        self._recovered = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._conn = None
+        self._thread = None
+        self._is_running = False
+        
+        self._metrics = {
+            "rows_written": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "dropped_rows": 0,
+            "sync_flushes": 0,
+            "recovered_rows": 0,
+            "max_batch_size": 0,
+            "total_commit_ms": 0.0,
+            "total_latency_ms": 0.0,
+            "max_latency_ms": 0.0
+        }
+    
+    def start(self):
+        """Запуск фонового потока записи"""
+        if self._is_running:
+            return
+        
+        self._is_running = True
+        self._thread = threading.Thread(target=self._run, name="db-write-behind")
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def stop(self):
+        """Остановка фонового потока со сбросом оставшихся записей"""
+        if self._is_running:
+            self._is_running = False
+            self._wakeup.set()
+            if self._thread:
+                self._thread.join(timeout=5.0)
+        
+        self.flush()
+        
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        
+        with self._lock:
+            if self._journal_fd is not None:
+                os.close(self._journal_fd)
+                self._journal_fd = None
+            self._recovered = False
+    
+    def recover(self) -> int:
+        """
+        Открытие журнала и запись строк, оставшихся в нем после аварийного завершения
+        
+        Вызывается из init_db, а если не был вызван - при первой вставке.
+        
+        Returns:
+            Число восстановленных строк
+        """
+        with self._lock:
+            if self._recovered:
+                return 0
+            self._recovered = True
+            
+            if self.journal_path is None:
+                return 0
+            
+            last_seq = self._last_written_seq()
+            rows = [
+                (kind, params, time.monotonic(), seq)
+                for seq, kind, params in self._read_journal()
+                if seq > last_seq
+            ]
+            self._seq = max([last_seq] + [seq for _, _, _, seq in rows])
+            self._pending = rows + self._pending
+            
+            try:
+                self._journal_fd = self._open_journal()
+            except OSError as e:
+                logger.error(f"Журнал отложенной записи {self.journal_path} недоступен, строки не защищены от сбоев: {e}")
+        
+        if rows:
+            self._metrics["recovered_rows"] += len(rows)
+            logger.warning(f"Из журнала отложенной записи восстановлено строк: {len(rows)}")
+            self.flush()
+        return len(rows)
+    
+    def submit(self, kind: str, params: tuple) -> None:
+        """Поставить вставку в очередь"""
+        if not self._recovered:
+            self.recover()
+        
+        with self._lock:
+            self._seq += 1
+            row = (kind, params, time.monotonic(), self._seq)
+            self._append_to_journal(row)
+            self._pending.append(row)
+            pending_count = len(self._pending)
+        
+        if not self._is_running:
+            self.start()
+        
+        if pending_count >= self.max_pending:
+            # Очередь заполнена - запись становится синхронной, пока база не догонит
+            self._metrics["sync_flushes"] += 1
+            self.flush()
+        elif pending_count >= self.max_rows:
+            self._wakeup.set()
+    
+    def has_pending(self) -> bool:
+        """Есть ли незаписанные строки"""
+        return bool(self._pending)
+    
+    def flush(self) -> int:
+        """Синхронно записать все накопленные строки, возвращает размер пакета"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            
+            if not batch:
+                return 0
+            
+            # Пакет сохраняется на диске до попытки записи в базу
+            self._sync_journal()
+            
+            started = time.monotonic()
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                self._metrics["failed_batches"] += 1
+                self._failed_attempts += 1
+                logger.error(f"Ошибка при пакетной записи в базу данных ({len(batch)} строк): {e}")
+                
+                processed = False
+                if self._failed_attempts >= MAX_BATCH_ATTEMPTS:
+                    # Пакет не записывается целиком - ищем строки, из-за которых он откатывается
+                    self._failed_attempts = 0
+                    remaining = self._write_rows_individually(batch)
+                    processed = len(remaining) < len(batch)
+                    batch = remaining
+                
+                # Оставшиеся строки возвращаются в начало очереди для повторной попытки
+                with self._lock:
+                    self._pending = batch + self._pending
+                    if processed:
+                        self._compact_journal()
+                return 0
+            
+            self._failed_attempts = 0
+            finished = time.monotonic()
+            self._record_metrics(batch, started, finished)
+            
+            with self._lock:
+                self._compact_journal()
+            return len(batch)
+    
+    def _write_rows_individually(self, batch: List[Tuple[str, tuple, float, int]]) -> List[Tuple[str, tuple, float, int]]:
+        """
+        Запись пакета по одной строке; строки с ошибкой пропускаются
+        
+        Returns:
+            Строки, не записанные из-за недоступности базы (блокировка, диск)
+        """
+        started = time.monotonic()
+        written = []
+        
+        for i, row in enumerate(batch):
+            try:
+                self._write_batch([row])
+            except sqlite3.OperationalError as e:
+                # Ошибка базы, а не строки - остаток пакета повторяется позже
+                logger.error(f"База данных недоступна для записи: {e}")
+                batch = batch[i:]
+                break
+            except Exception as e:
+                kind, params, _, _ = row
+                self._metrics["dropped_rows"] += 1
+                logger.error(f"Строка {kind} пропущена после {MAX_BATCH_ATTEMPTS} неудачных попыток записи: {e}; {params!r}")
+                continue
+            written.append(row)
+        else:
+            batch = []
+        
+        if written:
+            self._record_metrics(written, started, time.monotonic())
+        return batch
+    
+    def _open_journal(self) -> int:
+        """Дескриптор журнала для дозаписи"""
+        return os.open(self.journal_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+    
+    @staticmethod
+    def _journal_line(row: Tuple[str, tuple, float, int]) -> bytes:
+        """Строка очереди в формате журнала: JSON-массив [номер, вид, параметры]"""
+        kind, params, _, seq = row
+        return (json.dumps([seq, kind, list(params)], ensure_ascii=False) + "\n").encode("utf-8")
+    
+    def _read_journal(self) -> List[Tuple[int, str, tuple]]:
+        """Строки журнала (оборванная при сбое последняя строка пропускается)"""
+        if not os.path.exists(self.journal_path):
+            return []
+        
+        rows = []
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    seq, kind, params = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Поврежденная строка журнала отложенной записи пропущена: {line[:100]!r}")
+                    continue
+                rows.append((seq, kind, tuple(params)))
+        return rows
+    
+    def _last_written_seq(self) -> int:
+        """Номер последней строки, записанной в базу"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute("SELECT last_seq FROM write_buffer_state WHERE id = 1").fetchone()
+        except sqlite3.OperationalError:
+            # База еще не инициализирована
+            row = None
+        finally:
+            conn.close()
+        return row[0] if row else 0
+    
+    def _append_to_journal(self, row: Tuple[str, tuple, float, int]) -> None:
+        """Дозапись строки в журнал (вызывается под блокировкой)"""
+        if self._journal_fd is None:
+            return
+        try:
+            os.write(self._journal_fd, self._journal_line(row))
+        except OSError as e:
+            logger.error(f"Не удалось дописать строку в журнал отложенной записи: {e}")
+    
+    def _sync_journal(self) -> None:
+        """Сброс журнала на диск"""
+        if self._journal_fd is None:
+            return
+        try:
+            os.fsync(self._journal_fd)
+        except OSError as e:
+            logger.error(f"Не удалось сбросить журнал отложенной записи на диск: {e}")
+    
+    def _compact_journal(self) -> None:
+        """Удаление из журнала записанных строк (вызывается под блокировкой)"""
+        if self._journal_fd is None:
+            return
+        
+        try:
+            if not self._pending:
+                os.ftruncate(self._journal_fd, 0)
+            elif os.fstat(self._journal_fd).st_size > JOURNAL_COMPACT_BYTES:
+                # Очередь не пуста, а журнал разросся - переписываем его из очереди
+                temp_path = self.journal_path + ".tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(b"".join(self._journal_line(row) for row in self._pending))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.journal_path)
+                os.close(self._journal_fd)
+                self._journal_fd = self._open_journal()
+        except OSError as e:
+            logger.error(f"Не удалось сжать журнал отложенной записи: {e}")
+    
+    def get_metrics(self) -> Dict:
+        """Метрики записи: размер пакетов и задержка от постановки в очередь до фиксации"""
+        metrics = dict(self._metrics)
+        batches = metrics["batches"] or 1
+        rows = metrics["rows_written"] or 1
+        metrics["avg_batch_size"] = metrics["rows_written"] / batches
+        metrics["avg_commit_ms"] = metrics["total_commit_ms"] / batches
+        metrics["avg_latency_ms"] = metrics["total_latency_ms"] / rows
+        metrics["pending"] = len(self._pending)
+        return metrics
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Постоянное соединение для записи"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            # WAL + NORMAL: фиксация без fsync на каждую транзакцию, устойчиво к падению процесса
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        return self._conn
+    
+    def _write_batch(self, batch: List[Tuple[str, tuple, float, int]]) -> None:
+        """Запись пакета одной транзакцией вместе с номером последней строки"""
+        conn = self._connection()
+        cursor = conn.cursor()
+        
+        try:
+            for kind, params, _, _ in batch:
+                if kind == "message":
+                    _insert_message(cursor, *params)
+                elif kind == "usage":
+                    _insert_usage_stats(cursor, *params)
+            cursor.execute("""
+            INSERT INTO write_buffer_state (id, last_seq) VALUES (1, ?)
+            ON CONFLICT (id) DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq)
+            """, (max(seq for _, _, _, seq in batch),))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    def _record_metrics(self, batch: List[Tuple[str, tuple, float, int]], started: float, finished: float) -> None:
+        """Обновление метрик после успешной записи пакета"""
+        latencies = [(finished - queued_at) * 1000 for _, _, queued_at, _ in batch]
+        
+        self._metrics["rows_written"] += len(batch)
+        self._metrics["batches"] += 1
+        self._metrics["max_batch_size"] = max(self._metrics["max_batch_size"], len(batch))
+        self._metrics["total_commit_ms"] += (finished - started) * 1000
+        self._metrics["total_latency_ms"] += sum(latencies)
+        self._metrics["max_latency_ms"] = max(self._metrics["max_latency_ms"], max(latencies))
+        
+        logger.debug(f"Записан пакет из {len(batch)} строк за {(finished - started) * 1000:.1f} мс")
+    
+    def _run(self):
+        """Основной цикл фонового потока"""
+        while self._is_running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка в потоке отложенной записи: {e}")
+
+_write_buffer = WriteBehindBuffer(
+    config.DB_PATH,
+    flush_ms=config.WRITE_BUFFER_FLUSH_MS,
+    max_rows=config.WRITE_BUFFER_MAX_ROWS,
+    max_pending=config.WRITE_BUFFER_MAX_PENDING,
+    journal_path=config.DB_PATH + JOURNAL_SUFFIX if config.WRITE_BUFFER_JOURNAL else None
+) if config.WRITE_BUFFER_ENABLED and config.DB_BACKEND == "sqlite" else None
+
+def recover_writes() -> None:
+    """Запись строк, оставшихся в журнале отложенной записи после аварийного завершения"""
+    if _write_buffer is not None:
+        _write_buffer.recover()
+    elif config.DB_BACKEND == "sqlite" and os.path.exists(config.DB_PATH + JOURNAL_SUFFIX):
+        # Буфер выключен после сбоя - журнал дописывается один раз
+        buffer = WriteBehindBuffer(config.DB_PATH, journal_path=config.DB_PATH + JOURNAL_SUFFIX)
+        buffer.recover()
+        buffer.stop()
+
+def flush_writes() -> None:
+    """Записать все отложенные вставки (вызывается перед чтением и при остановке)"""
+    if _write_buffer is not None and _write_buffer.has_pending():
+        _write_buffer.flush()
+
+def shutdown_db() -> None:
+    """Остановка фоновой записи с полным сбросом буфера"""
+    if _write_buffer is not None:
+        _write_buffer.stop()
+
+def get_write_metrics() -> Dict:
+    """Метрики отложенной записи"""
+    if _write_buffer is None:
+        return {}
+    return _write_buffer.get_metrics()
+
+atexit.register(shutdown_db)
 
 def init_db():
     """Инициализация базы данных"""
     conn = sqlite3.connect(config.DB_PATH)
     cursor = conn.cursor()
     
+    # Для новой базы включаем инкрементальную очистку свободных страниц
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    
     # Таблица пользователей
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -21,7 +448,12 @@ def init_db():
         last_name TEXT,
         settings TEXT,
         created_at INTEGER,
-        last_active INTEGER
+        last_active INTEGER,
+        model TEXT,
+        temperature REAL,
+        max_tokens INTEGER,
+        conversation_mode TEXT,
+        language TEXT
     )
     ''')
     
@@ -76,10 +508,298 @@ def init_db():
         tokens_used INTEGER,
         request_type TEXT,
         timestamp INTEGER,
+        prompt_tokens INTEGER,
+        cached_tokens INTEGER,
+        latency_ms INTEGER,
+        conversation_mode TEXT,
         FOREIGN KEY (user_id) REFERENCES users (user_id)
     )
     ''')
     
+    # Сохраненные резюме разговоров; last_message_id - последнее учтенное сообщение
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        user_id INTEGER PRIMARY KEY,
+        summary TEXT,
+        last_message_id INTEGER NOT NULL DEFAULT 0,
+        updated_at INTEGER
+    )
+    ''')
+    
+    # История групповых чатов: общая для участников чата (и темы форума)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS group_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER,
+        thread_id INTEGER NOT NULL DEFAULT 0,
+        user_id INTEGER,
+        role TEXT,
+        content TEXT,
+        timestamp INTEGER
+    )
+    ''')
+    
+    # Предрасчитанная статистика (обновляется при записи сообщений и usage_stats)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stats_user_totals (
+        user_id INTEGER PRIMARY KEY,
+        message_count INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stats_user_models (
+        user_id INTEGER,
+        model TEXT,
+        tokens_used INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, model)
+    )
+    ''')
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stats_user_requests (
+        user_id INTEGER,
+        request_type TEXT,
+        request_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, request_type)
+    )
+    ''')
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stats_user_weekdays (
+        user_id INTEGER,
+        day TEXT,
+        message_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    )
+    ''')
+    
+    # Агрегаты по строкам, удаленным политиками хранения (учитываются при пересчете статистики)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stats_archive_messages (
+        user_id INTEGER,
+        day TEXT,
+        message_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    )
+    ''')
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stats_archive_usage (
+        user_id INTEGER,
+        model TEXT,
+        request_type TEXT,
+        tokens_used INTEGER NOT NULL DEFAULT 0,
+        request_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, model, request_type)
+    )
+    ''')
+    
+    # Номер последней строки, записанной буфером отложенной записи (см. WriteBehindBuffer)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS write_buffer_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        last_seq INTEGER NOT NULL
+    )
+    ''')
+    
+    # Столбцы настроек пользователя (ранее хранились JSON-строкой в users.settings)
+    _migrate_user_settings(cursor)
+    
+    # Столбцы статистики кеширования промптов для существующей таблицы usage_stats
+    cursor.execute("PRAGMA table_info(usage_stats)")
+    existing = {row[1] for row in cursor.fetchall()}
+    for column, column_type in USAGE_COLUMNS.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE usage_stats ADD COLUMN {column} {column_type}")
+    
+    # Индексы для выборок по пользователю и для политик хранения
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_model ON users (model)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_conversation_mode ON users (conversation_mode)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_media_id ON messages (media_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_stats_timestamp ON usage_stats (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_group_messages_chat ON group_messages (chat_id, thread_id, id)")
+    
+    conn.commit()
+    
+    # Полнотекстовый индекс по истории сообщений
+    search_index_created = _create_search_index(cursor)
+    conn.commit()
+    
+    # Первичное заполнение статистики для существующей базы
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM stats_user_totals)")
+    has_rollups = cursor.fetchone()[0]
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM messages)")
+    has_messages = cursor.fetchone()[0]
+    
+    conn.close()
+    
+    if has_messages and not has_rollups:
+        rebuild_stats_rollups()
+    
+    if has_messages and search_index_created:
+        rebuild_search_index()
+    
+    # Строки, не записанные до аварийного завершения прошлого запуска
+    recover_writes()
+
+def _create_search_index(cursor: sqlite3.Cursor) -> bool:
+    """Создание FTS5-индекса по messages.content с триггерами синхронизации, True - индекс создан заново"""
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+    row = cursor.fetchone()
+    if row and "UNINDEXED" not in row[0]:
+        return False
+    
+    if row:
+        # В прежней схеме user_id не индексировался и фильтровался после MATCH
+        # по всем пользователям; индекс пересоздается с user_id в MATCH
+        logger.info("Пересоздание полнотекстового индекса с индексированным user_id")
+        cursor.execute("DROP TABLE messages_fts")
+    
+    try:
+        cursor.execute('''
+        CREATE VIRTUAL TABLE messages_fts USING fts5(
+            content,
+            user_id,
+            content='messages',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''')
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Полнотекстовый поиск недоступен (нет поддержки FTS5): {e}")
+        return False
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, content, user_id) VALUES (new.id, new.content, new.user_id);
+    END
+    ''')
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content, user_id)
+        VALUES ('delete', old.id, old.content, old.user_id);
+    END
+    ''')
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, user_id ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content, user_id)
+        VALUES ('delete', old.id, old.content, old.user_id);
+        INSERT INTO messages_fts (rowid, content, user_id) VALUES (new.id, new.content, new.user_id);
+    END
+    ''')
+    
+    return True
+
+def _migrate_user_settings(cursor: sqlite3.Cursor) -> None:
+    """Добавление столбцов настроек и перенос значений из JSON в users.settings"""
+    cursor.execute("PRAGMA table_info(users)")
+    existing = {row[1] for row in cursor.fetchall()}
+    
+    added = [column for column in SETTINGS_COLUMNS if column not in existing]
+    for column in added:
+        cursor.execute(f"ALTER TABLE users ADD COLUMN {column} {SETTINGS_COLUMNS[column]}")
+    
+    if not added:
+        return
+    
+    cursor.execute("SELECT user_id, settings FROM users WHERE settings IS NOT NULL AND settings != ''")
+    rows = cursor.fetchall()
+    
+    updates = []
+    for user_id, settings_json in rows:
+        try:
+            settings = json.loads(settings_json)
+        except json.JSONDecodeError:
+            logger.warning(f"Некорректные настройки пользователя {user_id}, используются значения по умолчанию")
+            continue
+        updates.append(tuple(settings.get(column) for column in SETTINGS_COLUMNS) + (user_id,))
+    
+    assignments = ", ".join(f"{column} = ?" for column in SETTINGS_COLUMNS)
+    cursor.executemany(f"UPDATE users SET {assignments} WHERE user_id = ?", updates)
+    
+    logger.info(f"Настройки {len(updates)} пользователей перенесены в отдельные столбцы")
+
+def _rollup_message(cursor: sqlite3.Cursor, user_id: int, timestamp: int, count: int = 1) -> None:
+    """Учет сообщения в предрасчитанной статистике"""
+    cursor.execute("""
+    INSERT INTO stats_user_totals (user_id, message_count) VALUES (?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET message_count = message_count + excluded.message_count
+    """, (user_id, count))
+    
+    cursor.execute("""
+    INSERT INTO stats_user_weekdays (user_id, day, message_count) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, day) DO UPDATE SET message_count = message_count + excluded.message_count
+    """, (user_id, weekday(timestamp), count))
+
+def _rollup_usage(cursor: sqlite3.Cursor, user_id: int, model: str, tokens_used: int,
+                  request_type: str, count: int = 1) -> None:
+    """Учет запроса к модели в предрасчитанной статистике"""
+    cursor.execute("""
+    INSERT INTO stats_user_models (user_id, model, tokens_used) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, model) DO UPDATE SET tokens_used = tokens_used + excluded.tokens_used
+    """, (user_id, model, tokens_used))
+    
+    cursor.execute("""
+    INSERT INTO stats_user_requests (user_id, request_type, request_count) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, request_type) DO UPDATE SET request_count = request_count + excluded.request_count
+    """, (user_id, request_type, count))
+
+def rebuild_stats_rollups(user_id: int = None) -> None:
+    """Пересчитать предрасчитанную статистику по исходным таблицам и архивным агрегатам"""
+    flush_writes()
+    
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    if user_id is None:
+        where, params = "", ()
+    else:
+        where, params = "WHERE user_id = ?", (user_id,)
+    
+    for table in ("stats_user_totals", "stats_user_models", "stats_user_requests", "stats_user_weekdays"):
+        cursor.execute(f"DELETE FROM {table} {where}", params)
+    
+    cursor.execute(f"""
+    INSERT INTO stats_user_totals (user_id, message_count)
+    SELECT user_id, SUM(cnt) FROM (
+        SELECT user_id, COUNT(*) AS cnt FROM messages {where} GROUP BY user_id
+        UNION ALL
+        SELECT user_id, message_count FROM stats_archive_messages {where}
+    ) GROUP BY user_id
+    """, params * 2)
+    
+    cursor.execute(f"""
+    INSERT INTO stats_user_weekdays (user_id, day, message_count)
+    SELECT user_id, day, SUM(cnt) FROM (
+        SELECT user_id, strftime('%w', datetime(timestamp, 'unixepoch')) AS day, COUNT(*) AS cnt
+        FROM messages {where} GROUP BY 1, 2
+        UNION ALL
+        SELECT user_id, day, message_count FROM stats_archive_messages {where}
+    ) GROUP BY user_id, day
+    """, params * 2)
+    
+    cursor.execute(f"""
+    INSERT INTO stats_user_models (user_id, model, tokens_used)
+    SELECT user_id, model, SUM(tokens) FROM (
+        SELECT user_id, model, SUM(tokens_used) AS tokens FROM usage_stats {where} GROUP BY user_id, model
+        UNION ALL
+        SELECT user_id, model, tokens_used FROM stats_archive_usage {where}
+    ) GROUP BY user_id, model
+    """, params * 2)
+    
+    cursor.execute(f"""
+    INSERT INTO stats_user_requests (user_id, request_type, request_count)
+    SELECT user_id, request_type, SUM(cnt) FROM (
+        SELECT user_id, request_type, COUNT(*) AS cnt FROM usage_stats {where} GROUP BY user_id, request_type
+        UNION ALL
+        SELECT user_id, request_type, request_count FROM stats_archive_usage {where}
+    ) GROUP BY user_id, request_type
+    """, params * 2)
+    
     conn.commit()
     conn.close()
 
@@ -88,7 +808,10 @@ def get_user(user_id: int) -> Dict:
     conn = sqlite3.connect(config.DB_PATH)
     cursor = conn.cursor()
     
-    cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+    cursor.execute(f"""
+    SELECT user_id, username, first_name, last_name, created_at, last_active, {", ".join(SETTINGS_COLUMNS)}
+    FROM users WHERE user_id = ?
+    """, (user_id,))
     user_data = cursor.fetchone()
     
     conn.close()
@@ -96,19 +819,9 @@ def get_user(user_id: int) -> Dict:
     if not user_data:
         return None
     
-    columns = ['user_id', 'username', 'first_name', 'last_name', 'settings', 'created_at', 'last_active']
+    columns = ['user_id', 'username', 'first_name', 'last_name', 'created_at', 'last_active']
     user_dict = dict(zip(columns, user_data))
-    
-    if user_dict['settings']:
-        user_dict['settings'] = json.loads(user_dict['settings'])
-    else:
-        user_dict['settings'] = {
-            "model": config.DEFAULT_MODEL,
-            "temperature": config.DEFAULT_TEMP,
-            "max_tokens": config.DEFAULT_MAX_TOKENS,
-            "conversation_mode": "friendly",
-            "language": "ru"
-        }
+    user_dict['settings'] = settings_from_row(user_data[len(columns):])
     
     return user_dict
 
@@ -132,68 +845,74 @@ def create_or_update_user(user_id: int, username: str, first_name: str, last_nam
         """, (username, first_name, last_name, current_time, user_id))
     else:
         # Создаем нового пользователя с настройками по умолчанию
-        default_settings = {
-            "model": config.DEFAULT_MODEL,
-            "temperature": config.DEFAULT_TEMP,
-            "max_tokens": config.DEFAULT_MAX_TOKENS,
-            "conversation_mode": "friendly",
-            "language": "ru"
-        }
+        settings = default_settings()
         
-        cursor.execute("""
-        INSERT INTO users (user_id, username, first_name, last_name, settings, created_at, last_active)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, username, first_name, last_name, json.dumps(default_settings), current_time, current_time))
+        cursor.execute(f"""
+        INSERT INTO users (user_id, username, first_name, last_name, created_at, last_active, {", ".join(settings)})
+        VALUES (?, ?, ?, ?, ?, ?, {", ".join("?" * len(settings))})
+        """, (user_id, username, first_name, last_name, current_time, current_time, *settings.values()))
     
     conn.commit()
     conn.close()
 
 def update_user_settings(user_id: int, settings: Dict) -> None:
-    """Обновить настройки пользователя"""
+    """Обновить настройки пользователя (меняются только переданные столбцы)"""
+    settings = split_settings(settings)
+    
     conn = sqlite3.connect(config.DB_PATH)
     cursor = conn.cursor()
     
-    # Получаем текущие настройки
-    cursor.execute("SELECT settings FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    
-    if result and result[0]:
-        current_settings = json.loads(result[0])
-    else:
-        current_settings = {
-            "model": config.DEFAULT_MODEL,
-            "temperature": config.DEFAULT_TEMP,
-            "max_tokens": config.DEFAULT_MAX_TOKENS,
-            "conversation_mode": "friendly",
-            "language": "ru"
-        }
-    
-    # Обновляем настройки
-    current_settings.update(settings)
-    
-    # Сохраняем обновленные настройки
-    cursor.execute("""
+    assignments = "".join(f"{column} = ?, " for column in settings)
+    cursor.execute(f"""
     UPDATE users 
-    SET settings = ?, last_active = ? 
+    SET {assignments}last_active = ? 
     WHERE user_id = ?
-    """, (json.dumps(current_settings), int(time.time()), user_id))
+    """, (*settings.values(), int(time.time()), user_id))
     
     conn.commit()
     conn.close()
 
-def add_message(user_id: int, role: str, content: str, message_type: str = "text", media_id: str = None) -> int:
-    """Добавить сообщение в историю"""
+def get_users_per_setting(column: str) -> Dict:
+    """Количество пользователей по значению настройки (например, по модели)"""
+    if column not in SETTINGS_COLUMNS:
+        raise ValueError(f"Неизвестная настройка: {column}")
+    
     conn = sqlite3.connect(config.DB_PATH)
     cursor = conn.cursor()
     
-    current_time = int(time.time())
+    cursor.execute(f"SELECT {column}, COUNT(*) FROM users GROUP BY {column} ORDER BY 2 DESC")
+    result = {value: count for value, count in cursor.fetchall()}
     
+    conn.close()
+    
+    return result
+
+def _insert_message(cursor: sqlite3.Cursor, user_id: int, role: str, content: str, timestamp: int,
+                    message_type: str, media_id: str) -> int:
+    """Вставка сообщения и обновление статистики в рамках текущей транзакции"""
     cursor.execute("""
     INSERT INTO messages (user_id, role, content, timestamp, message_type, media_id)
     VALUES (?, ?, ?, ?, ?, ?)
-    """, (user_id, role, content, current_time, message_type, media_id))
+    """, (user_id, role, content, timestamp, message_type, media_id))
     
     message_id = cursor.lastrowid
+    _rollup_message(cursor, user_id, timestamp)
+    
+    return message_id
+
+def add_message(user_id: int, role: str, content: str, message_type: str = "text", media_id: str = None) -> Optional[int]:
+    """Добавить сообщение в историю (при отложенной записи ID не возвращается)"""
+    current_time = int(time.time())
+    params = (user_id, role, content, current_time, message_type, media_id)
+    
+    if _write_buffer is not None:
+        _write_buffer.submit("message", params)
+        return None
+    
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    message_id = _insert_message(cursor, *params)
     
     conn.commit()
     conn.close()
@@ -202,6 +921,8 @@ def add_message(user_id: int, role: str, content: str, message_type: str = "text
 
 def get_chat_history(user_id: int, limit: int = 10) -> List[Dict]:
     """Получить историю чата пользователя"""
+    flush_writes()
+    
     conn = sqlite3.connect(config.DB_PATH)
     cursor = conn.cursor()
     
@@ -210,7 +931,7 @@ def get_chat_history(user_id: int, limit: int = 10) -> List[Dict]:
     FROM messages m
     LEFT JOIN media med ON m.media_id = med.file_unique_id
     WHERE m.user_id = ?
-    ORDER BY m.timestamp DESC
+    ORDER BY m.timestamp DESC, m.id DESC
     LIMIT ?
     """, (user_id, limit))
     
@@ -218,42 +939,59 @@ def get_chat_history(user_id: int, limit: int = 10) -> List[Dict]:
     conn.close()
     
     # Преобразуем сообщения в формат для OpenRouter API
-    chat_messages = []
+    return format_chat_history(messages)
+
+def get_messages_since(user_id: int, after_id: int = 0, limit: int = 50) -> List[Dict]:
+    """Первые limit сообщений пользователя с id больше after_id (от старых к новым)"""
+    flush_writes()
     
-    for msg in reversed(messages):
-        role, content, timestamp, message_type, media_id, processed_text = msg
-        
-        if role not in ["user", "assistant", "system"]:
-            continue
-        
-        # Формируем содержимое сообщения в зависимости от типа
-        message_content = []
-        
-        if message_type == "text":
-            message_content.append({
-                "type": "text",
-                "text": content
-            })
-        elif message_type == "image" and processed_text:
-            # Если есть изображение и оно было обработано
-            message_content.append({
-                "type": "text",
-                "text": content or "Что на этом изображении?"
-            })
-            message_content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"file://{processed_text}"  # Путь к файлу изображения
-                }
-            })
-        
-        if message_content:
-            chat_messages.append({
-                "role": role,
-                "content": message_content
-            })
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
     
-    return chat_messages
+    cursor.execute("""
+    SELECT id, role, content, message_type FROM messages
+    WHERE user_id = ? AND id > ?
+    ORDER BY id
+    LIMIT ?
+    """, (user_id, after_id, limit))
+    
+    rows = cursor.fetchall()
+    conn.close()
+    
+    columns = ["id", "role", "content", "message_type"]
+    return [dict(zip(columns, row)) for row in rows]
+
+def get_chat_summary(user_id: int) -> Optional[Dict]:
+    """Сохраненное резюме разговора пользователя"""
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        "SELECT summary, last_message_id, updated_at FROM chat_summaries WHERE user_id = ?", (user_id,)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    
+    if not row:
+        return None
+    
+    return dict(zip(["summary", "last_message_id", "updated_at"], row))
+
+def save_chat_summary(user_id: int, summary: str, last_message_id: int) -> None:
+    """Сохранить резюме разговора и последнее учтенное сообщение"""
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+    INSERT INTO chat_summaries (user_id, summary, last_message_id, updated_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET
+        summary = excluded.summary,
+        last_message_id = excluded.last_message_id,
+        updated_at = excluded.updated_at
+    """, (user_id, summary, last_message_id, int(time.time())))
+    
+    conn.commit()
+    conn.close()
 
 def add_media(user_id: int, file_id: str, file_unique_id: str, 
               file_path: str, media_type: str, processed_text: str = None) -> int:
@@ -293,54 +1031,83 @@ def get_media(file_unique_id: str) -> Dict:
     
     return media_dict
 
-def add_usage_stats(user_id: int, model: str, tokens_used: int, request_type: str) -> None:
+def _insert_usage_stats(cursor: sqlite3.Cursor, user_id: int, model: str, tokens_used: int,
+                        request_type: str, timestamp: int, prompt_tokens: int = 0, cached_tokens: int = 0,
+                        latency_ms: int = None, conversation_mode: str = None) -> None:
+    """Вставка статистики использования в рамках текущей транзакции"""
+    cursor.execute("""
+    INSERT INTO usage_stats (user_id, model, tokens_used, request_type, timestamp,
+                             prompt_tokens, cached_tokens, latency_ms, conversation_mode)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, model, tokens_used, request_type, timestamp,
+          prompt_tokens, cached_tokens, latency_ms, conversation_mode))
+    _rollup_usage(cursor, user_id, model, tokens_used, request_type)
+
+def add_usage_stats(user_id: int, model: str, tokens_used: int, request_type: str,
+                    prompt_tokens: int = 0, cached_tokens: int = 0, latency_ms: int = None,
+                    conversation_mode: str = None) -> None:
     """Добавить статистику использования"""
+    current_time = int(time.time())
+    params = (user_id, model, tokens_used, request_type, current_time,
+              prompt_tokens, cached_tokens, latency_ms, conversation_mode)
+    
+    if _write_buffer is not None:
+        _write_buffer.submit("usage", params)
+        return
+    
     conn = sqlite3.connect(config.DB_PATH)
     cursor = conn.cursor()
     
-    current_time = int(time.time())
+    _insert_usage_stats(cursor, *params)
+    
+    conn.commit()
+    conn.close()
+
+def get_prompt_cache_stats(since: int = None) -> List[Dict]:
+    """Эффективность кеширования промптов по режимам разговора и моделям"""
+    flush_writes()
+    
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
     
     cursor.execute("""
-    INSERT INTO usage_stats (user_id, model, tokens_used, request_type, timestamp)
-    VALUES (?, ?, ?, ?, ?)
-    """, (user_id, model, tokens_used, request_type, current_time))
+    SELECT conversation_mode, model, COUNT(*), SUM(prompt_tokens), SUM(cached_tokens),
+           AVG(latency_ms), AVG(CASE WHEN cached_tokens > 0 THEN latency_ms END)
+    FROM usage_stats
+    WHERE request_type = 'chat' AND prompt_tokens IS NOT NULL AND timestamp >= ?
+    GROUP BY conversation_mode, model
+    ORDER BY COUNT(*) DESC
+    """, (since or 0,))
+    rows = cursor.fetchall()
     
-    conn.commit()
     conn.close()
+    
+    return format_prompt_cache_stats(rows)
 
 def get_user_stats(user_id: int) -> Dict:
     """Получить статистику использования для пользователя"""
+    flush_writes()
+    
     conn = sqlite3.connect(config.DB_PATH)
     cursor = conn.cursor()
     
     # Общее количество сообщений
-    cursor.execute("SELECT COUNT(*) FROM messages WHERE user_id = ?", (user_id,))
-    message_count = cursor.fetchone()[0]
+    cursor.execute("SELECT message_count FROM stats_user_totals WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    message_count = row[0] if row else 0
     
     # Количество токенов по моделям
-    cursor.execute("""
-    SELECT model, SUM(tokens_used) 
-    FROM usage_stats 
-    WHERE user_id = ? 
-    GROUP BY model
-    """, (user_id,))
+    cursor.execute("SELECT model, tokens_used FROM stats_user_models WHERE user_id = ?", (user_id,))
     tokens_by_model = {model: tokens for model, tokens in cursor.fetchall()}
     
     # Статистика по типам запросов
-    cursor.execute("""
-    SELECT request_type, COUNT(*) 
-    FROM usage_stats 
-    WHERE user_id = ? 
-    GROUP BY request_type
-    """, (user_id,))
+    cursor.execute("SELECT request_type, request_count FROM stats_user_requests WHERE user_id = ?", (user_id,))
     requests_by_type = {req_type: count for req_type, count in cursor.fetchall()}
     
     # Активность по дням недели
     cursor.execute("""
-    SELECT strftime('%w', datetime(timestamp, 'unixepoch')) as day, COUNT(*)
-    FROM messages
-    WHERE user_id = ?
-    GROUP BY day
+    SELECT day, message_count FROM stats_user_weekdays
+    WHERE user_id = ? AND message_count > 0
     """, (user_id,))
     activity_by_day = {day: count for day, count in cursor.fetchall()}
     
@@ -353,6 +1120,24 @@ def get_user_stats(user_id: int) -> Dict:
         "activity_by_day": activity_by_day
     }
 
+def get_tokens_used_since(since: int) -> Dict[int, int]:
+    """Токены по пользователям начиная с момента since (для сверки квот)"""
+    flush_writes()
+    
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+    SELECT user_id, SUM(tokens_used) FROM usage_stats
+    WHERE timestamp >= ?
+    GROUP BY user_id
+    """, (since,))
+    tokens = {user_id: int(total or 0) for user_id, total in cursor.fetchall()}
+    
+    conn.close()
+    
+    return tokens
+
 def add_scheduled_message(user_id: int, content: str, scheduled_time: int) -> int:
     """Добавить запланированное сообщение"""
     conn = sqlite3.connect(config.DB_PATH)
@@ -417,53 +1202,429 @@ def mark_scheduled_message_sent(message_id: int) -> None:
 
 def clear_chat_history(user_id: int) -> None:
     """Очистить историю чата пользователя"""
+    flush_writes()
+    
     conn = sqlite3.connect(config.DB_PATH)
     cursor = conn.cursor()
     
     cursor.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
     
+    # Статистика сообщений считается по сохраненной истории
+    cursor.execute("DELETE FROM stats_user_totals WHERE user_id = ?", (user_id,))
+    cursor.execute("DELETE FROM stats_user_weekdays WHERE user_id = ?", (user_id,))
+    cursor.execute("DELETE FROM stats_archive_messages WHERE user_id = ?", (user_id,))
+    cursor.execute("DELETE FROM chat_summaries WHERE user_id = ?", (user_id,))
+    
     conn.commit()
     conn.close()
 
-def export_chat_history(user_id: int, format_type: str = "text") -> str:
-    """Экспортировать историю чата в выбранном формате"""
+def add_group_message(chat_id: int, thread_id: int, user_id: int, role: str, content: str) -> int:
+    """Добавить сообщение в историю группового чата"""
     conn = sqlite3.connect(config.DB_PATH)
     cursor = conn.cursor()
     
     cursor.execute("""
-    SELECT m.role, m.content, m.timestamp, m.message_type
-    FROM messages m
-    WHERE m.user_id = ?
-    ORDER BY m.timestamp ASC
-    """, (user_id,))
+    INSERT INTO group_messages (chat_id, thread_id, user_id, role, content, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+    """, (chat_id, thread_id, user_id, role, content, int(time.time())))
+    message_id = cursor.lastrowid
+    
+    conn.commit()
+    conn.close()
+    
+    return message_id
+
+def get_group_history(chat_id: int, thread_id: int, limit: int = 10) -> List[Dict]:
+    """Получить историю группового чата (темы) в формате OpenRouter API"""
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+    SELECT role, content, timestamp, 'text', NULL, NULL
+    FROM group_messages
+    WHERE chat_id = ? AND thread_id = ?
+    ORDER BY id DESC
+    LIMIT ?
+    """, (chat_id, thread_id, limit))
     
     messages = cursor.fetchall()
     conn.close()
     
-    if format_type == "text":
-        output = []
-        for msg in messages:
-            role, content, timestamp, message_type = msg
-            time_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+    return format_chat_history(messages)
+
+def clear_group_history(chat_id: int, thread_id: int) -> None:
+    """Очистить историю группового чата (темы)"""
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute("DELETE FROM group_messages WHERE chat_id = ? AND thread_id = ?", (chat_id, thread_id))
+    
+    conn.commit()
+    conn.close()
+
+def get_users_over_message_limit(keep: int) -> List[int]:
+    """Пользователи, у которых сообщений больше, чем допускает политика хранения"""
+    flush_writes()
+    
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+    SELECT user_id FROM messages
+    GROUP BY user_id
+    HAVING COUNT(*) > ?
+    """, (keep,))
+    
+    user_ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    
+    return user_ids
+
+def delete_old_messages_batch(user_id: int, keep: int, batch_size: int = 500) -> int:
+    """Удалить пачку самых старых сообщений пользователя сверх последних keep"""
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    # Граница: ID самого нового сообщения, которое уже не попадает в последние keep
+    cursor.execute("""
+    SELECT id FROM messages WHERE user_id = ?
+    ORDER BY id DESC
+    LIMIT 1 OFFSET ?
+    """, (user_id, keep))
+    row = cursor.fetchone()
+    
+    if not row:
+        conn.close()
+        return 0
+    
+    cursor.execute("""
+    SELECT id, timestamp FROM messages
+    WHERE user_id = ? AND id <= ?
+    ORDER BY id
+    LIMIT ?
+    """, (user_id, row[0], batch_size))
+    rows = cursor.fetchall()
+    
+    # Сохраняем удаляемые сообщения в архивной статистике
+    by_day = {}
+    for _, timestamp in rows:
+        day = weekday(timestamp)
+        by_day[day] = by_day.get(day, 0) + 1
+    
+    for day, count in by_day.items():
+        cursor.execute("""
+        INSERT INTO stats_archive_messages (user_id, day, message_count) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, day) DO UPDATE SET message_count = message_count + excluded.message_count
+        """, (user_id, day, count))
+    
+    cursor.executemany("DELETE FROM messages WHERE id = ?", [(msg_id,) for msg_id, _ in rows])
+    
+    conn.commit()
+    conn.close()
+    
+    return len(rows)
+
+def delete_old_group_messages_batch(keep: int, batch_size: int = 500) -> int:
+    """Удалить пачку сообщений групповых чатов сверх последних keep в каждом чате (теме)"""
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+    DELETE FROM group_messages WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id, thread_id ORDER BY id DESC) AS position
+            FROM group_messages
+        )
+        WHERE position > ?
+        LIMIT ?
+    )
+    """, (keep, batch_size))
+    deleted = cursor.rowcount
+    
+    conn.commit()
+    conn.close()
+    
+    return deleted
+
+def delete_old_usage_stats_batch(before_timestamp: int, batch_size: int = 500) -> int:
+    """Удалить пачку строк usage_stats старше указанного времени, сохранив их агрегаты"""
+    flush_writes()
+    
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+    SELECT id, user_id, model, request_type, tokens_used FROM usage_stats
+    WHERE timestamp < ?
+    ORDER BY id
+    LIMIT ?
+    """, (before_timestamp, batch_size))
+    rows = cursor.fetchall()
+    
+    aggregated = {}
+    for _, user_id, model, request_type, tokens_used in rows:
+        key = (user_id, model, request_type)
+        tokens, count = aggregated.get(key, (0, 0))
+        aggregated[key] = (tokens + (tokens_used or 0), count + 1)
+    
+    for (user_id, model, request_type), (tokens, count) in aggregated.items():
+        cursor.execute("""
+        INSERT INTO stats_archive_usage (user_id, model, request_type, tokens_used, request_count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, model, request_type) DO UPDATE SET
+            tokens_used = tokens_used + excluded.tokens_used,
+            request_count = request_count + excluded.request_count
+        """, (user_id, model, request_type, tokens, count))
+    
+    cursor.executemany("DELETE FROM usage_stats WHERE id = ?", [(row[0],) for row in rows])
+    
+    conn.commit()
+    conn.close()
+    
+    return len(rows)
+
+def get_orphaned_media(created_before: int, batch_size: int = 500) -> List[Dict]:
+    """Медиафайлы, на которые больше не ссылается ни одно сообщение"""
+    flush_writes()
+    
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+    SELECT med.id, med.file_path FROM media med
+    WHERE med.created_at < ?
+      AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.media_id = med.file_unique_id)
+    ORDER BY med.id
+    LIMIT ?
+    """, (created_before, batch_size))
+    
+    result = [{"id": media_id, "file_path": file_path} for media_id, file_path in cursor.fetchall()]
+    conn.close()
+    
+    return result
+
+def delete_media_records(media_ids: List[int]) -> None:
+    """Удалить записи о медиафайлах"""
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.executemany("DELETE FROM media WHERE id = ?", [(media_id,) for media_id in media_ids])
+    
+    conn.commit()
+    conn.close()
+
+def get_media_file_paths() -> set:
+    """Пути ко всем медиафайлам, известным базе данных"""
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT file_path FROM media WHERE file_path IS NOT NULL")
+    paths = {os.path.normpath(row[0]) for row in cursor.fetchall()}
+    
+    conn.close()
+    
+    return paths
+
+def incremental_vacuum(pages: int = 1000) -> int:
+    """
+    Вернуть файловой системе до pages свободных страниц, возвращает остаток свободных страниц
+    
+    Работает только в режиме auto_vacuum=INCREMENTAL (новые базы создаются в
+    нем, существующие переводятся командой maintenance.py enable-incremental-vacuum).
+    """
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] == 2:
+        cursor.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+        cursor.fetchall()
+    
+    cursor.execute("PRAGMA freelist_count")
+    free_pages = cursor.fetchone()[0]
+    
+    conn.close()
+    
+    return free_pages
+
+def enable_incremental_vacuum() -> bool:
+    """
+    Перевод существующей базы в режим auto_vacuum=INCREMENTAL
+    
+    Режим вступает в силу только после полного VACUUM, который переписывает
+    весь файл и блокирует запись на время работы, поэтому выполняется
+    отдельной командой обслуживания, а не фоновой очисткой.
+    
+    Returns:
+        True, если база переведена, False - если режим уже включен
+    """
+    flush_writes()
+    
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] == 2:
+        conn.close()
+        return False
+    
+    logger.info("Перевод базы данных в режим auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    conn.close()
+    
+    return True
+
+def search_messages(user_id: int, query: str, limit: int = 10) -> List[Dict]:
+    """Полнотекстовый поиск по истории пользователя, результаты по релевантности"""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    
+    flush_writes()
+    
+    # Каждое слово в кавычках - без операторов FTS5; последнее слово ищется как префикс.
+    # Пользователь - часть MATCH: индекс сразу отбирает только его сообщения
+    words = " ".join(f'"{term}"' for term in terms[:-1])
+    words = f'{words} "{terms[-1]}"*'.strip()
+    match = f'user_id : "{int(user_id)}" AND content : ({words})'
+    
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+        SELECT m.id, m.role, m.timestamp, snippet(messages_fts, 0, '«', '»', '…', 16)
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        WHERE messages_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+        """, (match, limit))
+        rows = cursor.fetchall()
+    except sqlite3.OperationalError as e:
+        logger.error(f"Ошибка полнотекстового поиска: {e}")
+        rows = []
+    finally:
+        conn.close()
+    
+    return [
+        {"id": msg_id, "role": role, "timestamp": timestamp, "snippet": snippet}
+        for msg_id, role, timestamp, snippet in rows
+    ]
+
+def rebuild_search_index() -> None:
+    """Перестроить полнотекстовый индекс по таблице messages"""
+    flush_writes()
+    
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+    
+    conn.commit()
+    conn.close()
+    
+    logger.info("Полнотекстовый индекс перестроен")
+
+EXPORT_FORMATS = {
+    "text": "txt",
+    "json": "json",
+    "ndjson": "ndjson",
+    "csv": "csv"
+}
+
+def iter_chat_history(user_id: int, batch_size: int = 500) -> Iterator[Tuple]:
+    """Построчное чтение истории чата без загрузки ее целиком в память"""
+    flush_writes()
+    
+    conn = sqlite3.connect(config.DB_PATH)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+        SELECT m.role, m.content, m.timestamp, m.message_type
+        FROM messages m
+        WHERE m.user_id = ?
+        ORDER BY m.timestamp ASC, m.id ASC
+        """, (user_id,))
+        
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+def export_chat_history_stream(user_id: int, format_type: str = "text") -> Iterator[str]:
+    """Потоковый экспорт истории чата: генерирует текст по частям"""
+    if format_type not in EXPORT_FORMATS:
+        yield "Неподдерживаемый формат экспорта"
+        return
+    
+    if format_type == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["role", "content", "timestamp", "time", "type"])
+        yield buffer.getvalue()
+    elif format_type == "json":
+        yield "["
+    
+    first = True
+    for role, content, timestamp, message_type in iter_chat_history(user_id):
+        time_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        
+        if format_type == "text":
             if role == "user":
-                output.append(f"[{time_str}] Вы: {content}")
+                line = f"[{time_str}] Вы: {content}"
             elif role == "assistant":
-                output.append(f"[{time_str}] Бот: {content}")
+                line = f"[{time_str}] Бот: {content}"
+            else:
+                continue
+            yield line if first else "\n\n" + line
         
-        return "\n\n".join(output)
-    
-    elif format_type == "json":
-        output = []
-        for msg in messages:
-            role, content, timestamp, message_type = msg
-            output.append({
+        elif format_type == "csv":
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow([role, content, timestamp, time_str, message_type])
+            yield buffer.getvalue()
+        
+        else:
+            item = {
                 "role": role,
                 "content": content,
                 "timestamp": timestamp,
-                "time": datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S'),
+                "time": time_str,
                 "type": message_type
-            })
+            }
+            if format_type == "ndjson":
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+            else:
+                item_json = json.dumps(item, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+                yield ("\n  " if first else ",\n  ") + item_json
         
-        return json.dumps(output, ensure_ascii=False, indent=2)
+        first = False
     
-    return "Неподдерживаемый формат экспорта"
+    if format_type == "json":
+        yield "]" if first else "\n]"
+
+def export_chat_history(user_id: int, format_type: str = "text") -> str:
+    """Экспортировать историю чата в выбранном формате"""
+    return "".join(export_chat_history_stream(user_id, format_type))
+
+# Подмена функций модуля методами альтернативного бэкенда хранилища
+if config.DB_BACKEND == "postgres":
+    from storage_postgres import PostgresStorage
+    
+    _storage = PostgresStorage()
+    for _operation in Storage.OPERATIONS:
+        globals()[_operation] = getattr(_storage, _operation)
+elif config.DB_BACKEND != "sqlite":
+    raise RuntimeError(f"Неизвестный бэкенд хранилища: {config.DB_BACKEND}")
+
+# Время выполнения функций хранилища в метриках (при METRICS_ENABLED) и спаны трассировки
+for _operation in Storage.OPERATIONS + ("export_chat_history",):
+    if not inspect.isgeneratorfunction(globals()[_operation]):
+        globals()[_operation] = timed(DB_DURATION, _operation)(traced(f"db.{_operation}")(globals()[_operation]))
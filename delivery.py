@@ -0,0 +1,354 @@
+"""
+Доставка ответов пользователю.
+
+Telegram принимает не больше 4096 символов в сообщении, а Markdown из ответа
+модели часто не совпадает с разметкой Telegram. Ответ один раз разбивается на
+части по границам абзацев и блоков кода, каждая часть один раз приводится к
+parse_mode="Markdown" и проверяется; части отправляются подряд по мере
+готовности. Очень длинные ответы показываются постранично с inline-кнопками,
+страницы хранятся на стороне бота.
+"""
+
+import re
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+FENCE_RE = re.compile(r"```.*?(?:```|$)", re.DOTALL)
+INLINE_CODE_RE = re.compile(r"`[^`\n]+`")
+LINK_RE = re.compile(r"\[[^\]\n]+\]\(https?://[^)\s]+\)")
+BOLD_RE = re.compile(r"(?<![\w*])\*(?=\S)[^*\n]+?(?<=\S)\*(?![\w*])")
+ITALIC_RE = re.compile(r"(?<![\w_])_(?=\S)[^_\n]+?(?<=\S)_(?![\w_])")
+HEADING_RE = re.compile(r"^#{1,6}[ \t]+(.+?)[ \t#]*$", re.MULTILINE)
+BULLET_RE = re.compile(r"^([ \t]*)[*+-][ \t]+", re.MULTILINE)
+SPECIAL_CHARS_RE = re.compile(r"([_*`\[])")
+
+# Одна часть ответа: исходный текст и он же в разметке Telegram (None - без разметки)
+Chunk = Tuple[str, Optional[str]]
+
+def split_message(text: str, limit: int = None) -> List[str]:
+    """
+    Разбиение текста на части не длиннее limit
+    
+    Границы выбираются по абзацам; блок кода разрезается только если сам не
+    помещается в часть, и тогда каждая его часть снова оформляется как блок кода.
+    
+    Args:
+        text: Текст ответа
+        limit: Максимальная длина части
+    
+    Returns:
+        Список частей
+    """
+    limit = min(limit or config.RESPONSE_CHUNK_SIZE, TELEGRAM_MESSAGE_LIMIT)
+    chunks = []
+    current = ""
+    
+    for block in _blocks(text):
+        for piece in _fit_block(block, limit):
+            candidate = f"{current}\n\n{piece}" if current else piece
+            if len(candidate) <= limit:
+                current = candidate
+            else:
+                chunks.append(current)
+                current = piece
+    
+    if current:
+        chunks.append(current)
+    
+    return chunks
+
+def _blocks(text: str) -> List[str]:
+    """Абзацы и блоки кода в порядке следования"""
+    blocks = []
+    position = 0
+    
+    for match in FENCE_RE.finditer(text):
+        blocks.extend(_paragraphs(text[position:match.start()]))
+        blocks.append(_close_fence(match.group(0)))
+        position = match.end()
+    
+    blocks.extend(_paragraphs(text[position:]))
+    return blocks
+
+def _close_fence(code: str) -> str:
+    """Блок кода с закрывающими кавычками (модель могла оборвать ответ внутри блока)"""
+    if len(code) < 6 or not code.endswith("```"):
+        return code + "\n```"
+    return code
+
+def _paragraphs(text: str) -> List[str]:
+    """Непустые абзацы текста"""
+    return [paragraph.strip("\n") for paragraph in re.split(r"\n\s*\n", text) if paragraph.strip()]
+
+def _fit_block(block: str, limit: int) -> List[str]:
+    """Разбиение абзаца или блока кода, который не помещается в одну часть"""
+    if len(block) <= limit:
+        return [block]
+    
+    if not block.startswith("```"):
+        return _split_text(block, limit, ("\n", ". ", " "))
+    
+    header, _, body = block.partition("\n")
+    body = body[:-3].rstrip("\n")
+    
+    # Место под строку с языком и закрывающие кавычки
+    room = max(limit - len(header) - 5, 1)
+    return [f"{header}\n{part}\n```" for part in _split_text(body, room, ("\n",))]
+
+def _split_text(text: str, limit: int, separators: Tuple[str, ...]) -> List[str]:
+    """Жадное разбиение по первому разделителю, длинные куски - по следующим"""
+    if len(text) <= limit:
+        return [text]
+    
+    if not separators:
+        return [text[i:i + limit] for i in range(0, len(text), limit)]
+    
+    separator = separators[0]
+    parts = text.split(separator)
+    pieces = [part + separator for part in parts[:-1]] + [parts[-1]]
+    
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if len(current) + len(piece) <= limit:
+            current += piece
+            continue
+        
+        if current.strip():
+            chunks.append(current.rstrip())
+        
+        if len(piece) > limit:
+            nested = _split_text(piece, limit, separators[1:])
+            chunks.extend(nested[:-1])
+            current = nested[-1]
+        else:
+            current = piece
+    
+    if current.strip():
+        chunks.append(current.rstrip())
+    
+    return chunks
+
+def to_telegram_markdown(text: str) -> str:
+    """
+    Приведение Markdown из ответа модели к parse_mode="Markdown" Telegram
+    
+    Заголовки и **жирный** превращаются в *жирный*, маркеры списков - в «•».
+    Парные *, _, `код` и [ссылки](url) сохраняются, остальные служебные символы
+    экранируются, чтобы Telegram не отклонил сообщение.
+    """
+    parts = []
+    position = 0
+    
+    # Блоки кода передаются как есть
+    for match in FENCE_RE.finditer(text):
+        parts.append(_format_text(text[position:match.start()]))
+        parts.append(_close_fence(match.group(0)))
+        position = match.end()
+    
+    parts.append(_format_text(text[position:]))
+    return "".join(parts)
+
+def _format_text(text: str) -> str:
+    """Разметка текста вне блоков кода"""
+    text = HEADING_RE.sub(r"**\1**", text)
+    text = BULLET_RE.sub(r"\1• ", text)
+    text = text.replace("**", "*").replace("__", "_")
+    
+    # Сохраняем корректные сущности, экранируем все остальное
+    entities = []
+    
+    def protect(match: re.Match) -> str:
+        entities.append(match.group(0))
+        return f"\x00{len(entities) - 1}\x00"
+    
+    for pattern in (INLINE_CODE_RE, LINK_RE, BOLD_RE, ITALIC_RE):
+        text = pattern.sub(protect, text)
+    
+    text = SPECIAL_CHARS_RE.sub(r"\\\1", text)
+    
+    return re.sub(r"\x00(\d+)\x00", lambda match: entities[int(match.group(1))], text)
+
+def prepare_chunks(text: str, markdown: bool = True) -> List[Chunk]:
+    """Разбиение ответа на части и однократная подготовка разметки каждой из них"""
+    if not markdown:
+        return [(chunk, None) for chunk in split_message(text)]
+    
+    chunks = []
+    for chunk in split_message(text):
+        chunks.extend(_format_chunk(chunk))
+    return chunks
+
+def _format_chunk(chunk: str) -> List[Chunk]:
+    """
+    Разметка части ответа с проверкой длины
+    
+    Экранирование удлиняет текст, поэтому часть, которая после разметки не
+    помещается в сообщение, делится еще раз пропорционально удлинению.
+    """
+    formatted = to_telegram_markdown(chunk)
+    if len(formatted) <= TELEGRAM_MESSAGE_LIMIT:
+        return [(chunk, formatted)]
+    
+    limit = len(chunk) * TELEGRAM_MESSAGE_LIMIT // len(formatted)
+    pieces = split_message(chunk, limit) if limit > 0 else [chunk]
+    if len(pieces) < 2:
+        return [(chunk, None)]
+    
+    return [item for piece in pieces for item in _format_chunk(piece)]
+
+class PageCache:
+    """Страницы длинных ответов для постраничного просмотра (LRU с временем жизни)"""
+    
+    def __init__(self, max_size: int, ttl: int):
+        """Инициализация кеша"""
+        self.max_size = max_size
+        self.ttl = ttl
+        self._pages: "OrderedDict[str, Tuple[List[Chunk], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def put(self, pages: List[Chunk]) -> str:
+        """Сохранить страницы, возвращает идентификатор"""
+        page_id = uuid.uuid4().hex[:12]
+        
+        with self._lock:
+            self._pages[page_id] = (pages, time.monotonic() + self.ttl)
+            while len(self._pages) > self.max_size:
+                self._pages.popitem(last=False)
+        
+        return page_id
+    
+    def get(self, page_id: str) -> Optional[List[Chunk]]:
+        """Страницы по идентификатору или None, если они устарели"""
+        with self._lock:
+            entry = self._pages.get(page_id)
+            if entry is None:
+                return None
+            
+            pages, expires = entry
+            if expires < time.monotonic():
+                del self._pages[page_id]
+                return None
+            
+            self._pages.move_to_end(page_id)
+            return pages
+
+_page_cache = PageCache(config.RESPONSE_PAGES_CACHE_SIZE, config.RESPONSE_PAGES_TTL_HOURS * 3600)
+
+def page_keyboard(page_id: str, page: int, total: int) -> InlineKeyboardMarkup:
+    """Кнопки перехода между страницами ответа"""
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f"page_{page_id}_{page - 1}"))
+    buttons.append(InlineKeyboardButton(f"{page + 1}/{total}", callback_data=f"page_{page_id}_{page}"))
+    if page < total - 1:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f"page_{page_id}_{page + 1}"))
+    
+    return InlineKeyboardMarkup([buttons])
+
+def parse_page_callback(callback_data: str) -> Optional[Tuple[str, int]]:
+    """Идентификатор страниц и номер страницы из callback_data кнопки page_keyboard"""
+    prefix, _, rest = callback_data.partition("_")
+    page_id, _, page = rest.rpartition("_")
+    if prefix != "page" or not page_id or not page.isdigit():
+        return None
+    return page_id, int(page)
+
+def get_page(page_id: str, page: int) -> Optional[Tuple[Chunk, InlineKeyboardMarkup]]:
+    """Страница ответа и клавиатура для нее (None, если страницы устарели)"""
+    pages = _page_cache.get(page_id)
+    if pages is None or not 0 <= page < len(pages):
+        return None
+    
+    return pages[page], page_keyboard(page_id, page, len(pages))
+
+def _is_parse_error(error: BadRequest) -> bool:
+    """Ошибка разбора разметки сообщения или слишком длинный после разметки текст"""
+    message = str(error).lower()
+    return "can't parse entities" in message or "message is too long" in message
+
+async def _send_chunk(bot, chat_id: int, chunk: Chunk, reply_markup: InlineKeyboardMarkup = None, **options):
+    """
+    Отправка части ответа; если Telegram не принял разметку или текст с ней
+    оказался слишком длинным - отправка без разметки
+    
+    options - дополнительные параметры send_message (тема форума, ответ на сообщение)
+    """
+    raw, formatted = chunk
+    
+    if formatted is not None:
+        try:
+            return await bot.send_message(
+                chat_id=chat_id, text=formatted, parse_mode="Markdown", reply_markup=reply_markup, **options
+            )
+        except BadRequest as e:
+            if not _is_parse_error(e):
+                raise
+            logger.warning(f"Telegram не принял ответ с разметкой, отправляем без нее: {e}")
+    
+    return await bot.send_message(chat_id=chat_id, text=raw, reply_markup=reply_markup, **options)
+
+async def edit_page(query, chunk: Chunk, reply_markup: InlineKeyboardMarkup) -> None:
+    """Показ страницы ответа в существующем сообщении"""
+    raw, formatted = chunk
+    
+    try:
+        if formatted is not None:
+            try:
+                await query.edit_message_text(text=formatted, parse_mode="Markdown", reply_markup=reply_markup)
+                return
+            except BadRequest as e:
+                if not _is_parse_error(e):
+                    raise
+        
+        await query.edit_message_text(text=raw, reply_markup=reply_markup)
+    except BadRequest as e:
+        # Повторное нажатие на кнопку текущей страницы
+        if "message is not modified" not in str(e).lower():
+            raise
+
+async def send_response(bot, chat_id: int, text: str, markdown: bool = True,
+                        message_thread_id: int = None, reply_to_message_id: int = None) -> None:
+    """
+    Отправка ответа любой длины
+    
+    Args:
+        bot: Экземпляр бота
+        chat_id: ID чата
+        text: Текст ответа
+        markdown: Приводить ли разметку ответа к Markdown Telegram
+        message_thread_id: Тема форума, в которую отправляется ответ
+        reply_to_message_id: Сообщение, на которое отвечает первая часть ответа
+    """
+    chunks = prepare_chunks(text, markdown)
+    if not chunks:
+        return
+    
+    options = {}
+    if message_thread_id:
+        options["message_thread_id"] = message_thread_id
+    reply_options = dict(options)
+    if reply_to_message_id:
+        reply_options["reply_to_message_id"] = reply_to_message_id
+    
+    # Очень длинный ответ - одно сообщение с переключением страниц
+    if config.RESPONSE_PAGINATION_ENABLED and len(chunks) > config.RESPONSE_PAGINATE_AFTER:
+        page_id = _page_cache.put(chunks)
+        await _send_chunk(bot, chat_id, chunks[0], page_keyboard(page_id, 0, len(chunks)), **reply_options)
+        return
+    
+    # Части уже подготовлены, поэтому отправляются подряд без пауз на обработку
+    for i, chunk in enumerate(chunks):
+        await _send_chunk(bot, chat_id, chunk, **(reply_options if i == 0 else options))
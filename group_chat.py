@@ -0,0 +1,145 @@
+"""
+Групповые чаты.
+
+В группе бот отвечает только на упоминание (@имя_бота) или ответ на свое
+сообщение. Остальные сообщения не обращаются ни к базе, ни к модели: они
+только добавляются в кольцевой буфер последних сообщений чата в памяти.
+Когда к боту обращаются, сообщения из буфера, появившиеся после прошлого
+обращения, добавляются к запросу как контекст разговора.
+
+История ответов бота общая для участников и хранится по (chat_id, thread_id),
+где thread_id - тема форума (0 для обычной группы).
+"""
+
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from telegram import Message, MessageEntity
+from config import get_config
+
+config = get_config()
+
+ChatKey = Tuple[int, int]
+
+# Дополнение к системному промпту режима в групповом чате
+GROUP_SYSTEM_PROMPT = (
+    "Ты участник группового чата. Сообщения участников подписаны их именами. "
+    "Отвечай тому, кто к тебе обратился, учитывая недавние сообщения в чате."
+)
+
+def chat_key(message: Message) -> ChatKey:
+    """Ключ разговора: чат и тема форума"""
+    thread_id = message.message_thread_id if message.is_topic_message else 0
+    return message.chat_id, thread_id or 0
+
+def is_addressed(message: Message, bot_id: int, bot_username: str) -> bool:
+    """Обращается ли сообщение к боту: упоминание или ответ на сообщение бота"""
+    reply = message.reply_to_message
+    # В теме форума сообщения без явного ответа ссылаются на служебное сообщение о создании темы
+    if reply is not None and not reply.forum_topic_created and reply.from_user and reply.from_user.id == bot_id:
+        return True
+    
+    mention = f"@{bot_username}".lower() if bot_username else None
+    entities = message.parse_entities([MessageEntity.MENTION, MessageEntity.TEXT_MENTION])
+    for entity, text in entities.items():
+        if entity.type == MessageEntity.MENTION and mention and text.lower() == mention:
+            return True
+        if entity.type == MessageEntity.TEXT_MENTION and entity.user and entity.user.id == bot_id:
+            return True
+    
+    return False
+
+def strip_mention(text: str, bot_username: str) -> str:
+    """Текст сообщения без упоминания бота"""
+    if not bot_username:
+        return text.strip()
+    
+    mention = f"@{bot_username}"
+    start = text.lower().find(mention.lower())
+    while start != -1:
+        text = text[:start] + text[start + len(mention):]
+        start = text.lower().find(mention.lower())
+    
+    return " ".join(text.split())
+
+class GroupBuffer:
+    """Последние сообщения групповых чатов в памяти (LRU по чатам)"""
+    
+    def __init__(self, size: int = None, max_chats: int = None, max_chars: int = None):
+        """Инициализация буфера"""
+        self.size = size or config.GROUP_BUFFER_SIZE
+        self.max_chats = max_chats or config.GROUP_BUFFER_MAX_CHATS
+        self.max_chars = max_chars or config.GROUP_MESSAGE_MAX_CHARS
+        self._chats: "OrderedDict[ChatKey, Deque[Tuple[int, str, str]]]" = OrderedDict()
+        # Последнее сообщение, уже переданное модели (по чатам)
+        self._answered: Dict[ChatKey, int] = {}
+        self._lock = threading.Lock()
+    
+    def add(self, key: ChatKey, message_id: int, author: str, text: str) -> None:
+        """Добавить сообщение чата"""
+        if len(text) > self.max_chars:
+            text = text[:self.max_chars] + "…"
+        
+        with self._lock:
+            messages = self._chats.get(key)
+            if messages is None:
+                messages = self._chats[key] = deque(maxlen=self.size)
+            else:
+                self._chats.move_to_end(key)
+            messages.append((message_id, author, text))
+            
+            while len(self._chats) > self.max_chats:
+                evicted, _ = self._chats.popitem(last=False)
+                self._answered.pop(evicted, None)
+    
+    def take_context(self, key: ChatKey, message_id: int, limit: int = None) -> List[Tuple[str, str]]:
+        """
+        Сообщения чата между прошлым обращением к боту и сообщением message_id
+        
+        Returns:
+            Последние limit пар (автор, текст) от старых к новым; следующий вызов
+            вернет только сообщения после message_id
+        """
+        limit = limit or config.GROUP_CONTEXT_MESSAGES
+        
+        with self._lock:
+            messages = self._chats.get(key)
+            if messages is None:
+                # Чата нет в буфере: отметка не нужна, все сообщения, которые в нем
+                # появятся, будут новее этого обращения (так _answered не растет
+                # сверх max_chats)
+                return []
+            
+            after = self._answered.get(key, 0)
+            self._answered[key] = max(after, message_id)
+            context = [(author, text) for msg_id, author, text in messages if after < msg_id < message_id]
+        
+        return context[-limit:]
+    
+    def clear(self, key: ChatKey) -> None:
+        """Забыть сообщения чата"""
+        with self._lock:
+            self._chats.pop(key, None)
+            self._answered.pop(key, None)
+
+_buffer: Optional[GroupBuffer] = None
+_buffer_lock = threading.Lock()
+
+def get_group_buffer() -> GroupBuffer:
+    """Общий буфер сообщений групповых чатов"""
+    global _buffer
+    
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = GroupBuffer()
+    
+    return _buffer
+
+def format_group_request(author: str, text: str, context: List[Tuple[str, str]]) -> str:
+    """Текст реплики для модели: недавние сообщения чата и обращение к боту"""
+    request = f"{author}: {text}"
+    if not context:
+        return request
+    
+    recent = "\n".join(f"{name}: {line}" for name, line in context)
+    return f"Недавние сообщения в чате:\n{recent}\n\nОбращение к тебе:\n{request}"
@@ -1,12 +1,17 @@
 import logging
+import os
+import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from database import (
-    get_user, update_user_settings, clear_chat_history, export_chat_history
-)
-from config import load_config, config
+from database import get_user, update_user_settings, clear_chat_history
+from config import get_config, AUTO_MODEL
+from utils import write_chat_export
+from memory import forget_user
+from delivery import get_page, edit_page, parse_page_callback
+from model_registry import get_model_registry
 
 logger = logging.getLogger(__name__)
+config = get_config()
 
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка callback-запросов от inline-кнопок"""
@@ -69,6 +74,12 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
     # Вернуться в меню настроек
     elif callback_data == "back_to_settings":
         await handle_back_to_settings(update, context)
+    
+    # Переключение страниц длинного ответа
+    elif callback_data.startswith("page_"):
+        selection = parse_page_callback(callback_data)
+        if selection is not None:
+            await handle_page_selection(update, context, *selection)
 
 async def handle_settings_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, setting_type: str) -> None:
     """Обработка callback-запросов для настроек"""
@@ -77,10 +88,17 @@ async def handle_settings_callback(update: Update, context: ContextTypes.DEFAULT
     
     if setting_type == "model":
         # Отображаем доступные модели
-        keyboard = []
-        for model in config.AVAILABLE_MODELS:
+        # Отображаем только модели, которые есть в каталоге OpenRouter
+        registry = get_model_registry()
+        keyboard = [[InlineKeyboardButton("🤖 Авто (по запросу)", callback_data=f"model_{AUTO_MODEL}")]]
+        for model in registry.available_models(config.AVAILABLE_MODELS):
             # Делаем короткие имена для моделей
             model_short = model.split("/")[-1].split(":")[0]
+            info = registry.get(model)
+            if info is not None:
+                model_short += f" · {info.context_length // 1000}K"
+                if info.supports_images:
+                    model_short += " 🖼"
             keyboard.append([InlineKeyboardButton(model_short, callback_data=f"model_{model}")])
         
         keyboard.append([InlineKeyboardButton("Назад", callback_data="back_to_settings")])
@@ -182,7 +200,10 @@ async def handle_model_selection(update: Update, context: ContextTypes.DEFAULT_T
     update_user_settings(user_id, {"model": model_name})
     
     # Получаем короткое имя модели для отображения
-    model_short = model_name.split("/")[-1].split(":")[0]
+    if model_name == AUTO_MODEL:
+        model_short = "авто (выбирается для каждого запроса)"
+    else:
+        model_short = model_name.split("/")[-1].split(":")[0]
     
     await query.edit_message_text(
         text=f"✅ Модель изменена на: {model_short}"
@@ -290,34 +311,46 @@ async def handle_back_to_settings(update: Update, context: ContextTypes.DEFAULT_
         reply_markup=reply_markup
     )
 
+async def handle_page_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, page_id: str, page: int) -> None:
+    """Показ выбранной страницы длинного ответа"""
+    query = update.callback_query
+    
+    result = get_page(page_id, page)
+    if result is None:
+        # Страницы удалены из кеша (устарели или бот перезапускался)
+        await query.edit_message_reply_markup(reply_markup=None)
+        return
+    
+    chunk, reply_markup = result
+    await edit_page(query, chunk, reply_markup)
+
 async def handle_export_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE, format_type: str) -> None:
     """Обработка подтверждения экспорта истории чата"""
     query = update.callback_query
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     
-    # Экспортируем историю чата
-    history_text = export_chat_history(user_id, format_type)
+    await query.edit_message_text(text="⏳ Готовлю экспорт истории чата...")
     
-    # Формируем имя файла
-    file_name = f"chat_history_{user_id}_{format_type}.{'txt' if format_type == 'text' else format_type}"
+    # Экспорт пишется потоково в сжатый файл в отдельном потоке
+    file_path = await asyncio.to_thread(write_chat_export, user_id, format_type)
     
-    # Сохраняем историю в файл
-    with open(file_name, "w", encoding="utf-8") as f:
-        f.write(history_text)
-    
-    # Отправляем файл пользователю
-    with open(file_name, "rb") as f:
-        await context.bot.send_document(
-            chat_id=chat_id,
-            document=f,
-            filename=file_name,
-            caption="📤 Экспорт истории чата"
-        )
+    if not file_path:
+        await query.edit_message_text(text="😔 Не удалось экспортировать историю чата.")
+        return
     
-    # Удаляем временный файл
-    import os
-    os.remove(file_name)
+    try:
+        # Отправляем файл пользователю
+        with open(file_path, "rb") as f:
+            await context.bot.send_document(
+                chat_id=chat_id,
+                document=f,
+                filename=os.path.basename(file_path),
+                caption="📤 Экспорт истории чата"
+            )
+    finally:
+        # Удаляем временный файл
+        os.remove(file_path)
     
     await query.edit_message_text(
         text=f"✅ История чата успешно экспортирована в формате {format_type.upper()}"
@@ -328,8 +361,9 @@ async def handle_clear_confirmation(update: Update, context: ContextTypes.DEFAUL
     query = update.callback_query
     user_id = update.effective_user.id
     
-    # Очищаем историю чата
+    # Очищаем историю чата и долговременную память
     clear_chat_history(user_id)
+    forget_user(user_id)
     
     await query.edit_message_text(
         text="✅ История чата успешно очищена"
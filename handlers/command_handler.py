@@ -1,12 +1,17 @@
+import os
+import asyncio
 import logging
 import json
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from config import load_config
-from database import get_user, create_or_update_user, update_user_settings, get_user_stats
+from config import get_config
+from database import get_user, create_or_update_user, update_user_settings, get_user_stats, search_messages
+from utils import format_timestamp, truncate_text
+from profiler import is_admin, run_profiler, format_top_functions
+from quotas import get_quota_manager, format_tokens, PERIODS, PERIOD_NAMES
 
 logger = logging.getLogger(__name__)
-config = load_config()
+config = get_config()
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка команды /start"""
@@ -39,7 +44,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         "/clear - Очистить историю чата\n"
         "/mode - Изменить режим общения\n"
         "/schedule - Запланировать сообщение\n"
-        "/template - Управление шаблонами\n\n"
+        "/template - Управление шаблонами\n"
+        "/search - Поиск по истории чата\n\n"
         "🚀 Просто напишите мне сообщение или отправьте изображение, и я помогу вам!"
     )
     
@@ -60,7 +66,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "/clear - Очистить историю чата\n"
         "/mode - Изменить режим общения\n"
         "/template <название> - Использовать шаблон\n"
-        "/schedule - Запланировать сообщение\n\n"
+        "/schedule - Запланировать сообщение\n"
+        "/search <запрос> - Поиск по истории чата\n\n"
         "💡 Особенности:\n"
         "• Отправьте текстовое сообщение для обычного общения\n"
         "• Отправьте изображение для его анализа\n"
@@ -176,12 +183,103 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             for day, count in sorted(stats["activity_by_day"].items())
         ])
     
+    # Остаток квоты токенов
+    quota = get_quota_manager().status(user.id)
+    quota_lines = []
+    for period in PERIODS:
+        remaining = quota.remaining(period)
+        if remaining is None:
+            quota_lines.append(f"  • {PERIOD_NAMES[period]}: без ограничения")
+        else:
+            quota_lines.append(
+                f"  • {PERIOD_NAMES[period]}: осталось {format_tokens(remaining)} "
+                f"из {format_tokens(quota.limits[period])}"
+            )
+    quota_text = "\n".join(quota_lines)
+    
     stats_text = (
         "📊 Статистика использования бота:\n\n"
         f"💬 Всего сообщений: {stats.get('message_count', 0)}\n\n"
         f"🤖 Использование моделей:\n{models_text}\n\n"
         f"🔄 Типы запросов:\n{requests_text}\n\n"
         f"📅 Активность по дням недели:\n{activity_text}\n\n"
+        f"🎫 Квота токенов (тариф {quota.tier}):\n{quota_text}\n\n"
     )
     
     await context.bot.send_message(chat_id=chat_id, text=stats_text)
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработка команды /search"""
+    user = update.effective_user
+    chat_id = update.effective_chat.id
+    
+    query = " ".join(context.args or [])
+    
+    if not query:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="🔍 Использование: /search <запрос>\n\nПример: /search рецепт борща"
+        )
+        return
+    
+    results = search_messages(user.id, query, limit=10)
+    
+    if not results:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"🔍 По запросу «{truncate_text(query, 50)}» ничего не найдено."
+        )
+        return
+    
+    lines = []
+    for result in results:
+        author = "Вы" if result["role"] == "user" else "Бот"
+        lines.append(f"[{format_timestamp(result['timestamp'])}] {author}: {result['snippet']}")
+    
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=f"🔍 Результаты поиска «{truncate_text(query, 50)}»:\n\n" + "\n\n".join(lines)
+    )
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработка команды /profile [секунды] (только для администраторов)"""
+    user = update.effective_user
+    chat_id = update.effective_chat.id
+    
+    if not is_admin(user.id):
+        await context.bot.send_message(chat_id=chat_id, text="⛔ Команда доступна только администраторам.")
+        return
+    
+    seconds = config.PROFILER_SIGNAL_SECONDS
+    if context.args:
+        try:
+            seconds = int(context.args[0])
+        except ValueError:
+            await context.bot.send_message(chat_id=chat_id, text="Использование: /profile [секунды]")
+            return
+    seconds = min(max(seconds, 1), config.PROFILER_MAX_SECONDS)
+    
+    await context.bot.send_message(chat_id=chat_id, text=f"⏱ Профилирование запущено на {seconds} с...")
+    
+    # Профиль снимается в фоне, чтобы не задерживать обработку других обновлений
+    context.application.create_task(send_profile(context.bot, chat_id, seconds))
+
+async def send_profile(bot, chat_id: int, seconds: int) -> None:
+    """Профилирование и отправка результата администратору"""
+    result = await asyncio.to_thread(run_profiler, seconds)
+    
+    if result is None:
+        await bot.send_message(chat_id=chat_id, text="Профилирование уже выполняется, дождитесь результата.")
+        return
+    
+    path, top = result
+    with open(path, "rb") as f:
+        await bot.send_document(
+            chat_id=chat_id,
+            document=f,
+            filename=os.path.basename(path),
+            caption="🔥 Профиль в формате folded (flamegraph.pl, speedscope)"
+        )
+    
+    if top:
+        await bot.send_message(chat_id=chat_id, text="Самые частые функции:\n" + format_top_functions(top))
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from telegram import ChatMember, Update
+from telegram.ext import ContextTypes
+from ai_client import AIClient
+from database import get_user, create_or_update_user, add_group_message, get_group_history, clear_group_history
+from config import get_config
+from delivery import send_response
+from group_chat import (
+    GROUP_SYSTEM_PROMPT, chat_key, is_addressed, strip_mention, get_group_buffer, format_group_request
+)
+from handlers.text_handler import prepare_request
+from profiler import is_admin
+from quotas import get_quota_manager, quota_exceeded_text
+from utils import estimate_message_tokens
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработка текстовых сообщений в групповых чатах"""
+    message = update.effective_message
+    user = update.effective_user
+    if message is None or user is None or not message.text:
+        return
+    
+    key = chat_key(message)
+    author = user.full_name or user.username or str(user.id)
+    buffer = get_group_buffer()
+    
+    # Сообщения, не обращенные к боту, только запоминаются в памяти
+    if not is_addressed(message, context.bot.id, context.bot.username):
+        buffer.add(key, message.message_id, author, message.text)
+        return
+    
+    chat_id, thread_id = key
+    text = strip_mention(message.text, context.bot.username) or "Привет!"
+    
+    # Настройки и квота - того, кто обратился к боту
+    create_or_update_user(
+        user_id=user.id,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name
+    )
+    user_info = get_user(user.id)
+    settings = user_info.get('settings', {})
+    
+    # Режим разговора и общая история чата; буфер становится частью запроса только сейчас
+    conversation_mode = settings.get('conversation_mode', 'friendly')
+    system_prompt = config.CONVERSATION_MODES[conversation_mode]["system_prompt"]
+    request_text = format_group_request(author, text, buffer.take_context(key, message.message_id))
+    
+    messages = [
+        {"role": "system", "content": [{"type": "text", "text": f"{system_prompt}\n\n{GROUP_SYSTEM_PROMPT}"}]},
+        *get_group_history(chat_id, thread_id, limit=config.GROUP_HISTORY_LIMIT),
+        {"role": "user", "content": [{"type": "text", "text": request_text}]}
+    ]
+    messages, model, max_tokens = prepare_request(messages, settings, conversation_mode)
+    
+    quota = get_quota_manager().check(user.id, sum(estimate_message_tokens(item) for item in messages))
+    if not quota.allowed:
+        await message.reply_text(quota_exceeded_text(quota))
+        return
+    
+    await context.bot.send_chat_action(
+        chat_id=chat_id, action="typing", message_thread_id=thread_id or None
+    )
+    
+    # В истории сохраняется только обращение к боту, без сообщений из буфера
+    add_group_message(chat_id, thread_id, user.id, "user", f"{author}: {text}")
+    
+    response = await asyncio.to_thread(
+        AIClient().generate_response,
+        user_id=user.id,
+        messages=messages,
+        model=model,
+        temperature=settings.get('temperature', config.DEFAULT_TEMP),
+        max_tokens=max_tokens,
+        conversation_mode=conversation_mode
+    )
+    
+    if response:
+        add_group_message(chat_id, thread_id, user.id, "assistant", response)
+        await send_response(
+            context.bot, chat_id, response,
+            message_thread_id=thread_id or None,
+            reply_to_message_id=message.message_id
+        )
+    else:
+        await message.reply_text("😔 Извините, произошла ошибка при генерации ответа. Пожалуйста, попробуйте еще раз.")
+
+async def clear_group_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработка команды /clear в группе: общая история чата (темы), только для администраторов"""
+    message = update.effective_message
+    user = update.effective_user
+    if message is None or user is None:
+        return
+    
+    # Анонимный администратор пишет от имени самого чата
+    allowed = is_admin(user.id) or (message.sender_chat is not None and message.sender_chat.id == message.chat_id)
+    if not allowed:
+        member = await context.bot.get_chat_member(message.chat_id, user.id)
+        allowed = member.status in (ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+    
+    if not allowed:
+        await message.reply_text("Очистить историю группы могут только администраторы чата.")
+        return
+    
+    key = chat_key(message)
+    clear_group_history(*key)
+    get_group_buffer().clear(key)
+    
+    await message.reply_text("🧹 История разговора с ботом в этом чате очищена.")
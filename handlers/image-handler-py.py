@@ -8,10 +8,13 @@ from database import (
     get_user, create_or_update_user, add_message,
     add_media, get_chat_history
 )
-from config import load_config
+from delivery import send_response
+from config import get_config
+from quotas import get_quota_manager, quota_exceeded_text
+from utils import IMAGE_TOKENS, MESSAGE_OVERHEAD_TOKENS, estimate_tokens
 
 logger = logging.getLogger(__name__)
-config = load_config()
+config = get_config()
 
 async def handle_image_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка сообщений с изображениями"""
@@ -30,6 +33,13 @@ async def handle_image_message(update: Update, context: ContextTypes.DEFAULT_TYP
     user_info = get_user(user.id)
     settings = user_info.get('settings', {})
     
+    # Квота проверяется до скачивания изображения и запроса к модели
+    caption_text = update.message.caption or "Что на этом изображении?"
+    quota = get_quota_manager().check(user.id, MESSAGE_OVERHEAD_TOKENS + IMAGE_TOKENS + estimate_tokens(caption_text))
+    if not quota.allowed:
+        await context.bot.send_message(chat_id=chat_id, text=quota_exceeded_text(quota))
+        return
+    
     # Отправляем сообщение о начале обработки
     processing_message = await context.bot.send_message(
         chat_id=chat_id,
@@ -63,9 +73,6 @@ async def handle_image_message(update: Update, context: ContextTypes.DEFAULT_TYP
         processed_text=file_path
     )
     
-    # Извлекаем текст из описания к изображению (если есть)
-    caption_text = update.message.caption or "Что на этом изображении?"
-    
     # Добавляем сообщение пользователя в историю
     add_message(
         user_id=user.id,
@@ -105,8 +112,8 @@ async def handle_image_message(update: Update, context: ContextTypes.DEFAULT_TYP
             message_type="text"
         )
         
-        # Отправляем ответ пользователю
-        await context.bot.send_message(chat_id=chat_id, text=response)
+        # Отправляем ответ пользователю (длинные ответы - по частям или постранично)
+        await send_response(context.bot, chat_id, response)
     else:
         # В случае ошибки
         await context.bot.send_message(
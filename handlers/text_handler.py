@@ -1,18 +1,47 @@
 import logging
-import os
-import time
+import asyncio
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from ai_client import AIClient
 from database import (
     get_user, create_or_update_user, add_message, get_chat_history,
-    clear_chat_history, export_chat_history, add_scheduled_message
+    clear_chat_history, export_chat_history, add_scheduled_message,
+    get_messages_since, get_chat_summary, save_chat_summary
 )
-from config import load_config, config
+from config import get_config, AUTO_MODEL
+from memory import recall_context, remember_turn
+from delivery import send_response
+from model_registry import get_model_registry
+from model_router import route_model
+from utils import fit_messages_to_context, without_images, estimate_message_tokens
+from quotas import get_quota_manager, quota_exceeded_text
 
 logger = logging.getLogger(__name__)
-config = load_config()
+config = get_config()
+
+def prepare_request(messages: List[Dict], settings: Dict, conversation_mode: str) -> Tuple[List[Dict], str, int]:
+    """
+    Подгонка запроса под возможности модели из каталога OpenRouter:
+    изображения - только для мультимодальных, история - в пределах контекста
+    
+    Returns:
+        (сообщения, модель, длина ответа)
+    """
+    registry = get_model_registry()
+    model = settings.get('model', config.DEFAULT_MODEL)
+    max_tokens = settings.get('max_tokens', config.DEFAULT_MAX_TOKENS)
+    if model == AUTO_MODEL:
+        # Модель выбирается по размеру запроса, изображениям и целевой задержке режима
+        model = route_model(messages, max_tokens, conversation_mode)
+    model = registry.resolve(model, [config.DEFAULT_MODEL, *config.AVAILABLE_MODELS])
+    max_tokens = registry.max_completion_tokens(model, max_tokens)
+    if not registry.supports_images(model):
+        messages = without_images(messages)
+    messages = fit_messages_to_context(messages, registry.context_length(model) - max_tokens)
+    
+    return messages, model, max_tokens
 
 async def handle_text_message(
     update: Update, 
@@ -22,8 +51,7 @@ async def handle_text_message(
     clear: bool = False,
     change_mode: bool = False,
     template: bool = False,
-    schedule: bool = False,
-    voice: bool = False
+    schedule: bool = False
 ) -> None:
     """Обработка текстовых сообщений"""
     user = update.effective_user
@@ -61,47 +89,22 @@ async def handle_text_message(
         await handle_schedule(update, context)
         return
     
-    # Если это голосовое сообщение, сначала его нужно преобразовать в текст
-    if voice:
-        voice_file = await update.message.voice.get_file()
-        voice_path = f"temp_voice_{user.id}_{int(time.time())}.ogg"
-        await voice_file.download_to_drive(voice_path)
-        
-        # Здесь должен быть код для преобразования голоса в текст
-        # Можно использовать библиотеку SpeechRecognition или Whisper API
-        # Для примера просто сообщаем, что функция в разработке
-        
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="🎤 Получено голосовое сообщение. Функция преобразования голоса в текст находится в разработке."
-        )
-        
-        # Удаляем временный файл
-        if os.path.exists(voice_path):
-            os.remove(voice_path)
-        
-        return
-    
-    # Получаем текст сообщения
-    message_text = update.message.text
-    
-    # Отправляем индикатор набора текста
-    await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-    
-    # Добавляем сообщение пользователя в историю
-    add_message(
-        user_id=user.id,
-        role="user",
-        content=message_text,
-        message_type="text"
-    )
-    
-    # Получаем историю чата для контекста
-    chat_history = get_chat_history(user.id, limit=10)
-    
-    # Инициализируем клиент AI
-    ai_client = AIClient()
+    await reply_to_text(context, chat_id, user.id, settings, update.message.text)
+
+async def reply_to_text(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    user_id: int,
+    settings: Dict,
+    message_text: str,
+    message_type: str = "text"
+) -> None:
+    """
+    Ответ модели на реплику пользователя (текст или распознанное голосовое сообщение)
     
+    Квота проверяется до сохранения реплики в истории, запрос к модели
+    выполняется в отдельном потоке.
+    """
     # Получаем системный промпт для текущего режима разговора
     conversation_mode = settings.get('conversation_mode', 'friendly')
     system_prompt = config.CONVERSATION_MODES[conversation_mode]["system_prompt"]
@@ -112,28 +115,67 @@ async def handle_text_message(
         "content": [{"type": "text", "text": system_prompt}]
     }
     
-    messages = [system_message] + chat_history
+    # Новая реплика сохраняется в истории только после проверки квоты,
+    # поэтому в запрос она добавляется отдельно от сохраненной истории
+    user_message = {
+        "role": "user",
+        "content": [{"type": "text", "text": message_text}]
+    }
     
-    # Генерируем ответ от AI
-    response = ai_client.generate_response(
-        user_id=user.id,
+    # Добавляем релевантные фрагменты прошлых разговоров (если память включена).
+    # Они меняются от запроса к запросу, поэтому передаются в самой новой реплике:
+    # системный промпт и история остаются неизменным кешируемым префиксом
+    memory_part = await asyncio.to_thread(recall_context, user_id, message_text)
+    if memory_part:
+        user_message["content"].insert(0, memory_part)
+    
+    messages = [system_message] + get_chat_history(user_id, limit=9) + [user_message]
+    
+    messages, model, max_tokens = prepare_request(messages, settings, conversation_mode)
+    
+    # Квота проверяется по оценке размера истории и новой реплики до того,
+    # как сообщение попадет в историю: отклоненный запрос не остается в ней
+    quota = get_quota_manager().check(user_id, sum(estimate_message_tokens(message) for message in messages))
+    if not quota.allowed:
+        await context.bot.send_message(chat_id=chat_id, text=quota_exceeded_text(quota))
+        return
+    
+    # Отправляем индикатор набора текста
+    await context.bot.send_chat_action(chat_id=chat_id, action="typing")
+    
+    # Добавляем сообщение пользователя в историю
+    add_message(
+        user_id=user_id,
+        role="user",
+        content=message_text,
+        message_type=message_type
+    )
+    
+    # Генерируем ответ в отдельном потоке, не блокируя обработку других обновлений
+    response = await asyncio.to_thread(
+        AIClient().generate_response,
+        user_id=user_id,
         messages=messages,
-        model=settings.get('model', config.DEFAULT_MODEL),
+        model=model,
         temperature=settings.get('temperature', config.DEFAULT_TEMP),
-        max_tokens=settings.get('max_tokens', config.DEFAULT_MAX_TOKENS)
+        max_tokens=max_tokens,
+        conversation_mode=conversation_mode
     )
     
     if response:
         # Добавляем ответ в историю
         add_message(
-            user_id=user.id,
+            user_id=user_id,
             role="assistant",
             content=response,
             message_type="text"
         )
         
-        # Отправляем ответ пользователю
-        await context.bot.send_message(chat_id=chat_id, text=response)
+        # Запоминаем пару реплик для долговременной памяти
+        await asyncio.to_thread(remember_turn, user_id, message_text, response)
+        
+        # Отправляем ответ пользователю (длинные ответы - по частям или постранично)
+        await send_response(context.bot, chat_id, response)
     else:
         # В случае ошибки
         await context.bot.send_message(
@@ -141,84 +183,116 @@ async def handle_text_message(
             text="😔 Извините, произошла ошибка при генерации ответа. Пожалуйста, попробуйте еще раз."
         )
 
-async def handle_summary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработка команды /summary"""
-    user = update.effective_user
-    chat_id = update.effective_chat.id
-    
-    # Получаем историю чата
-    chat_history = get_chat_history(user.id, limit=20)
-    
-    if not chat_history:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="Нет истории чата для суммирования."
-        )
-        return
-    
-    # Отправляем индикатор набора текста
-    await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-    
-    # Получаем настройки пользователя
-    user_info = get_user(user.id)
-    settings = user_info.get('settings', {})
-    
-    # Преобразуем историю в текст для суммирования
+def summary_request(summary: Optional[str], new_messages: List[Dict]) -> List[Dict]:
+    """Промпт для резюме: новые сообщения вместе с предыдущим резюме (если оно есть)"""
+    # Преобразуем новые сообщения в текст для суммирования
     history_text = ""
-    for msg in chat_history:
-        role = msg.get("role", "")
-        content = msg.get("content", [])
-        
-        if role == "user":
+    for msg in new_messages:
+        if msg["role"] == "user":
             author = "Пользователь"
-        elif role == "assistant":
+        elif msg["role"] == "assistant":
             author = "Ассистент"
         else:
             continue
         
-        # Извлекаем текст из содержимого
-        text = ""
-        for item in content:
-            if item.get("type") == "text":
-                text += item.get("text", "")
-        
-        history_text += f"{author}: {text}\n\n"
+        if msg["content"]:
+            history_text += f"{author}: {msg['content']}\n\n"
     
-    # Формируем промпт для суммирования
-    summary_prompt = [
+    if summary:
+        request_text = (
+            f"Вот резюме разговора до этого момента:\n\n{summary}\n\n"
+            f"Обнови резюме с учетом новых сообщений:\n\n{history_text}"
+        )
+    else:
+        request_text = f"Пожалуйста, суммируй следующий разговор:\n\n{history_text}"
+    
+    return [
         {
             "role": "system",
             "content": [{"type": "text", "text": "Ты аналитический ассистент. Твоя задача - кратко суммировать ключевые моменты разговора."}]
         },
         {
             "role": "user",
-            "content": [{"type": "text", "text": f"Пожалуйста, суммируй следующий разговор:\n\n{history_text}"}]
+            "content": [{"type": "text", "text": request_text}]
         }
     ]
+
+async def handle_summary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработка команды /summary"""
+    user = update.effective_user
+    chat_id = update.effective_chat.id
+    
+    # Резюме обновляется инкрементально: сообщения после последнего учтенного
+    # читаются от старых к новым окнами по SUMMARY_MAX_NEW_MESSAGES, и каждое
+    # окно добавляется к предыдущему резюме
+    cached = get_chat_summary(user.id)
+    summary = cached["summary"] if cached else None
+    last_message_id = cached["last_message_id"] if cached else 0
+    new_messages = get_messages_since(user.id, last_message_id, limit=config.SUMMARY_MAX_NEW_MESSAGES)
+    
+    if not new_messages:
+        if cached:
+            # Новых сообщений нет - отдаем сохраненное резюме без обращения к модели
+            await send_summary(context, chat_id, cached["summary"])
+        else:
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text="Нет истории чата для суммирования."
+            )
+        return
+    
+    # Отправляем индикатор набора текста
+    await context.bot.send_chat_action(chat_id=chat_id, action="typing")
+    
+    # Получаем настройки пользователя
+    user_info = get_user(user.id)
+    settings = user_info.get('settings', {})
     
     # Инициализируем клиент AI
     ai_client = AIClient()
     
-    # Генерируем суммирование
-    summary = ai_client.generate_response(
-        user_id=user.id,
-        messages=summary_prompt,
-        model=settings.get('model', config.DEFAULT_MODEL),
-        temperature=0.3,  # Используем низкую температуру для точности
-        max_tokens=500  # Ограничиваем длину суммирования
-    )
-    
-    if summary:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=f"📝 *Суммирование разговора:*\n\n{summary}",
-            parse_mode="Markdown"
-        )
-    else:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="😔 Извините, не удалось суммировать разговор. Пожалуйста, попробуйте еще раз."
+    updated = False
+    for _ in range(config.SUMMARY_MAX_WINDOWS):
+        summary_prompt = summary_request(summary, new_messages)
+        
+        quota = get_quota_manager().check(user.id, sum(estimate_message_tokens(message) for message in summary_prompt))
+        if not quota.allowed:
+            await context.bot.send_message(chat_id=chat_id, text=quota_exceeded_text(quota))
+            break
+        
+        # Генерируем суммирование в отдельном потоке, не блокируя обработку других обновлений
+        result = await asyncio.to_thread(
+            ai_client.generate_response,
+            user_id=user.id,
+            messages=summary_prompt,
+            model=settings.get('model', config.DEFAULT_MODEL),
+            temperature=0.3,  # Используем низкую температуру для точности
+            max_tokens=500  # Ограничиваем длину суммирования
         )
+        
+        if not result:
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text="😔 Извините, не удалось суммировать разговор. Пожалуйста, попробуйте еще раз."
+            )
+            break
+        
+        # Отметка сдвигается только до последнего сообщения, переданного модели
+        summary = result
+        updated = True
+        save_chat_summary(user.id, summary, new_messages[-1]["id"])
+        new_messages = get_messages_since(user.id, new_messages[-1]["id"], limit=config.SUMMARY_MAX_NEW_MESSAGES)
+        if not new_messages:
+            break
+    
+    if updated:
+        if new_messages:
+            summary += "\n\n(Учтена не вся история: повторите /summary, чтобы дополнить резюме.)"
+        await send_summary(context, chat_id, summary)
+
+async def send_summary(context: ContextTypes.DEFAULT_TYPE, chat_id: int, summary: str) -> None:
+    """Отправка резюме разговора пользователю"""
+    await send_response(context.bot, chat_id, f"📝 **Суммирование разговора:**\n\n{summary}")
 
 async def handle_export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка команды /export"""
@@ -230,6 +304,10 @@ async def handle_export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         [
             InlineKeyboardButton("Текст (TXT)", callback_data="export_text"),
             InlineKeyboardButton("JSON", callback_data="export_json")
+        ],
+        [
+            InlineKeyboardButton("NDJSON", callback_data="export_ndjson"),
+            InlineKeyboardButton("CSV", callback_data="export_csv")
         ]
     ]
     
@@ -412,7 +490,7 @@ async def handle_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 text=f"Время установлено на *{time_str}*. Теперь введите текст сообщения:",
                 parse_mode="Markdown"
             )
-            
+        
         except ValueError:
             await context.bot.send_message(
                 chat_id=chat_id,
@@ -461,7 +539,7 @@ async def handle_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                  f"Текст сообщения: {message_text}",
             parse_mode="Markdown"
         )
-        
+    
     except ValueError:
         await context.bot.send_message(
             chat_id=chat_id,
@@ -1,12 +1,22 @@
 #!/usr/bin/env python
 import logging
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler
-from config import load_config
-from handlers.command_handler import start_command, help_command, settings_command, stats_command
+from config import init_config, with_config_snapshot, ConfigWatcher
+from handlers.command_handler import start_command, help_command, settings_command, stats_command, search_command, profile_command
 from handlers.text_handler import handle_text_message
 from handlers.image_handler import handle_image_message
 from handlers.callback_handler import handle_callback_query
-from database import init_db
+from voice_handler import handle_voice_message
+from handlers.group_handler import handle_group_message, clear_group_command
+from database import init_db, shutdown_db, get_write_metrics
+from retention import RetentionManager
+from backup import BackupManager
+from outbound import create_outbound_queue, get_outbound_metrics
+from model_registry import get_model_registry
+from quotas import get_quota_manager
+from metrics import timed_handler, register_gauge, start_metrics_server
+from tracing import trace_handler, create_bot_request
+from profiler import watch_update, install_profiler_signal
 
 # Настройка логирования
 logging.basicConfig(
@@ -15,36 +25,147 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def check_privacy_mode(application: Application) -> None:
+    """Проверка режима приватности бота для работы в группах"""
+    # После initialize() сведения о боте из getMe уже получены
+    if application.bot.can_read_all_group_messages:
+        logger.info("Режим приватности выключен: бот видит все сообщения групп")
+    else:
+        logger.warning(
+            "Режим приватности включен: в группах бот получает только команды, упоминания "
+            "и ответы на свои сообщения, поэтому контекст недавних сообщений чата будет пустым. "
+            "Отключите его в @BotFather (/setprivacy) и заново добавьте бота в группы"
+        )
+
+async def on_shutdown(application: Application) -> None:
+    """Сброс отложенных записей в базу данных при остановке бота"""
+    shutdown_db()
+
+def instrumented(name: str):
+    """
+    Обертка обработчика: время в метриках, корневой спан трассировки, запись
+    медленных обновлений и один снимок конфигурации на все обновление
+    """
+    def decorator(func):
+        return timed_handler(name)(trace_handler(name)(watch_update(name)(with_config_snapshot(func))))
+    return decorator
+
+def register_queue_gauges() -> None:
+    """Показатели очередей для /metrics"""
+    register_gauge(
+        "outbound_queue_depth", "Запросы к Telegram, ожидающие отправки",
+        lambda: {(lane,): get_outbound_metrics().get(f"queue_{lane}", 0) for lane in ("high", "normal", "low")},
+        ("lane",)
+    )
+    register_gauge(
+        "outbound_retry_after_total", "Ответы RetryAfter от Telegram",
+        lambda: {(): get_outbound_metrics().get("retry_after", 0)}
+    )
+    register_gauge(
+        "outbound_throttled_total", "Запросы, ожидавшие токен лимита отправки",
+        lambda: {(): get_outbound_metrics().get("throttled", 0)}
+    )
+    register_gauge(
+        "outbound_dropped_total", "Индикаторы действий, устаревшие в очереди",
+        lambda: {(): get_outbound_metrics().get("dropped", 0)}
+    )
+    register_gauge(
+        "db_write_buffer_pending", "Строки в буфере отложенной записи",
+        lambda: {(): get_write_metrics().get("pending", 0)}
+    )
+
+def build_application(config, base_url: str = None, concurrent_updates=None) -> Application:
+    """
+    Создание приложения со всеми обработчиками
+    
+    Args:
+        config: Конфигурация бота
+        base_url: Адрес Bot API (например, эмулятор из benchmarks/load_test.py)
+        concurrent_updates: Параллельная обработка обновлений (по умолчанию - последовательная)
+    """
+    # Исходящие запросы проходят через общую очередь с лимитами Telegram
+    builder = Application.builder().token(config.TELEGRAM_TOKEN).post_shutdown(on_shutdown)
+    if base_url:
+        builder = builder.base_url(base_url)
+    if concurrent_updates is not None:
+        builder = builder.concurrent_updates(concurrent_updates)
+    # При включенной трассировке каждый вызов Bot API - дочерний спан обновления
+    bot_request = create_bot_request(connection_pool_size=256)
+    if bot_request is not None:
+        builder = builder.request(bot_request)
+    outbound_queue = create_outbound_queue()
+    if outbound_queue is not None:
+        builder = builder.rate_limiter(outbound_queue)
+    if config.GROUP_MODE_ENABLED:
+        builder = builder.post_init(check_privacy_mode)
+    application = builder.build()
+    
+    # Добавление обработчиков команд; команды с историей и настройками пользователя - только в личных чатах
+    private = filters.ChatType.PRIVATE
+    application.add_handler(CommandHandler("start", instrumented("command_start")(start_command)))
+    application.add_handler(CommandHandler("help", instrumented("command_help")(help_command)))
+    application.add_handler(CommandHandler("settings", instrumented("command_settings")(settings_command), filters=private))
+    application.add_handler(CommandHandler("stats", instrumented("command_stats")(stats_command), filters=private))
+    application.add_handler(CommandHandler("search", instrumented("command_search")(search_command), filters=private))
+    application.add_handler(CommandHandler("profile", instrumented("command_profile")(profile_command), filters=private))
+    application.add_handler(CommandHandler("summary", instrumented("command_summary")(lambda update, context: handle_text_message(update, context, summarize=True)), filters=private))
+    application.add_handler(CommandHandler("export", instrumented("command_export")(lambda update, context: handle_text_message(update, context, export=True)), filters=private))
+    application.add_handler(CommandHandler("clear", instrumented("command_clear")(lambda update, context: handle_text_message(update, context, clear=True)), filters=private))
+    application.add_handler(CommandHandler("mode", instrumented("command_mode")(lambda update, context: handle_text_message(update, context, change_mode=True)), filters=private))
+    application.add_handler(CommandHandler("template", instrumented("command_template")(lambda update, context: handle_text_message(update, context, template=True)), filters=private))
+    application.add_handler(CommandHandler("schedule", instrumented("command_schedule")(lambda update, context: handle_text_message(update, context, schedule=True)), filters=private))
+    
+    # Обработчик callback-запросов (для inline-кнопок)
+    application.add_handler(CallbackQueryHandler(instrumented("callback")(handle_callback_query)))
+    
+    # Обработчики сообщений в личных чатах
+    application.add_handler(MessageHandler(filters.PHOTO & private, instrumented("image")(handle_image_message)))
+    application.add_handler(MessageHandler(filters.VOICE & private, instrumented("voice")(handle_voice_message)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & private, instrumented("text")(handle_text_message)))
+    
+    # В группах бот отвечает только на упоминание или ответ на свое сообщение
+    if config.GROUP_MODE_ENABLED:
+        groups = filters.ChatType.GROUPS
+        application.add_handler(CommandHandler("clear", instrumented("command_clear_group")(clear_group_command), filters=groups))
+        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & groups, instrumented("group")(handle_group_message)))
+    
+    return application
+
 def main():
     """Запуск бота"""
-    # Загрузка конфигурации
-    config = load_config()
+    # Конфигурация загружается один раз и используется всеми модулями
+    config = init_config()
+    
+    # Модели, режимы и шаблоны из user_config.json применяются без перезапуска
+    if config.CONFIG_WATCH_ENABLED:
+        ConfigWatcher().start()
     
     # Инициализация базы данных
     init_db()
     
-    # Создание приложения
-    application = Application.builder().token(config.TELEGRAM_TOKEN).build()
-    
-    # Добавление обработчиков команд
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("settings", settings_command))
-    application.add_handler(CommandHandler("stats", stats_command))
-    application.add_handler(CommandHandler("summary", lambda update, context: handle_text_message(update, context, summarize=True)))
-    application.add_handler(CommandHandler("export", lambda update, context: handle_text_message(update, context, export=True)))
-    application.add_handler(CommandHandler("clear", lambda update, context: handle_text_message(update, context, clear=True)))
-    application.add_handler(CommandHandler("mode", lambda update, context: handle_text_message(update, context, change_mode=True)))
-    application.add_handler(CommandHandler("template", lambda update, context: handle_text_message(update, context, template=True)))
-    application.add_handler(CommandHandler("schedule", lambda update, context: handle_text_message(update, context, schedule=True)))
+    # Каталог моделей OpenRouter: из кеша на диске или загрузка при запуске
+    get_model_registry()
     
-    # Обработчик callback-запросов (для inline-кнопок)
-    application.add_handler(CallbackQueryHandler(handle_callback_query))
+    # Квоты токенов: счетчики из usage_stats и их периодическая сверка
+    if config.QUOTA_ENABLED:
+        get_quota_manager().start()
+    
+    # Фоновая очистка устаревших данных
+    if config.RETENTION_ENABLED:
+        RetentionManager().start()
+    
+    # Резервное копирование базы данных
+    if config.BACKUP_ENABLED and config.DB_BACKEND == "sqlite":
+        BackupManager().start()
+    
+    application = build_application(config)
+    
+    # Метрики: глубина очередей и HTTP-эндпоинт /metrics
+    register_queue_gauges()
+    start_metrics_server()
     
-    # Обработчики сообщений
-    application.add_handler(MessageHandler(filters.PHOTO, handle_image_message))
-    application.add_handler(MessageHandler(filters.VOICE, lambda update, context: handle_text_message(update, context, voice=True)))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
+    # Профилирование по сигналу SIGUSR1
+    install_profiler_signal()
     
     # Запуск бота
     logger.info("Бот запущен")
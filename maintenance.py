@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+Служебные операции с базой данных бота.
+
+Примеры:
+    python maintenance.py rebuild-stats
+    python maintenance.py rebuild-stats --user 123456
+    python maintenance.py reindex-search
+    python maintenance.py rebuild-memory --user 123456
+    python maintenance.py retention
+    python maintenance.py enable-incremental-vacuum
+    python maintenance.py backup
+    python maintenance.py users-per-setting model
+    python maintenance.py cache-stats --days 7
+    python maintenance.py traces --slowest 10
+    python maintenance.py check-config
+    python maintenance.py restore backups/backup_20250101_120000.db.gz
+"""
+
+import sys
+import time
+import logging
+import argparse
+from database import (
+    init_db, rebuild_stats_rollups, rebuild_search_index, get_users_per_setting, get_prompt_cache_stats,
+    enable_incremental_vacuum
+)
+from retention import RetentionManager
+from utils import create_backup, restore_backup
+from storage import SETTINGS_COLUMNS
+from memory import rebuild_user_memory
+from tracing import load_traces, format_trace
+from config import Config, read_user_config, apply_user_config, validate_config, USER_CONFIG_PATH
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def cmd_rebuild_stats(args) -> int:
+    """Пересчет предрасчитанной статистики /stats"""
+    rebuild_stats_rollups(args.user)
+    logger.info("Статистика пересчитана" + (f" для пользователя {args.user}" if args.user else ""))
+    return 0
+
+def cmd_reindex_search(args) -> int:
+    """Перестроение полнотекстового индекса истории"""
+    rebuild_search_index()
+    return 0
+
+def cmd_rebuild_memory(args) -> int:
+    """Построение долговременной памяти пользователя по истории"""
+    count = rebuild_user_memory(args.user)
+    logger.info(f"В память пользователя {args.user} добавлено фрагментов: {count}")
+    return 0
+
+def cmd_retention(args) -> int:
+    """Однократный запуск политик хранения данных"""
+    RetentionManager().run_once()
+    return 0
+
+def cmd_enable_incremental_vacuum(args) -> int:
+    """Однократный перевод базы в режим постепенного освобождения места"""
+    if enable_incremental_vacuum():
+        logger.info("База данных переведена в режим auto_vacuum=INCREMENTAL")
+    else:
+        logger.info("Режим auto_vacuum=INCREMENTAL уже включен (или не требуется)")
+    return 0
+
+def cmd_users_per_setting(args) -> int:
+    """Количество пользователей по значению настройки"""
+    for value, count in get_users_per_setting(args.setting).items():
+        print(f"{value}\t{count}")
+    return 0
+
+def cmd_cache_stats(args) -> int:
+    """Доля токенов промпта, прочитанных из кеша, и задержка ответа по режимам разговора"""
+    since = int(time.time()) - args.days * 86400 if args.days else None
+    
+    print("mode\tmodel\trequests\tprompt_tokens\tcached_tokens\tcached_ratio\tavg_ms\tavg_cached_ms")
+    for row in get_prompt_cache_stats(since):
+        print(
+            f"{row['conversation_mode']}\t{row['model']}\t{row['requests']}\t{row['prompt_tokens']}\t"
+            f"{row['cached_tokens']}\t{row['cached_ratio']:.1%}\t{row['avg_latency_ms']}\t{row['avg_cached_latency_ms']}"
+        )
+    return 0
+
+def cmd_traces(args) -> int:
+    """Самые долгие трассы из файла экспорта трассировки"""
+    try:
+        traces = load_traces(args.file)
+    except FileNotFoundError as e:
+        print(f"Файл трасс не найден: {e.filename}")
+        return 1
+    
+    if not traces:
+        print("Трасс нет")
+        return 0
+    
+    def trace_duration(spans):
+        return max(int(span["endTimeUnixNano"]) for span in spans) - min(int(span["startTimeUnixNano"]) for span in spans)
+    
+    slowest = sorted(traces.values(), key=trace_duration, reverse=True)[:args.slowest]
+    for spans in slowest:
+        print(f"Трасса {spans[0]['traceId']} ({trace_duration(spans) / 1e6:.1f} мс)")
+        print(format_trace(spans))
+        print()
+    return 0
+
+def cmd_check_config(args) -> int:
+    """Проверка файла пользовательской конфигурации перед выкладкой"""
+    config = Config(TELEGRAM_TOKEN=None, OPENROUTER_API_KEY=None)
+    try:
+        apply_user_config(config, read_user_config(args.file))
+        validate_config(config)
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        print(f"Конфигурация {args.file} некорректна: {e}")
+        return 1
+    
+    print(f"Конфигурация {args.file} корректна: {len(config.AVAILABLE_MODELS)} моделей, "
+          f"{len(config.CONVERSATION_MODES)} режимов, {len(config.TEMPLATES)} шаблонов")
+    return 0
+
+def cmd_backup(args) -> int:
+    """Создание резервной копии базы данных"""
+    return 0 if create_backup(full=args.full) else 1
+
+def cmd_restore(args) -> int:
+    """Восстановление базы данных из резервной копии"""
+    return 0 if restore_backup(args.file) else 1
+
+def main() -> int:
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных бота")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    rebuild_stats = subparsers.add_parser("rebuild-stats", help="Пересчитать статистику по существующим данным")
+    rebuild_stats.add_argument("--user", type=int, default=None, help="ID пользователя (по умолчанию все)")
+    rebuild_stats.set_defaults(func=cmd_rebuild_stats)
+    
+    reindex_search = subparsers.add_parser("reindex-search", help="Перестроить полнотекстовый индекс истории")
+    reindex_search.set_defaults(func=cmd_reindex_search)
+    
+    rebuild_memory = subparsers.add_parser("rebuild-memory", help="Построить долговременную память пользователя по истории")
+    rebuild_memory.add_argument("--user", type=int, required=True, help="ID пользователя")
+    rebuild_memory.set_defaults(func=cmd_rebuild_memory)
+    
+    retention = subparsers.add_parser("retention", help="Удалить устаревшие данные по политикам хранения")
+    retention.set_defaults(func=cmd_retention)
+    
+    enable_vacuum = subparsers.add_parser(
+        "enable-incremental-vacuum",
+        help="Перевести существующую базу в режим auto_vacuum=INCREMENTAL (полный VACUUM, остановите бота)"
+    )
+    enable_vacuum.set_defaults(func=cmd_enable_incremental_vacuum)
+    
+    users_per_setting = subparsers.add_parser("users-per-setting", help="Количество пользователей по значению настройки")
+    users_per_setting.add_argument("setting", choices=list(SETTINGS_COLUMNS), help="Настройка")
+    users_per_setting.set_defaults(func=cmd_users_per_setting)
+    
+    cache_stats = subparsers.add_parser("cache-stats", help="Эффективность кеширования промптов по режимам")
+    cache_stats.add_argument("--days", type=int, default=None, help="За последние N дней (по умолчанию все время)")
+    cache_stats.set_defaults(func=cmd_cache_stats)
+    
+    traces = subparsers.add_parser("traces", help="Самые долгие трассы из файла трассировки")
+    traces.add_argument("--file", default=None, help="Файл трасс (по умолчанию TRACING_FILE)")
+    traces.add_argument("--slowest", type=int, default=10, help="Сколько трасс показать")
+    traces.set_defaults(func=cmd_traces, skip_init=True)
+    
+    check_config = subparsers.add_parser("check-config", help="Проверить файл пользовательской конфигурации")
+    check_config.add_argument("--file", default=USER_CONFIG_PATH, help="Файл (по умолчанию user_config.json)")
+    check_config.set_defaults(func=cmd_check_config, skip_init=True)
+    
+    backup = subparsers.add_parser("backup", help="Создать резервную копию базы данных")
+    backup.add_argument("--full", action="store_true", help="Полная копия вместо инкрементальной")
+    backup.set_defaults(func=cmd_backup)
+    
+    restore = subparsers.add_parser("restore", help="Восстановить базу данных из резервной копии")
+    restore.add_argument("file", help="Файл резервной копии (.db.gz или .inc.gz)")
+    restore.set_defaults(func=cmd_restore, skip_init=True)
+    
+    args = parser.parse_args()
+    
+    if not getattr(args, "skip_init", False):
+        init_db()
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
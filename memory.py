@@ -0,0 +1,355 @@
+"""
+Долговременная память: поиск релевантных фрагментов прошлых разговоров.
+
+Каждая пара реплик (пользователь + ассистент) превращается в вектор и хранится
+в компактном индексе NumPy отдельно для каждого пользователя. Размер индекса
+ограничен MEMORY_MAX_ITEMS (старые фрагменты вытесняются), поэтому точный
+перебор скалярных произведений укладывается в доли миллисекунды.
+"""
+
+import os
+import re
+import json
+import zlib
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional
+from config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+# NumPy импортируется только при включенной памяти (см. _import_numpy)
+np = None
+
+MAX_TEXT_LENGTH = 1000
+SAVE_EVERY = 20
+INITIAL_CAPACITY = 64
+
+# Файлы индекса в прежнем формате (векторы и тексты отдельно)
+LEGACY_SUFFIXES = (".npy", ".json")
+
+class HashingEmbedder:
+    """Векторизация хешированием слов и биграмм (без внешних моделей)"""
+    
+    def __init__(self, dim: int):
+        """Инициализация векторизатора"""
+        self.dim = dim
+    
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        """Векторы текстов, нормированные по длине"""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        
+        for row, text in enumerate(texts):
+            words = re.findall(r"\w+", text.lower())
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                # Знак из старшего бита уменьшает смещение от коллизий
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+class SentenceTransformerEmbedder:
+    """Векторизация локальной моделью sentence-transformers на CPU"""
+    
+    def __init__(self, model_name: str):
+        """Загрузка модели"""
+        from sentence_transformers import SentenceTransformer
+        
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+    
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        """Векторы текстов, нормированные по длине"""
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+class UserMemoryIndex:
+    """
+    Индекс фрагментов разговоров одного пользователя
+    
+    Векторы лежат в кольцевом буфере: новый фрагмент записывается на место
+    самого старого, без копирования индекса. Буфер растет удвоением до
+    max_items, поэтому пользователи с короткой историей не занимают полный
+    объем.
+    """
+    
+    def __init__(self, user_id: int, dim: int, max_items: int):
+        """Инициализация пустого индекса"""
+        self.user_id = user_id
+        self.max_items = max_items
+        self.vectors = np.zeros((min(max_items, INITIAL_CAPACITY), dim), dtype=np.float32)
+        self.texts: List[Optional[str]] = [None] * len(self.vectors)
+        self.count = 0
+        self.head = 0       # Позиция для следующего фрагмента
+        self.unsaved = 0
+        self.lock = threading.Lock()
+    
+    def _order(self) -> "np.ndarray":
+        """Позиции фрагментов в буфере от старых к новым"""
+        start = (self.head - self.count) % len(self.vectors)
+        return (start + np.arange(self.count)) % len(self.vectors)
+    
+    def _grow(self) -> None:
+        """Удвоение буфера (только пока он не заполнен, фрагменты идут по порядку)"""
+        capacity = min(self.max_items, len(self.vectors) * 2)
+        vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+        vectors[:self.count] = self.vectors[:self.count]
+        self.vectors = vectors
+        self.texts.extend([None] * (capacity - len(self.texts)))
+        self.head = self.count
+    
+    def add(self, vector: "np.ndarray", text: str) -> None:
+        """Добавить фрагмент, вытесняя самый старый при переполнении"""
+        with self.lock:
+            if self.count == len(self.vectors) < self.max_items:
+                self._grow()
+            
+            self.vectors[self.head] = vector
+            self.texts[self.head] = text
+            self.head = (self.head + 1) % len(self.vectors)
+            self.count = min(self.count + 1, len(self.vectors))
+            self.unsaved += 1
+    
+    def search(self, vector: "np.ndarray", top_k: int, min_score: float, skip_recent: int) -> List[Dict]:
+        """Наиболее похожие фрагменты, кроме skip_recent самых новых"""
+        with self.lock:
+            candidates = self.count - skip_recent
+            if candidates <= 0:
+                return []
+            
+            positions = self._order()[:candidates]
+            scores = (self.vectors[:self.count] @ vector)[positions]
+            k = min(top_k, candidates)
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            
+            return [
+                {"text": self.texts[positions[i]], "score": float(scores[i])}
+                for i in best if scores[i] >= min_score
+            ]
+    
+    def save(self, directory: str) -> None:
+        """
+        Сохранение индекса на диск (векторы в float16 для компактности)
+        
+        Векторы и тексты пишутся в один файл .npz через временный файл и
+        os.replace: при сбое на диске остается прежний индекс целиком.
+        """
+        with self.lock:
+            if not self.unsaved:
+                return
+            
+            positions = self._order()
+            texts = json.dumps([self.texts[i] for i in positions], ensure_ascii=False).encode("utf-8")
+            
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{self.user_id}.npz")
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    vectors=self.vectors[positions].astype(np.float16),
+                    texts=np.frombuffer(texts, dtype=np.uint8)
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self.unsaved = 0
+            
+            # Индекс в прежнем формате (.npy + .json) больше не нужен
+            base = os.path.join(directory, str(self.user_id))
+            for suffix in LEGACY_SUFFIXES:
+                if os.path.exists(base + suffix):
+                    os.remove(base + suffix)
+    
+    @classmethod
+    def load(cls, user_id: int, dim: int, max_items: int, directory: str) -> "UserMemoryIndex":
+        """Загрузка индекса с диска (или пустой индекс)"""
+        index = cls(user_id, dim, max_items)
+        base = os.path.join(directory, str(user_id))
+        
+        if os.path.exists(base + ".npz"):
+            with np.load(base + ".npz") as data:
+                vectors = data["vectors"].astype(np.float32)
+                texts = json.loads(data["texts"].tobytes().decode("utf-8"))
+        elif all(os.path.exists(base + suffix) for suffix in LEGACY_SUFFIXES):
+            vectors = np.load(base + ".npy").astype(np.float32)
+            with open(base + ".json", "r", encoding="utf-8") as f:
+                texts = json.load(f)
+        else:
+            return index
+        
+        # Индекс, построенный другой моделью, не используем
+        if vectors.ndim == 2 and vectors.shape[1] == dim and len(texts) == len(vectors):
+            for vector, text in zip(vectors[-max_items:], texts[-max_items:]):
+                index.add(vector, text)
+            index.unsaved = 0
+        else:
+            logger.warning(f"Индекс памяти пользователя {user_id} несовместим и будет пересоздан")
+        
+        return index
+
+class MemoryStore:
+    """Индексы памяти пользователей с ограниченным числом загруженных в память"""
+    
+    def __init__(self):
+        """Инициализация хранилища"""
+        self.directory = config.MEMORY_DIR
+        self.embedder = self._create_embedder()
+        self._indexes: "OrderedDict[int, UserMemoryIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _create_embedder(self):
+        """Локальная модель, если доступна, иначе векторизация хешированием"""
+        if config.MEMORY_MODEL:
+            try:
+                return SentenceTransformerEmbedder(config.MEMORY_MODEL)
+            except Exception as e:
+                logger.warning(f"Модель {config.MEMORY_MODEL} недоступна, используется векторизация хешированием: {e}")
+        return HashingEmbedder(config.MEMORY_HASH_DIM)
+    
+    def _index(self, user_id: int) -> UserMemoryIndex:
+        """Индекс пользователя (LRU-кеш загруженных индексов)"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+                return index
+            
+            index = UserMemoryIndex.load(user_id, self.embedder.dim, config.MEMORY_MAX_ITEMS, self.directory)
+            self._indexes[user_id] = index
+            
+            while len(self._indexes) > config.MEMORY_CACHE_USERS:
+                _, evicted = self._indexes.popitem(last=False)
+                evicted.save(self.directory)
+            
+            return index
+    
+    def remember(self, user_id: int, user_text: str, assistant_text: str) -> None:
+        """Добавить пару реплик в память пользователя"""
+        text = f"Пользователь: {user_text}\nАссистент: {assistant_text}"[:MAX_TEXT_LENGTH]
+        vector = self.embedder.embed([text])[0]
+        
+        index = self._index(user_id)
+        index.add(vector, text)
+        
+        if index.unsaved >= SAVE_EVERY:
+            index.save(self.directory)
+    
+    def recall(self, user_id: int, query: str) -> List[Dict]:
+        """Релевантные фрагменты прошлых разговоров для запроса"""
+        vector = self.embedder.embed([query[:MAX_TEXT_LENGTH]])[0]
+        return self._index(user_id).search(
+            vector,
+            top_k=config.MEMORY_TOP_K,
+            min_score=config.MEMORY_MIN_SCORE,
+            skip_recent=config.MEMORY_SKIP_RECENT
+        )
+    
+    def forget(self, user_id: int) -> None:
+        """Удалить память пользователя"""
+        with self._lock:
+            self._indexes.pop(user_id, None)
+        
+        for suffix in (".npz",) + LEGACY_SUFFIXES:
+            path = os.path.join(self.directory, f"{user_id}{suffix}")
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def save_all(self) -> None:
+        """Сохранить все загруженные индексы"""
+        with self._lock:
+            indexes = list(self._indexes.values())
+        
+        for index in indexes:
+            index.save(self.directory)
+
+_store: Optional[MemoryStore] = None
+_store_lock = threading.Lock()
+
+def _import_numpy() -> bool:
+    """Отложенный импорт NumPy, False - если он не установлен"""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+def get_memory_store() -> Optional[MemoryStore]:
+    """Хранилище памяти или None, если память отключена или NumPy недоступен"""
+    global _store
+    
+    if not config.MEMORY_ENABLED:
+        return None
+    
+    if not _import_numpy():
+        logger.warning("Долговременная память отключена: не установлен numpy")
+        config.MEMORY_ENABLED = False
+        return None
+    
+    with _store_lock:
+        if _store is None:
+            _store = MemoryStore()
+            atexit.register(_store.save_all)
+    
+    return _store
+
+def recall_context(user_id: int, query: str) -> Optional[Dict]:
+    """Часть содержимого новой реплики с релевантными фрагментами прошлых разговоров (или None)"""
+    store = get_memory_store()
+    if store is None:
+        return None
+    
+    snippets = store.recall(user_id, query)
+    if not snippets:
+        return None
+    
+    text = "Релевантные фрагменты прошлых разговоров с пользователем (используй, если они помогают ответить):\n\n"
+    text += "\n\n".join(snippet["text"] for snippet in snippets)
+    
+    return {"type": "text", "text": text}
+
+def remember_turn(user_id: int, user_text: str, assistant_text: str) -> None:
+    """Сохранить пару реплик в долговременной памяти"""
+    store = get_memory_store()
+    if store is not None:
+        store.remember(user_id, user_text, assistant_text)
+
+def forget_user(user_id: int) -> None:
+    """Удалить долговременную память пользователя"""
+    store = get_memory_store()
+    if store is not None:
+        store.forget(user_id)
+
+def rebuild_user_memory(user_id: int) -> int:
+    """Построить память пользователя по сохраненной истории, возвращает число фрагментов"""
+    from database import iter_chat_history
+    
+    store = get_memory_store()
+    if store is None:
+        return 0
+    
+    store.forget(user_id)
+    
+    count = 0
+    pending_user_text = None
+    for role, content, timestamp, message_type in iter_chat_history(user_id):
+        if role == "user":
+            pending_user_text = content or ""
+        elif role == "assistant" and pending_user_text is not None:
+            store.remember(user_id, pending_user_text, content or "")
+            pending_user_text = None
+            count += 1
+    
+    store.save_all()
+    
+    return count
@@ -0,0 +1,282 @@
+"""
+Метрики бота в текстовом формате Prometheus.
+
+Счетчики и гистограммы хранятся в памяти процесса и отдаются по HTTP на
+METRICS_HOST:METRICS_PORT/metrics. При METRICS_ENABLED = False декораторы
+возвращают исходные функции без обертки, а observe/inc сразу выходят, поэтому
+выключенные метрики почти ничего не стоят.
+"""
+
+import time
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+ENABLED = config.METRICS_ENABLED
+
+# Границы гистограмм длительности (секунды)
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+class Counter:
+    """Монотонно растущий счетчик с метками"""
+    
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        """Инициализация счетчика"""
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, label_values: LabelValues = (), amount: float = 1.0) -> None:
+        """Увеличить счетчик"""
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+    
+    def render(self) -> List[str]:
+        """Строки в формате Prometheus"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    """Гистограмма значений с фиксированными границами"""
+    
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        """Инициализация гистограммы"""
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._values: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, label_values: LabelValues = ()) -> None:
+        """Учесть значение"""
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                # Счетчики по границам, затем сумма и количество
+                state = self._values[label_values] = [0.0] * (len(self.buckets) + 2)
+            
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+    
+    def render(self) -> List[str]:
+        """Строки в формате Prometheus"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    labels = _format_labels(self.labels + ("le",), label_values + (repr(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels + ("le",), label_values + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {state[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {state[-1]}")
+        return lines
+
+class Gauge:
+    """Значение, которое вычисляется при каждом запросе метрик"""
+    
+    def __init__(self, name: str, help_text: str, callback: Callable[[], Dict[LabelValues, float]], labels: Tuple[str, ...] = ()):
+        """Инициализация показателя"""
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.callback = callback
+    
+    def render(self) -> List[str]:
+        """Строки в формате Prometheus"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.error(f"Ошибка при расчете метрики {self.name}: {e}")
+            return []
+        
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues) -> str:
+    """Метки в формате {name="value",...}"""
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+_registry: Dict[str, object] = {}
+
+def _register(metric):
+    """Регистрация метрики (повторная регистрация возвращает существующую)"""
+    return _registry.setdefault(metric.name, metric)
+
+UPDATE_DURATION = _register(Histogram(
+    "bot_update_duration_seconds", "Время обработки обновления Telegram", ("handler",)
+))
+UPDATE_ERRORS = _register(Counter(
+    "bot_update_errors_total", "Необработанные ошибки обработчиков", ("handler",)
+))
+OPENROUTER_DURATION = _register(Histogram(
+    "openrouter_request_duration_seconds", "Время запроса к OpenRouter", ("model", "request_type")
+))
+OPENROUTER_REQUESTS = _register(Counter(
+    "openrouter_requests_total", "Запросы к OpenRouter по результату", ("model", "status")
+))
+OPENROUTER_TOKENS = _register(Counter(
+    "openrouter_tokens_total", "Токены OpenRouter по типу", ("model", "type")
+))
+MODEL_ROUTES = _register(Counter(
+    "model_routing_total", "Автовыбор модели по категориям запросов", ("tier", "model")
+))
+QUOTA_REJECTIONS = _register(Counter(
+    "quota_rejections_total", "Запросы, отклоненные из-за квоты токенов", ("tier", "period")
+))
+DB_DURATION = _register(Histogram(
+    "db_query_duration_seconds", "Время выполнения функций хранилища", ("function",)
+))
+SCHEDULER_LAG = _register(Histogram(
+    "scheduler_lag_seconds", "Задержка отправки запланированного сообщения относительно scheduled_time",
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+))
+
+def observe(metric: Histogram, value: float, label_values: LabelValues = ()) -> None:
+    """Учесть значение в гистограмме (ничего не делает при выключенных метриках)"""
+    if ENABLED:
+        metric.observe(value, label_values)
+
+def inc(metric: Counter, label_values: LabelValues = (), amount: float = 1.0) -> None:
+    """Увеличить счетчик (ничего не делает при выключенных метриках)"""
+    if ENABLED:
+        metric.inc(label_values, amount)
+
+def register_gauge(name: str, help_text: str, callback: Callable[[], Dict[LabelValues, float]],
+                   labels: Tuple[str, ...] = ()) -> None:
+    """Показатель, вычисляемый при запросе метрик (например, глубина очереди)"""
+    if ENABLED:
+        _register(Gauge(name, help_text, callback, labels))
+
+def timed(metric: Histogram, *label_values: str, errors: Optional[Counter] = None):
+    """
+    Декоратор: длительность вызова функции (обычной или async) в гистограмме
+    
+    Args:
+        metric: Гистограмма длительности
+        label_values: Значения меток гистограммы
+        errors: Счетчик исключений с теми же метками
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+        
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(label_values)
+                    raise
+                finally:
+                    metric.observe(time.perf_counter() - started, label_values)
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(label_values)
+                raise
+            finally:
+                metric.observe(time.perf_counter() - started, label_values)
+        return wrapper
+    
+    return decorator
+
+def timed_handler(name: str):
+    """Декоратор обработчика обновлений Telegram (в том числе lambda, возвращающей корутину)"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+        
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+                return result
+            except Exception:
+                UPDATE_ERRORS.inc((name,))
+                raise
+            finally:
+                UPDATE_DURATION.observe(time.perf_counter() - started, (name,))
+        return wrapper
+    
+    return decorator
+
+def render_metrics() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in list(_registry.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """HTTP-обработчик /metrics"""
+    
+    def do_GET(self):
+        """Отдача метрик"""
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        """Запросы сборщика метрик не пишем в лог"""
+
+def start_metrics_server(host: str = None, port: int = None) -> Optional[ThreadingHTTPServer]:
+    """Запуск HTTP-сервера метрик в фоновом потоке (None, если метрики выключены)"""
+    if not ENABLED:
+        return None
+    
+    host = host or config.METRICS_HOST
+    port = port or config.METRICS_PORT
+    
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,268 @@
+"""
+Реестр возможностей моделей OpenRouter.
+
+Метаданные моделей (длина контекста, входные модальности, цены, лимиты на
+запрос) загружаются из GET /models и кешируются на диске на
+MODEL_REGISTRY_TTL_HOURS. Проверки возможностей - поиск в словаре по
+идентификатору модели; устаревший кеш обновляется в фоновом потоке, не
+задерживая обработку сообщений. Пока данных нет (нет сети и кеша), реестр
+ничего не запрещает и использует консервативные значения по умолчанию.
+
+MODEL_REGISTRY_FIXTURE подменяет OpenRouter локальным файлом в том же
+формате (benchmarks/fixtures/openrouter_models.json) для запуска без сети.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+import requests
+from config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+# Длина контекста неизвестной модели (минимальная среди распространенных)
+DEFAULT_CONTEXT_LENGTH = 8192
+
+# Пауза перед повторной попыткой после неудачной загрузки /models
+RETRY_INTERVAL = 600
+
+# Модели с изображениями на входе, если метаданных нет
+FALLBACK_VISION_PREFIXES = (
+    "google/gemini",
+    "anthropic/claude-3",
+    "openai/gpt-4o"
+)
+
+@dataclass(frozen=True)
+class ModelInfo:
+    """Возможности модели по данным OpenRouter"""
+    id: str
+    name: str
+    context_length: int
+    input_modalities: Tuple[str, ...]
+    prompt_price: float                 # Долларов за токен запроса
+    completion_price: float             # Долларов за токен ответа
+    max_completion_tokens: Optional[int]
+    per_request_limits: Optional[Dict]  # Лимиты токенов на запрос (бесплатные модели)
+    
+    @property
+    def supports_images(self) -> bool:
+        return "image" in self.input_modalities
+    
+    @property
+    def is_free(self) -> bool:
+        return self.prompt_price == 0 and self.completion_price == 0
+    
+    @classmethod
+    def from_api(cls, data: Dict) -> "ModelInfo":
+        """Разбор элемента ответа /models"""
+        architecture = data.get("architecture") or {}
+        pricing = data.get("pricing") or {}
+        top_provider = data.get("top_provider") or {}
+        
+        modalities = architecture.get("input_modalities")
+        if not modalities:
+            # Старый формат: "text+image->text"
+            modalities = (architecture.get("modality") or "text->text").split("->")[0].split("+")
+        
+        return cls(
+            id=data["id"],
+            name=data.get("name") or data["id"],
+            context_length=int(data.get("context_length") or top_provider.get("context_length") or DEFAULT_CONTEXT_LENGTH),
+            input_modalities=tuple(modalities),
+            prompt_price=float(pricing.get("prompt") or 0),
+            completion_price=float(pricing.get("completion") or 0),
+            max_completion_tokens=top_provider.get("max_completion_tokens"),
+            per_request_limits=data.get("per_request_limits")
+        )
+
+class ModelRegistry:
+    """Кешируемый на диске каталог моделей OpenRouter"""
+    
+    def __init__(self, cache_file: str = None, ttl: float = None, fixture: str = None, enabled: bool = None):
+        """
+        Инициализация реестра
+        
+        Args:
+            cache_file: Файл кеша ответа /models
+            ttl: Время жизни кеша в секундах
+            fixture: Файл с ответом /models вместо обращения к OpenRouter
+            enabled: Загружать каталог (без него реестр отвечает значениями по умолчанию)
+        """
+        self.cache_file = cache_file or config.MODEL_REGISTRY_CACHE_FILE
+        self.ttl = ttl if ttl is not None else config.MODEL_REGISTRY_TTL_HOURS * 3600
+        self.fixture = fixture if fixture is not None else config.MODEL_REGISTRY_FIXTURE
+        self.enabled = enabled if enabled is not None else config.MODEL_REGISTRY_ENABLED
+        
+        self._models: Dict[str, ModelInfo] = {}
+        self._fetched_at = 0.0
+        self._next_attempt = 0.0
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+    
+    def load(self) -> None:
+        """Загрузка каталога при запуске: из файла-заглушки, кеша или OpenRouter"""
+        if self.fixture:
+            self._set_models(self._read_file(self.fixture), time.time())
+            logger.info(f"Каталог моделей загружен из {self.fixture}: {len(self._models)} моделей")
+            return
+        
+        cached = self._read_cache()
+        if cached:
+            self._set_models(*cached)
+        
+        if self.is_stale():
+            self.refresh()
+    
+    def is_stale(self) -> bool:
+        """Кеш устарел или отсутствует"""
+        return self.enabled and not self.fixture and time.time() - self._fetched_at >= self.ttl
+    
+    def refresh(self) -> bool:
+        """Загрузка /models из OpenRouter и сохранение в кеш; False - если не удалось"""
+        self._next_attempt = time.time() + RETRY_INTERVAL
+        try:
+            response = requests.get(
+                f"{config.OPENROUTER_BASE_URL}/models",
+                headers={"Authorization": f"Bearer {config.OPENROUTER_API_KEY}"},
+                timeout=15
+            )
+            response.raise_for_status()
+            data = response.json().get("data") or []
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"Не удалось обновить каталог моделей OpenRouter: {e}")
+            return False
+        
+        fetched_at = time.time()
+        self._set_models(data, fetched_at)
+        self._write_cache(data, fetched_at)
+        logger.info(f"Каталог моделей OpenRouter обновлен: {len(self._models)} моделей")
+        return True
+    
+    def _refresh_in_background(self) -> None:
+        """Фоновое обновление устаревшего кеша (не больше одного одновременно)"""
+        with self._refresh_lock:
+            if self._refreshing or time.time() < self._next_attempt:
+                return
+            self._refreshing = True
+        
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+        
+        threading.Thread(target=run, name="model-registry", daemon=True).start()
+    
+    def _set_models(self, data: List[Dict], fetched_at: float) -> None:
+        """Замена каталога новым словарем (читатели видят либо старый, либо новый)"""
+        models = {}
+        for item in data:
+            try:
+                info = ModelInfo.from_api(item)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.debug(f"Пропущена модель с некорректными метаданными: {e}")
+                continue
+            models[info.id] = info
+        
+        self._models = models
+        self._fetched_at = fetched_at
+    
+    def _read_file(self, path: str) -> List[Dict]:
+        """Ответ /models из файла"""
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("data") or []
+    
+    def _read_cache(self) -> Optional[Tuple[List[Dict], float]]:
+        """Кеш с диска: (модели, время загрузки) или None"""
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            return cached["data"], float(cached["fetched_at"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Кеш каталога моделей {self.cache_file} поврежден: {e}")
+            return None
+    
+    def _write_cache(self, data: List[Dict], fetched_at: float) -> None:
+        """Атомарная запись кеша на диск"""
+        directory = os.path.dirname(self.cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        temp_file = self.cache_file + ".tmp"
+        try:
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump({"fetched_at": fetched_at, "data": data}, f, ensure_ascii=False)
+            os.replace(temp_file, self.cache_file)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кеш каталога моделей: {e}")
+    
+    def get(self, model: str) -> Optional[ModelInfo]:
+        """Возможности модели или None, если она неизвестна"""
+        if self.is_stale():
+            self._refresh_in_background()
+        return self._models.get(model)
+    
+    def is_available(self, model: str) -> bool:
+        """Модель есть в каталоге OpenRouter (без каталога - считаем, что есть)"""
+        return not self._models or self.get(model) is not None
+    
+    def available_models(self, models: Iterable[str]) -> List[str]:
+        """Модели из списка, которые есть в каталоге"""
+        return [model for model in models if self.is_available(model)]
+    
+    def supports_images(self, model: str) -> bool:
+        """Принимает ли модель изображения на входе"""
+        info = self.get(model)
+        if info is not None:
+            return info.supports_images
+        return any(model.startswith(prefix) for prefix in FALLBACK_VISION_PREFIXES)
+    
+    def context_length(self, model: str) -> int:
+        """Длина контекста модели в токенах"""
+        info = self.get(model)
+        return info.context_length if info is not None else DEFAULT_CONTEXT_LENGTH
+    
+    def max_completion_tokens(self, model: str, requested: int) -> int:
+        """Запрошенная длина ответа с учетом ограничения провайдера"""
+        info = self.get(model)
+        if info is None or not info.max_completion_tokens:
+            return requested
+        return min(requested, info.max_completion_tokens)
+    
+    def resolve(self, model: str, candidates: Iterable[str], need_images: bool = False) -> str:
+        """
+        Модель для запроса: выбранная, если она доступна (и принимает изображения,
+        когда они нужны), иначе первая подходящая из candidates
+        """
+        if self.is_available(model) and (not need_images or self.supports_images(model)):
+            return model
+        
+        for candidate in candidates:
+            if self.is_available(candidate) and (not need_images or self.supports_images(candidate)):
+                logger.warning(f"Модель {model} недоступна{' для изображений' if need_images else ''}, используем {candidate}")
+                return candidate
+        
+        return model
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+def get_model_registry() -> ModelRegistry:
+    """Общий реестр моделей (каталог загружается при первом обращении)"""
+    global _registry
+    
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+            if _registry.enabled:
+                _registry.load()
+    
+    return _registry
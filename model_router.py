@@ -0,0 +1,207 @@
+"""
+Автоматический выбор модели для запроса (настройка модели "auto").
+
+Запрос относится к одной из трех категорий:
+- small: короткая реплика без изображений ("спасибо", "ок") - самая дешевая
+  и быстрая подходящая модель;
+- large: запрос больше AUTO_LARGE_PROMPT_TOKENS - самая дешевая модель, в
+  контекст которой он помещается;
+- normal: остальное - первая подходящая модель в порядке AVAILABLE_MODELS,
+  без моделей с контекстом от AUTO_RESERVED_CONTEXT (они оставлены для
+  больших запросов, пока есть альтернатива).
+
+Подходящая модель есть в каталоге OpenRouter, вмещает запрос вместе с
+ответом, принимает изображения, если они есть в последнем сообщении, и по
+текущей статистике укладывается в целевую задержку режима разговора
+(latency_target_ms). Статистика задержек и ошибок по моделям - скользящие
+средние по последним запросам в памяти процесса.
+
+Статистика не считается окончательной: модель исключается только после
+MIN_SAMPLES запросов, статистика без новых запросов дольше STATS_TTL
+забывается, а с вероятностью EXPLORATION_RATE запрос уходит исключенной
+модели, чтобы обновить ее статистику. Иначе одна ошибка или медленный ответ
+исключали бы модель навсегда: без запросов статистика не меняется.
+"""
+
+import time
+import random
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from config import get_config, AUTO_MODEL
+from model_registry import get_model_registry
+from metrics import inc, MODEL_ROUTES
+from utils import estimate_message_tokens
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+# Вес последнего запроса в скользящих средних
+EWMA_ALPHA = 0.2
+
+# Модели с долей ошибок выше порога не выбираются, пока есть другие
+MAX_ERROR_RATE = 0.5
+
+# Запросов, после которых статистика модели влияет на выбор
+MIN_SAMPLES = 3
+
+# Через сколько секунд без запросов статистика модели забывается
+STATS_TTL = 600
+
+# Доля запросов, которые уходят исключенной модели для обновления статистики
+EXPLORATION_RATE = 0.05
+
+class ModelLatencyStats:
+    """Скользящие средние задержки и доли ошибок запросов по моделям"""
+    
+    def __init__(self, alpha: float = EWMA_ALPHA, min_samples: int = MIN_SAMPLES, ttl: float = STATS_TTL):
+        """Инициализация статистики"""
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.ttl = ttl
+        # модель -> [задержка в мс, доля ошибок, запросов, время последнего запроса]
+        self._stats: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, model: str, latency_ms: float, ok: bool) -> None:
+        """Учесть завершенный запрос"""
+        error = 0.0 if ok else 1.0
+        now = time.monotonic()
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is None or now - stats[3] > self.ttl:
+                self._stats[model] = [latency_ms, error, 1, now]
+                return
+            
+            # Задержка неудачных запросов (таймауты, 429) не характеризует модель
+            if ok:
+                stats[0] += self.alpha * (latency_ms - stats[0])
+            stats[1] += self.alpha * (error - stats[1])
+            stats[2] += 1
+            stats[3] = now
+    
+    def _current(self, model: str) -> Optional[List[float]]:
+        """Статистика модели, если запросов достаточно и она не устарела"""
+        stats = self._stats.get(model)
+        if stats is None or stats[2] < self.min_samples or time.monotonic() - stats[3] > self.ttl:
+            return None
+        return stats
+    
+    def latency_ms(self, model: str) -> Optional[float]:
+        """Средняя задержка модели или None, если статистики пока нет"""
+        stats = self._current(model)
+        return stats[0] if stats is not None else None
+    
+    def error_rate(self, model: str) -> float:
+        """Средняя доля ошибок модели"""
+        stats = self._current(model)
+        return stats[1] if stats is not None else 0.0
+    
+    def snapshot(self) -> Dict[str, Dict]:
+        """Статистика по всем моделям"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                model: {
+                    "latency_ms": stats[0],
+                    "error_rate": stats[1],
+                    "requests": int(stats[2]),
+                    "age_seconds": round(now - stats[3], 1)
+                }
+                for model, stats in self._stats.items()
+            }
+
+latency_stats = ModelLatencyStats()
+
+def _has_images(message: Dict) -> bool:
+    """Есть ли изображение в сообщении"""
+    content = message.get("content")
+    return isinstance(content, list) and any(part.get("type") == "image_url" for part in content)
+
+def classify_request(messages: List[Dict]) -> Tuple[str, int, bool]:
+    """
+    Категория запроса
+    
+    Returns:
+        (категория, оценка токенов запроса, есть ли изображения в последнем сообщении)
+    """
+    prompt_tokens = sum(estimate_message_tokens(message) for message in messages)
+    last = messages[-1] if messages else {}
+    has_images = _has_images(last)
+    
+    if prompt_tokens > config.AUTO_LARGE_PROMPT_TOKENS:
+        tier = "large"
+    elif not has_images and last and estimate_message_tokens(last) <= config.AUTO_SMALL_MESSAGE_TOKENS:
+        tier = "small"
+    else:
+        tier = "normal"
+    
+    return tier, prompt_tokens, has_images
+
+def route_model(messages: List[Dict], max_tokens: int = None, conversation_mode: str = None) -> str:
+    """
+    Модель для запроса в режиме "auto"
+    
+    Args:
+        messages: Сообщения запроса (последнее - новая реплика пользователя)
+        max_tokens: Запрошенная длина ответа
+        conversation_mode: Режим разговора (целевая задержка)
+    
+    Returns:
+        Идентификатор модели
+    """
+    registry = get_model_registry()
+    max_tokens = max_tokens or config.DEFAULT_MAX_TOKENS
+    tier, prompt_tokens, has_images = classify_request(messages)
+    
+    candidates = [
+        model for model in registry.available_models(config.AVAILABLE_MODELS)
+        if registry.context_length(model) >= prompt_tokens + registry.max_completion_tokens(model, max_tokens)
+        and (not has_images or registry.supports_images(model))
+    ]
+    if not candidates:
+        fallback = config.DEFAULT_MODEL if config.DEFAULT_MODEL != AUTO_MODEL else config.AVAILABLE_MODELS[0]
+        logger.warning(f"Нет модели для запроса в {prompt_tokens} токенов, используем {fallback}")
+        return fallback
+    
+    # Модели со сбоями и медленнее цели режима - только если других нет
+    suitable = candidates
+    healthy = [model for model in candidates if latency_stats.error_rate(model) <= MAX_ERROR_RATE]
+    candidates = healthy or candidates
+    
+    mode = config.CONVERSATION_MODES.get(conversation_mode) or {}
+    target_ms = mode.get("latency_target_ms")
+    if target_ms:
+        # Модель без статистики считается быстрой: так она получает первые запросы
+        fast = [model for model in candidates if (latency_stats.latency_ms(model) or 0.0) <= target_ms]
+        candidates = fast or candidates
+    
+    # Изредка - исключенная модель: иначе ее статистика не обновится, пока не устареет
+    excluded = [model for model in suitable if model not in candidates]
+    if excluded and random.random() < EXPLORATION_RATE:
+        model = random.choice(excluded)
+        inc(MODEL_ROUTES, (tier, model))
+        logger.debug(f"Автовыбор модели: {tier}, {prompt_tokens} токенов -> {model} (проверка исключенной модели)")
+        return model
+    
+    def price(model: str) -> float:
+        info = registry.get(model)
+        if info is None:
+            return 0.0
+        return info.prompt_price * prompt_tokens + info.completion_price * max_tokens
+    
+    def latency(model: str) -> float:
+        return latency_stats.latency_ms(model) or 0.0
+    
+    if tier == "small":
+        # Среди равных по цене и задержке - модель с меньшим контекстом (обычно она быстрее)
+        model = min(candidates, key=lambda m: (price(m), latency(m), registry.context_length(m)))
+    elif tier == "large":
+        model = min(candidates, key=lambda m: (price(m), latency(m)))
+    else:
+        regular = [m for m in candidates if registry.context_length(m) < config.AUTO_RESERVED_CONTEXT]
+        model = (regular or candidates)[0]
+    
+    inc(MODEL_ROUTES, (tier, model))
+    logger.debug(f"Автовыбор модели: {tier}, {prompt_tokens} токенов -> {model}")
+    return model
@@ -0,0 +1,404 @@
+"""
+Очередь исходящих запросов к Telegram Bot API.
+
+Подключается к Application как rate limiter python-telegram-bot, поэтому через
+нее проходят все вызовы context.bot / application.bot с chat_id: отправка,
+редактирование и удаление сообщений. Запросы ждут токены в общем бакете
+(лимит Telegram ~30 сообщений в секунду) и в бакете чата (~1 в секунду, в
+группах ~20 в минуту), обслуживаются по приоритетам, а при RetryAfter
+повторяются после указанной паузы. Пауза после RetryAfter касается только
+этого чата; общий бакет останавливается, лишь когда RetryAfter одновременно
+приходит в нескольких чатах.
+
+Приоритет передается в вызов бота параметром rate_limit_args; без очереди
+python-telegram-bot его не принимает, поэтому он подставляется через
+priority_args:
+    await context.bot.send_message(chat_id, text, **priority_args(context.bot, PRIORITY_LOW))
+"""
+
+import time
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from typing import Any, Callable, Coroutine, Dict, List, Optional
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+# Приоритеты очереди (меньше - раньше)
+PRIORITY_HIGH = 0      # Реакция на действия пользователя: редактирование, прогресс
+PRIORITY_NORMAL = 1    # Ответы на сообщения
+PRIORITY_LOW = 2       # Запланированные сообщения, служебная активность
+
+# Приоритет методов API по умолчанию: правки сообщений срочные, а индикатор
+# набора текста не должен опережать ответы
+ENDPOINT_PRIORITIES = {
+    "editMessageText": PRIORITY_HIGH,
+    "editMessageReplyMarkup": PRIORITY_HIGH,
+    "deleteMessage": PRIORITY_HIGH,
+    "sendChatAction": PRIORITY_LOW
+}
+
+# Индикаторы действий («печатает...») не расходуют лимит чата и не ждут его
+# сообщений; индикатор, простоявший в очереди дольше, чем он показывается, не отправляется
+CHAT_ACTION_ENDPOINTS = frozenset({"sendChatAction"})
+CHAT_ACTION_TTL = 5.0
+
+# RetryAfter в стольких разных чатах за окно (секунд) - превышен общий лимит бота
+GLOBAL_RETRY_AFTER_CHATS = 3
+GLOBAL_RETRY_AFTER_WINDOW = 1.0
+
+# Бакеты чатов, не использовавшиеся дольше этого времени, удаляются
+IDLE_BUCKET_TTL = 300
+
+LATENCY_SAMPLES = 1000
+
+class TokenBucket:
+    """Бакет токенов: rate токенов в секунду, не больше capacity про запас"""
+    
+    def __init__(self, rate: float, capacity: float):
+        """Инициализация полного бакета"""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.last_used = self.updated
+        self.blocked_until = 0.0
+    
+    def _refill(self, now: float) -> None:
+        """Пополнение токенов за прошедшее время"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def blocked_for(self, now: float) -> float:
+        """Сколько секунд еще действует пауза после RetryAfter (0 - паузы нет)"""
+        return max(0.0, self.blocked_until - now)
+    
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 - доступен сейчас)"""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    def consume(self) -> None:
+        """Забрать токен (после проверки wait_time)"""
+        self.tokens -= 1
+        self.last_used = time.monotonic()
+    
+    def block(self, until: float) -> None:
+        """Не выдавать токены до указанного момента (после RetryAfter)"""
+        self.blocked_until = max(self.blocked_until, until)
+    
+    def is_idle(self, now: float) -> bool:
+        """Бакет давно не использовался (и, значит, снова полон)"""
+        return now - self.last_used > IDLE_BUCKET_TTL and now > self.blocked_until
+
+class OutboundJob:
+    """Запрос к API, ожидающий отправки"""
+    
+    __slots__ = ("chat_id", "priority", "call", "future", "queued_at", "attempts", "throttled", "context", "chat_action")
+    
+    def __init__(self, chat_id: Any, priority: int, call: Callable[[], Coroutine], future: asyncio.Future,
+                 chat_action: bool = False):
+        """Инициализация запроса"""
+        self.chat_id = chat_id
+        self.priority = priority
+        self.chat_action = chat_action
+        self.call = call
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+        self.throttled = False
+        # Контекст вызывающего кода (текущий спан трассировки) для отправки из диспетчера
+        self.context = contextvars.copy_context()
+
+class OutboundQueue(BaseRateLimiter[int]):
+    """Очередь исходящих запросов с приоритетами и ограничением частоты"""
+    
+    def __init__(self,
+                 global_rate: float = None,
+                 chat_rate: float = None,
+                 chat_burst: int = None,
+                 group_rate_per_minute: float = None,
+                 max_retries: int = None):
+        """Инициализация очереди"""
+        self.global_bucket = TokenBucket(
+            global_rate or config.OUTBOUND_GLOBAL_RATE,
+            global_rate or config.OUTBOUND_GLOBAL_RATE
+        )
+        self.chat_rate = chat_rate or config.OUTBOUND_CHAT_RATE
+        self.chat_burst = chat_burst or config.OUTBOUND_CHAT_BURST
+        self.group_rate = (group_rate_per_minute or config.OUTBOUND_GROUP_RATE_PER_MIN) / 60.0
+        self.max_retries = max_retries if max_retries is not None else config.OUTBOUND_MAX_RETRIES
+        
+        self._lanes: List[deque] = [deque() for _ in (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)]
+        self._buckets: Dict[Any, TokenBucket] = {}
+        self._in_flight: set = set()
+        self._tasks: set = set()
+        self._retry_after_events: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._last_cleanup = time.monotonic()
+        
+        self._latencies: deque = deque(maxlen=LATENCY_SAMPLES)
+        self._metrics = {
+            "sent": 0,
+            "failed": 0,
+            "throttled": 0,
+            "dropped": 0,
+            "retry_after": 0,
+            "global_retry_after": 0,
+            "retry_after_seconds": 0.0
+        }
+    
+    async def initialize(self) -> None:
+        """Запуск диспетчера очереди"""
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+    
+    async def shutdown(self) -> None:
+        """Остановка диспетчера после отправки оставшихся запросов"""
+        deadline = time.monotonic() + 5.0
+        while (any(self._lanes) or self._tasks) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        
+        for lane in self._lanes:
+            while lane:
+                job = lane.popleft()
+                if not job.future.done():
+                    job.future.cancel()
+    
+    async def process_request(self,
+                              callback: Callable[..., Coroutine[Any, Any, Any]],
+                              args: Any,
+                              kwargs: Dict[str, Any],
+                              endpoint: str,
+                              data: Dict[str, Any],
+                              rate_limit_args: Optional[int]) -> Any:
+        """Постановка запроса в очередь и ожидание результата"""
+        chat_id = data.get("chat_id")
+        
+        # Запросы без чата (getUpdates, getFile, answerCallbackQuery) не ограничиваются
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+        
+        if self._dispatcher is None:
+            await self.initialize()
+        
+        priority = rate_limit_args if rate_limit_args is not None else ENDPOINT_PRIORITIES.get(endpoint, PRIORITY_NORMAL)
+        priority = min(max(priority, PRIORITY_HIGH), PRIORITY_LOW)
+        
+        job = OutboundJob(
+            chat_id, priority, lambda: callback(*args, **kwargs), asyncio.get_running_loop().create_future(),
+            chat_action=endpoint in CHAT_ACTION_ENDPOINTS
+        )
+        self._lanes[priority].append(job)
+        self._wakeup.set()
+        
+        return await job.future
+    
+    def get_metrics(self) -> Dict:
+        """Метрики очереди: задержка доставки, ожидание лимитов, глубина очередей"""
+        metrics = dict(self._metrics)
+        latencies = sorted(self._latencies)
+        
+        metrics["avg_latency_ms"] = sum(latencies) / len(latencies) if latencies else 0.0
+        metrics["p95_latency_ms"] = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+        metrics["max_latency_ms"] = latencies[-1] if latencies else 0.0
+        metrics["queue_high"] = len(self._lanes[PRIORITY_HIGH])
+        metrics["queue_normal"] = len(self._lanes[PRIORITY_NORMAL])
+        metrics["queue_low"] = len(self._lanes[PRIORITY_LOW])
+        metrics["in_flight"] = len(self._tasks)
+        return metrics
+    
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        """Бакет чата (для групп лимит строже)"""
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(self.group_rate, self.chat_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+    
+    def _next_job(self):
+        """
+        Следующий запрос, который можно отправить сейчас
+        
+        Returns:
+            (запрос, None) или (None, сколько секунд ждать; None - ждать новых запросов)
+        """
+        now = time.monotonic()
+        
+        global_wait = self.global_bucket.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+        
+        # Устаревшие индикаторы действий завершаются без отправки
+        for lane in self._lanes:
+            for job in lane:
+                if job.chat_action and now - job.queued_at > CHAT_ACTION_TTL and not job.future.done():
+                    job.future.set_result(False)
+                    self._metrics["dropped"] += 1
+        
+        # Запросы, которые вызывающий код уже отменил, не отправляем
+        for priority, lane in enumerate(self._lanes):
+            if any(job.future.done() for job in lane):
+                self._lanes[priority] = deque(job for job in lane if not job.future.done())
+        
+        min_wait = None
+        # Чаты, у которых более ранний запрос еще ждет: порядок внутри чата сохраняется
+        waiting_chats = set(self._in_flight)
+        
+        for lane in self._lanes:
+            for index, job in enumerate(lane):
+                if job.chat_action:
+                    # Индикатор ждет только паузы чата после RetryAfter
+                    wait = self._chat_bucket(job.chat_id).blocked_for(now)
+                    if wait == 0:
+                        del lane[index]
+                        return job, None
+                    min_wait = wait if min_wait is None else min(min_wait, wait)
+                    continue
+                
+                if job.chat_id in waiting_chats:
+                    continue
+                
+                wait = self._chat_bucket(job.chat_id).wait_time(now)
+                if wait == 0:
+                    del lane[index]
+                    return job, None
+                
+                if not job.throttled:
+                    job.throttled = True
+                    self._metrics["throttled"] += 1
+                
+                waiting_chats.add(job.chat_id)
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+        
+        return None, min_wait
+    
+    async def _dispatch(self) -> None:
+        """Выдача запросов на отправку по мере появления токенов"""
+        while True:
+            job, wait = self._next_job()
+            
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            self.global_bucket.consume()
+            if not job.chat_action:
+                self._chat_bucket(job.chat_id).consume()
+                self._in_flight.add(job.chat_id)
+            
+            # Ссылка на задачу хранится до ее завершения, иначе ее может собрать сборщик мусора
+            task = asyncio.create_task(self._send(job), context=job.context)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            
+            self._cleanup_buckets()
+    
+    async def _send(self, job: OutboundJob) -> None:
+        """Выполнение запроса с повтором после RetryAfter"""
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+            self._metrics["retry_after"] += 1
+            self._metrics["retry_after_seconds"] += retry_after
+            logger.warning(f"Telegram ограничил отправку в чат {job.chat_id}, пауза {retry_after} с")
+            
+            now = time.monotonic()
+            until = now + retry_after
+            self._chat_bucket(job.chat_id).block(until)
+            if self._is_global_limit(job.chat_id, now):
+                self._metrics["global_retry_after"] += 1
+                logger.warning(f"RetryAfter сразу в нескольких чатах, пауза {retry_after} с для всех отправок")
+                self.global_bucket.block(until)
+            
+            job.attempts += 1
+            if job.attempts <= self.max_retries:
+                self._lanes[job.priority].appendleft(job)
+            else:
+                self._metrics["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+        except Exception as e:
+            self._metrics["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self._metrics["sent"] += 1
+            self._latencies.append((time.monotonic() - job.queued_at) * 1000)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            if not job.chat_action:
+                self._in_flight.discard(job.chat_id)
+            self._wakeup.set()
+    
+    def _is_global_limit(self, chat_id: Any, now: float) -> bool:
+        """RetryAfter пришел в нескольких разных чатах за короткое время"""
+        events = self._retry_after_events
+        events.append((now, chat_id))
+        while events[0][0] < now - GLOBAL_RETRY_AFTER_WINDOW:
+            events.popleft()
+        return len({chat for _, chat in events}) >= GLOBAL_RETRY_AFTER_CHATS
+    
+    def _cleanup_buckets(self) -> None:
+        """Удаление бакетов неактивных чатов"""
+        now = time.monotonic()
+        if now - self._last_cleanup < IDLE_BUCKET_TTL:
+            return
+        
+        self._last_cleanup = now
+        for chat_id in [chat_id for chat_id, bucket in self._buckets.items() if bucket.is_idle(now)]:
+            del self._buckets[chat_id]
+
+_queue: Optional[OutboundQueue] = None
+
+def create_outbound_queue() -> Optional[OutboundQueue]:
+    """Очередь исходящих запросов для Application или None, если она отключена"""
+    global _queue
+    
+    if not config.OUTBOUND_QUEUE_ENABLED:
+        return None
+    
+    _queue = OutboundQueue()
+    return _queue
+
+def priority_args(bot, priority: int) -> Dict:
+    """
+    Приоритет вызова бота в очереди исходящих запросов
+    
+    python-telegram-bot отклоняет rate_limit_args (ValueError), если у бота
+    нет rate limiter, поэтому параметр передается только при включенной очереди.
+    """
+    if getattr(bot, "rate_limiter", None) is None:
+        return {}
+    return {"rate_limit_args": priority}
+
+def get_outbound_metrics() -> Dict:
+    """Метрики очереди исходящих запросов"""
+    if _queue is None:
+        return {}
+    return _queue.get_metrics()
@@ -0,0 +1,344 @@
+"""
+Сэмплирующий профилировщик и запись медленных обновлений.
+
+Профилировщик раз в PROFILER_SAMPLE_MS снимает стеки всех потоков через
+sys._current_frames() и считает одинаковые стеки; результат пишется в
+logs/ в свернутом формате (folded stacks), который принимают flamegraph.pl,
+speedscope и inferno. Запускается админской командой /profile [секунды] или
+сигналом SIGUSR1 (kill -USR1 <pid>) на PROFILER_SIGNAL_SECONDS секунд.
+
+Наблюдатель медленных обновлений раз в SLOW_UPDATE_SAMPLE_MS записывает стек
+корутины каждого обрабатываемого обновления. Если обработка заняла дольше
+SLOW_UPDATE_THRESHOLD_MS, в logs/slow_updates/ сохраняется временная шкала:
+где находилось обновление в каждый момент, плюс стеки всех потоков на момент
+превышения порога (например, поток с запросом к OpenRouter).
+"""
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+# Функции ожидания стандартной библиотеки: стек потока, стоящего в них, считается простоем
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("socket.py", "accept"),
+    ("socketserver.py", "serve_forever"),
+    ("thread.py", "_worker")
+}
+
+def _frame_label(frame) -> str:
+    """Подпись кадра для свернутого стека: функция (файл:строка начала функции)"""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _coroutine_stack(coro) -> Tuple[str, ...]:
+    """Стек корутины задачи по цепочке await (от внешней к ожидающей) с текущими строками"""
+    labels = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        labels.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return tuple(labels)
+
+def _is_idle(frame) -> bool:
+    """Поток ждет в стандартной функции ожидания"""
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+def _collapse(frame) -> List[str]:
+    """Кадры стека от внешнего к внутреннему"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+class SamplingProfiler:
+    """Профилировщик, снимающий стеки всех потоков в фоновом потоке"""
+    
+    def __init__(self, interval: float, include_idle: bool = False):
+        """
+        Инициализация профилировщика
+        
+        Args:
+            interval: Интервал между снимками (секунды)
+            include_idle: Учитывать потоки, ожидающие в select/wait/queue.get
+        """
+        self.interval = interval
+        self.include_idle = include_idle
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self) -> None:
+        """Запуск снятия стеков"""
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> None:
+        """Остановка и ожидание фонового потока"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _run(self) -> None:
+        """Цикл снятия стеков"""
+        own_id = threading.get_ident()
+        
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (not self.include_idle and _is_idle(frame)):
+                    continue
+                
+                stack = [names.get(thread_id, str(thread_id))] + _collapse(frame)
+                self.samples[";".join(stack)] += 1
+            
+            self.sample_count += 1
+    
+    def write_folded(self, path: str) -> None:
+        """Сохранение в свернутом формате: "поток;кадр;...;кадр число_снимков" """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+    
+    def top_functions(self, limit: int = 10) -> List[Tuple[str, float]]:
+        """Функции, в которых поток находился чаще всего (собственное время, доля снимков)"""
+        own = Counter()
+        for stack, count in self.samples.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        
+        total = sum(own.values()) or 1
+        return [(label, count / total) for label, count in own.most_common(limit)]
+
+_active_profiler: Optional[SamplingProfiler] = None
+_profiler_lock = threading.Lock()
+
+def run_profiler(seconds: float) -> Optional[Tuple[str, List[Tuple[str, float]]]]:
+    """
+    Профилирование всего процесса в течение seconds секунд (блокирует вызывающий поток)
+    
+    Returns:
+        (путь к файлу .folded, самые частые функции) или None, если профилирование уже идет
+    """
+    global _active_profiler
+    
+    with _profiler_lock:
+        if _active_profiler is not None:
+            return None
+        _active_profiler = SamplingProfiler(config.PROFILER_SAMPLE_MS / 1000.0)
+        profiler = _active_profiler
+    
+    try:
+        profiler.start()
+        time.sleep(seconds)
+        profiler.stop()
+        
+        path = os.path.join(config.PROFILER_DIR, f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded")
+        profiler.write_folded(path)
+        logger.info(f"Профиль за {seconds} с ({profiler.sample_count} снимков) сохранен в {path}")
+        
+        return path, profiler.top_functions()
+    finally:
+        with _profiler_lock:
+            _active_profiler = None
+
+def install_profiler_signal() -> None:
+    """Профилирование по сигналу SIGUSR1 (на платформах, где он есть)"""
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    
+    def handle(signum, frame):
+        threading.Thread(
+            target=run_profiler, args=(config.PROFILER_SIGNAL_SECONDS,), name="profiler-signal", daemon=True
+        ).start()
+    
+    signal.signal(signal.SIGUSR1, handle)
+    logger.info(f"Профилирование по сигналу: kill -USR1 {os.getpid()} ({config.PROFILER_SIGNAL_SECONDS} с)")
+
+class InFlightUpdate:
+    """Обновление в обработке и снимки его стека"""
+    
+    __slots__ = ("name", "update_id", "user_id", "task", "started", "timeline", "threads")
+    
+    def __init__(self, name: str, update_id: Optional[int], user_id: Optional[int], task: asyncio.Task):
+        """Начало наблюдения"""
+        self.name = name
+        self.update_id = update_id
+        self.user_id = user_id
+        self.task = task
+        self.started = time.monotonic()
+        # (мс от начала, стек корутины); одинаковые подряд снимки объединяются
+        self.timeline: List[Tuple[float, Tuple[str, ...]]] = []
+        self.threads: Dict[str, List[str]] = {}
+
+class SlowUpdateMonitor:
+    """Снимки стеков обрабатываемых обновлений и сохранение медленных"""
+    
+    def __init__(self, threshold_ms: float, interval_ms: float, directory: str):
+        """Инициализация наблюдателя"""
+        self.threshold = threshold_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.directory = directory
+        self._updates: Dict[int, InFlightUpdate] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+    
+    def begin(self, name: str, update) -> Optional[int]:
+        """Начало обработки обновления, возвращает ключ для finish"""
+        task = asyncio.current_task()
+        if task is None:
+            return None
+        
+        user = getattr(update, "effective_user", None)
+        record = InFlightUpdate(name, getattr(update, "update_id", None), user.id if user else None, task)
+        
+        with self._lock:
+            self._updates[id(record)] = record
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-update-monitor", daemon=True)
+                self._thread.start()
+        
+        return id(record)
+    
+    def finish(self, key: Optional[int], error: BaseException = None) -> None:
+        """Окончание обработки: медленное обновление сохраняется в файл"""
+        if key is None:
+            return
+        
+        with self._lock:
+            record = self._updates.pop(key, None)
+        
+        if record is None:
+            return
+        
+        duration = time.monotonic() - record.started
+        if duration >= self.threshold:
+            try:
+                self._write(record, duration, error)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить данные медленного обновления: {e}")
+    
+    def _run(self) -> None:
+        """Снятие стеков обрабатываемых обновлений"""
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            
+            with self._lock:
+                records = list(self._updates.values())
+            
+            for record in records:
+                elapsed = now - record.started
+                stack = _coroutine_stack(record.task.get_coro())
+                
+                if not record.timeline or record.timeline[-1][1] != stack:
+                    record.timeline.append((elapsed * 1000, stack))
+                
+                # После превышения порога - стеки занятых потоков (запросы в to_thread и т.п.)
+                if not record.threads and elapsed >= self.threshold:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    record.threads = {
+                        names.get(thread_id, str(thread_id)): _collapse(frame)
+                        for thread_id, frame in sys._current_frames().items()
+                        if not _is_idle(frame) and thread_id != threading.get_ident()
+                    }
+    
+    def _write(self, record: InFlightUpdate, duration: float, error: BaseException = None) -> None:
+        """Сохранение временной шкалы медленного обновления"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(
+            self.directory,
+            f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{record.name}_{record.update_id}.txt"
+        )
+        
+        lines = [
+            f"Обработчик: {record.name}",
+            f"Обновление: {record.update_id}, пользователь: {record.user_id}",
+            f"Длительность: {duration * 1000:.0f} мс (порог {self.threshold * 1000:.0f} мс)"
+        ]
+        if error is not None:
+            lines.append(f"Ошибка: {type(error).__name__}: {error}")
+        
+        lines.append("")
+        lines.append("Временная шкала (стек корутины обработчика):")
+        for index, (elapsed, stack) in enumerate(record.timeline):
+            until = record.timeline[index + 1][0] if index + 1 < len(record.timeline) else duration * 1000
+            lines.append(f"  {elapsed:8.0f} - {until:8.0f} мс")
+            lines.extend(f"      {frame}" for frame in stack)
+        
+        if record.threads:
+            lines.append("")
+            lines.append("Занятые потоки после превышения порога:")
+            for name, stack in record.threads.items():
+                lines.append(f"  {name}:")
+                lines.extend(f"      {frame}" for frame in stack)
+        
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        
+        logger.warning(f"Обновление {record.update_id} ({record.name}) обрабатывалось {duration:.1f} с, подробности: {path}")
+
+_monitor = SlowUpdateMonitor(
+    config.SLOW_UPDATE_THRESHOLD_MS,
+    config.SLOW_UPDATE_SAMPLE_MS,
+    os.path.join(config.PROFILER_DIR, "slow_updates")
+) if config.SLOW_UPDATE_ENABLED else None
+
+def watch_update(name: str):
+    """Декоратор обработчика обновлений: запись временной шкалы, если обработка медленная"""
+    def decorator(func):
+        if _monitor is None:
+            return func
+        
+        @functools.wraps(func)
+        async def wrapper(update, context, *args, **kwargs):
+            key = _monitor.begin(name, update)
+            error = None
+            try:
+                result = func(update, context, *args, **kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+                return result
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                _monitor.finish(key, error)
+        return wrapper
+    
+    return decorator
+
+def is_admin(user_id: int) -> bool:
+    """Пользователь входит в ADMIN_USER_IDS"""
+    return user_id in config.ADMIN_USER_IDS
+
+def format_top_functions(top: List[Tuple[str, float]]) -> str:
+    """Текст со списком самых частых функций профиля"""
+    return "\n".join(f"{share:6.1%}  {label}" for label, share in top)
@@ -0,0 +1,262 @@
+"""
+Квоты токенов по пользователям.
+
+У каждого пользователя есть тариф (QUOTA_USER_TIERS, по умолчанию
+QUOTA_DEFAULT_TIER) с дневным и месячным лимитом токенов (QUOTA_TIERS, 0 -
+без ограничения). Израсходованные токены считаются в памяти процесса:
+проверка перед запросом и учет ответа - обращение к словарю, без запросов к
+базе. Сутки и месяц считаются по UTC.
+
+Счетчики в памяти раз в QUOTA_RECONCILE_SECONDS сверяются с usage_stats: так
+учитываются перезапуски бота и запросы других экземпляров с общей базой.
+Токены, учтенные во время сверки, добавляются к результату запроса к базе.
+"""
+
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from config import get_config
+from database import get_tokens_used_since, flush_writes
+from metrics import inc, QUOTA_REJECTIONS
+from profiler import is_admin
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+PERIODS = ("daily", "monthly")
+
+PERIOD_NAMES = {
+    "daily": "Дневной",
+    "monthly": "Месячный"
+}
+
+def period_starts(now: float = None) -> Tuple[int, int]:
+    """Начало текущих суток и месяца (UTC) в секундах"""
+    moment = datetime.fromtimestamp(now if now is not None else time.time(), tz=timezone.utc)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(day.timestamp()), int(day.replace(day=1).timestamp())
+
+def period_resets(now: float = None) -> Dict[str, int]:
+    """Время обнуления дневного и месячного лимита (UTC) в секундах"""
+    day_start, month_start = period_starts(now)
+    month = datetime.fromtimestamp(month_start, tz=timezone.utc)
+    if month.month == 12:
+        next_month = month.replace(year=month.year + 1, month=1)
+    else:
+        next_month = month.replace(month=month.month + 1)
+    return {"daily": day_start + 86400, "monthly": int(next_month.timestamp())}
+
+@dataclass
+class QuotaStatus:
+    """Результат проверки квоты"""
+    tier: str
+    allowed: bool = True
+    exceeded: Optional[str] = None                             # Исчерпанный период
+    used: Dict[str, int] = field(default_factory=dict)
+    limits: Dict[str, int] = field(default_factory=dict)       # 0 - без ограничения
+    resets_at: Dict[str, int] = field(default_factory=dict)
+    
+    def remaining(self, period: str) -> Optional[int]:
+        """Остаток токенов за период или None, если лимита нет"""
+        limit = self.limits.get(period)
+        if not limit:
+            return None
+        return max(0, limit - self.used.get(period, 0))
+
+class QuotaManager:
+    """Счетчики токенов по пользователям со сверкой с usage_stats в фоновом потоке"""
+    
+    def __init__(self, reconcile_interval: int = None):
+        """Инициализация менеджера"""
+        self.reconcile_interval = reconcile_interval or config.QUOTA_RECONCILE_SECONDS
+        self.is_running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+        
+        self._lock = threading.Lock()
+        self._day_start, self._month_start = period_starts()
+        self._daily: Dict[int, int] = {}
+        self._monthly: Dict[int, int] = {}
+        # Токены, учтенные во время сверки (None - сверка не идет)
+        self._pending: Optional[Dict[int, int]] = None
+    
+    def tier(self, user_id: int) -> str:
+        """Тариф пользователя"""
+        return config.QUOTA_USER_TIERS.get(user_id, config.QUOTA_DEFAULT_TIER)
+    
+    def _roll_periods(self, now: float = None) -> None:
+        """Обнуление счетчиков при смене суток или месяца (вызывается под блокировкой)"""
+        day_start, month_start = period_starts(now)
+        if day_start != self._day_start:
+            self._day_start = day_start
+            self._daily = {}
+        if month_start != self._month_start:
+            self._month_start = month_start
+            self._monthly = {}
+    
+    def record(self, user_id: int, tokens: int) -> None:
+        """Учесть токены, израсходованные пользователем"""
+        if tokens <= 0:
+            return
+        
+        with self._lock:
+            self._roll_periods()
+            self._daily[user_id] = self._daily.get(user_id, 0) + tokens
+            self._monthly[user_id] = self._monthly.get(user_id, 0) + tokens
+            if self._pending is not None:
+                self._pending[user_id] = self._pending.get(user_id, 0) + tokens
+    
+    def usage(self, user_id: int) -> Dict[str, int]:
+        """Токены пользователя за текущие сутки и месяц"""
+        with self._lock:
+            self._roll_periods()
+            return {
+                "daily": self._daily.get(user_id, 0),
+                "monthly": self._monthly.get(user_id, 0)
+            }
+    
+    def status(self, user_id: int) -> QuotaStatus:
+        """Тариф, лимиты и израсходованные токены пользователя (для /stats)"""
+        if not config.QUOTA_ENABLED or is_admin(user_id):
+            return QuotaStatus(tier="unlimited")
+        
+        tier = self.tier(user_id)
+        limits = config.QUOTA_TIERS.get(tier) or config.QUOTA_TIERS[config.QUOTA_DEFAULT_TIER]
+        return QuotaStatus(
+            tier=tier,
+            used=self.usage(user_id),
+            limits={period: limits[period] for period in PERIODS},
+            resets_at=period_resets()
+        )
+    
+    def check(self, user_id: int, estimated_tokens: int = 0) -> QuotaStatus:
+        """
+        Проверка квоты перед запросом к модели
+        
+        Args:
+            user_id: ID пользователя
+            estimated_tokens: Оценка токенов запроса
+        
+        Returns:
+            Статус квоты; allowed=False, если запрос превысит лимит
+        """
+        status = self.status(user_id)
+        
+        for period in PERIODS:
+            limit = status.limits.get(period)
+            if limit and status.used[period] + estimated_tokens > limit:
+                status.allowed = False
+                status.exceeded = period
+                inc(QUOTA_REJECTIONS, (status.tier, period))
+                break
+        
+        return status
+    
+    def reconcile(self) -> None:
+        """Замена счетчиков суммами из usage_stats за текущие сутки и месяц"""
+        try:
+            # Буфер отложенной записи сбрасывается до открытия окна _pending.
+            # Иначе запрос к базе сам сбросил бы весь накопленный буфер уже в
+            # окне, и токены запросов, завершившихся за время этой записи,
+            # попали бы и в сумму из базы, и в _pending
+            flush_writes()
+        except Exception as e:
+            logger.error(f"Ошибка при сверке квот с usage_stats: {e}")
+            return
+        
+        with self._lock:
+            self._roll_periods()
+            day_start, month_start = self._day_start, self._month_start
+            self._pending = {}
+        
+        try:
+            daily = get_tokens_used_since(day_start)
+            monthly = get_tokens_used_since(month_start)
+        except Exception as e:
+            logger.error(f"Ошибка при сверке квот с usage_stats: {e}")
+            with self._lock:
+                self._pending = None
+            return
+        
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._roll_periods()
+            # Если за время запроса сменились сутки или месяц, результат уже устарел
+            if (day_start, month_start) != (self._day_start, self._month_start):
+                return
+            
+            for user_id, tokens in pending.items():
+                daily[user_id] = daily.get(user_id, 0) + tokens
+                monthly[user_id] = monthly.get(user_id, 0) + tokens
+            self._daily, self._monthly = daily, monthly
+        
+        logger.debug(f"Квоты сверены с usage_stats: {len(monthly)} пользователей за месяц")
+    
+    def start(self):
+        """Запуск сверки квот"""
+        if self.is_running:
+            logger.warning("Сверка квот уже запущена")
+            return
+        
+        # Первая сверка - сразу: после перезапуска счетчики в памяти пусты
+        self.reconcile()
+        
+        self.is_running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="quota-reconcile")
+        self.thread.daemon = True
+        self.thread.start()
+        
+        logger.info("Сверка квот запущена")
+    
+    def stop(self):
+        """Остановка сверки квот"""
+        if not self.is_running:
+            logger.warning("Сверка квот не запущена")
+            return
+        
+        self.is_running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5.0)
+        
+        logger.info("Сверка квот остановлена")
+    
+    def _run(self):
+        """Основной цикл сверки"""
+        while not self._stop_event.wait(self.reconcile_interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"Ошибка при сверке квот: {e}")
+
+def format_tokens(tokens: int) -> str:
+    """Число токенов с разделителями разрядов"""
+    return f"{tokens:,}".replace(",", " ")
+
+def quota_exceeded_text(status: QuotaStatus) -> str:
+    """Сообщение пользователю об исчерпанной квоте"""
+    period = status.exceeded
+    resets_at = datetime.fromtimestamp(status.resets_at[period], tz=timezone.utc)
+    return (
+        f"⛔ {PERIOD_NAMES[period]} лимит токенов исчерпан "
+        f"(тариф {status.tier}: {format_tokens(status.limits[period])}).\n"
+        f"Осталось: {format_tokens(status.remaining(period))} токенов. "
+        f"Лимит обновится {resets_at.strftime('%d.%m.%Y в %H:%M')} UTC."
+    )
+
+_manager: Optional[QuotaManager] = None
+_manager_lock = threading.Lock()
+
+def get_quota_manager() -> QuotaManager:
+    """Общий менеджер квот"""
+    global _manager
+    
+    with _manager_lock:
+        if _manager is None:
+            _manager = QuotaManager()
+    
+    return _manager
@@ -0,0 +1,188 @@
+import os
+import logging
+import time
+import threading
+from typing import Dict
+from database import (
+    get_users_over_message_limit, delete_old_messages_batch, delete_old_group_messages_batch,
+    delete_old_usage_stats_batch,
+    get_orphaned_media, delete_media_records, get_media_file_paths, incremental_vacuum
+)
+from config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+# Файлы моложе этого возраста не считаются потерянными (могут еще записываться в базу)
+MEDIA_GRACE_PERIOD = 3600
+
+class RetentionManager:
+    """Фоновая очистка устаревших данных по политикам хранения"""
+    
+    def __init__(self, check_interval: int = None):
+        """Инициализация менеджера"""
+        self.check_interval = check_interval or config.RETENTION_INTERVAL_HOURS * 3600
+        self.batch_size = config.RETENTION_BATCH_SIZE
+        self.batch_pause = config.RETENTION_BATCH_PAUSE_MS / 1000.0
+        self.is_running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+    
+    def start(self):
+        """Запуск фоновой очистки"""
+        if self.is_running:
+            logger.warning("Очистка данных уже запущена")
+            return
+        
+        self.is_running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="retention")
+        self.thread.daemon = True
+        self.thread.start()
+        
+        logger.info("Фоновая очистка данных запущена")
+    
+    def stop(self):
+        """Остановка фоновой очистки"""
+        if not self.is_running:
+            logger.warning("Очистка данных не запущена")
+            return
+        
+        self.is_running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5.0)
+        
+        logger.info("Фоновая очистка данных остановлена")
+    
+    def run_once(self) -> Dict:
+        """Однократный проход всех политик хранения"""
+        started = time.monotonic()
+        result = {
+            "messages": self._compact_messages(),
+            "group_messages": self._compact_group_messages(),
+            "usage_stats": self._compact_usage_stats(),
+            "media": self._cleanup_media()
+        }
+        result["free_pages"] = incremental_vacuum()
+        
+        logger.info(
+            f"Очистка данных завершена за {time.monotonic() - started:.1f} с: "
+            f"сообщений {result['messages']}, сообщений групп {result['group_messages']}, строк статистики {result['usage_stats']}, "
+            f"медиафайлов {result['media']}, свободных страниц {result['free_pages']}"
+        )
+        
+        return result
+    
+    def _pause(self) -> bool:
+        """Пауза между пачками, чтобы не занимать базу надолго; True - пора остановиться"""
+        return self._stop_event.wait(self.batch_pause)
+    
+    def _compact_messages(self) -> int:
+        """Оставить только последние RETENTION_KEEP_MESSAGES сообщений каждого пользователя"""
+        keep = config.RETENTION_KEEP_MESSAGES
+        if keep <= 0:
+            return 0
+        
+        deleted = 0
+        for user_id in get_users_over_message_limit(keep):
+            while True:
+                count = delete_old_messages_batch(user_id, keep, self.batch_size)
+                deleted += count
+                if count < self.batch_size or self._pause():
+                    break
+            
+            if self._stop_event.is_set():
+                break
+        
+        return deleted
+    
+    def _compact_group_messages(self) -> int:
+        """Оставить только последние RETENTION_KEEP_MESSAGES сообщений каждого группового чата"""
+        keep = config.RETENTION_KEEP_MESSAGES
+        if keep <= 0:
+            return 0
+        
+        deleted = 0
+        while True:
+            count = delete_old_group_messages_batch(keep, self.batch_size)
+            deleted += count
+            if count < self.batch_size or self._pause():
+                break
+        
+        return deleted
+    
+    def _compact_usage_stats(self) -> int:
+        """Удалить строки usage_stats старше RETENTION_USAGE_DAYS (агрегаты сохраняются)"""
+        days = config.RETENTION_USAGE_DAYS
+        if days <= 0:
+            return 0
+        
+        before = int(time.time()) - days * 86400
+        deleted = 0
+        
+        while True:
+            count = delete_old_usage_stats_batch(before, self.batch_size)
+            deleted += count
+            if count < self.batch_size or self._pause():
+                break
+        
+        return deleted
+    
+    def _cleanup_media(self) -> int:
+        """Удалить медиафайлы без ссылок из сообщений и файлы без записей в базе"""
+        created_before = int(time.time()) - MEDIA_GRACE_PERIOD
+        deleted = 0
+        
+        # Записи о медиа, на которые больше не ссылаются сообщения
+        while True:
+            orphans = get_orphaned_media(created_before, self.batch_size)
+            for media in orphans:
+                self._remove_file(media["file_path"])
+            
+            if orphans:
+                delete_media_records([media["id"] for media in orphans])
+            
+            deleted += len(orphans)
+            if len(orphans) < self.batch_size or self._pause():
+                break
+        
+        # Файлы на диске, о которых база ничего не знает
+        media_dir = config.RETENTION_MEDIA_DIR
+        if not os.path.isdir(media_dir):
+            return deleted
+        
+        known_paths = get_media_file_paths()
+        with os.scandir(media_dir) as entries:
+            for entry in entries:
+                if not entry.is_file() or os.path.normpath(entry.path) in known_paths:
+                    continue
+                if entry.stat().st_mtime >= created_before:
+                    continue
+                
+                self._remove_file(entry.path)
+                deleted += 1
+        
+        return deleted
+    
+    def _remove_file(self, file_path: str) -> None:
+        """Удаление файла с диска"""
+        if not file_path or not os.path.exists(file_path):
+            return
+        
+        try:
+            os.remove(file_path)
+        except OSError as e:
+            logger.error(f"Не удалось удалить файл {file_path}: {e}")
+    
+    def _run(self):
+        """Основной цикл очистки"""
+        while self.is_running:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка при очистке данных: {e}")
+            
+            # Пауза перед следующим проходом
+            if self._stop_event.wait(self.check_interval):
+                break
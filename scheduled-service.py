@@ -28,56 +28,12 @@ logger = logging.getLogger(__name__)
 # Загружаем переменные окружения
 load_dotenv()
 
-def get_db_connection():
-    """Подключение к базе данных"""
-    import sqlite3
-    from config import load_config
-    
-    config = load_config()
-    return sqlite3.connect(config.DB_PATH)
-
-def get_pending_messages():
-    """Получение запланированных сообщений, которые нужно отправить"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    current_time = int(time.time())
-    
-    cursor.execute("""
-    SELECT id, user_id, content, scheduled_time 
-    FROM scheduled_messages 
-    WHERE scheduled_time <= ? AND is_sent = 0
-    """, (current_time,))
-    
-    messages = cursor.fetchall()
-    conn.close()
-    
-    # Преобразуем в список словарей
-    result = []
-    for msg in messages:
-        msg_id, user_id, content, scheduled_time = msg
-        result.append({
-            "id": msg_id,
-            "user_id": user_id,
-            "content": content,
-            "scheduled_time": scheduled_time
-        })
-    
-    return result
+# Доступ к данным через общий модуль хранилища (SQLite или PostgreSQL)
+from database import init_db, get_pending_scheduled_messages, mark_scheduled_message_sent
 
-def mark_message_sent(message_id):
-    """Отметить сообщение как отправленное"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-    UPDATE scheduled_messages 
-    SET is_sent = 1
-    WHERE id = ?
-    """, (message_id,))
-    
-    conn.commit()
-    conn.close()
+# Не больше 30 сообщений в секунду (лимит Telegram Bot API) и повторы после ответа 429
+SEND_INTERVAL = 1.0 / 30
+MAX_SEND_ATTEMPTS = 3
 
 def send_telegram_message(chat_id, text):
     """Отправка сообщения через Telegram Bot API"""
@@ -93,20 +49,31 @@ def send_telegram_message(chat_id, text):
         "parse_mode": "Markdown"
     }
     
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка при отправке сообщения: {e}")
-        return False
+    for attempt in range(MAX_SEND_ATTEMPTS):
+        try:
+            response = requests.post(url, json=payload)
+            
+            # Превышен лимит Telegram: ждем указанное время и повторяем
+            if response.status_code == 429:
+                retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+                logger.warning(f"Telegram ограничил отправку, повтор через {retry_after} с")
+                time.sleep(retry_after)
+                continue
+            
+            response.raise_for_status()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при отправке сообщения: {e}")
+            return False
+    
+    return False
 
 def process_scheduled_messages():
     """Обработка запланированных сообщений"""
     logger.info("Проверка запланированных сообщений")
     
     # Получаем список сообщений для отправки
-    messages = get_pending_messages()
+    messages = get_pending_scheduled_messages()
     
     if not messages:
         logger.info("Нет запланированных сообщений для отправки")
@@ -125,10 +92,12 @@ def process_scheduled_messages():
         # Пытаемся отправить сообщение
         if send_telegram_message(user_id, content):
             # Если успешно отправлено, отмечаем как отправленное
-            mark_message_sent(message_id)
+            mark_scheduled_message_sent(message_id)
             logger.info(f"Сообщение #{message_id} успешно отправлено и отмечено")
         else:
             logger.error(f"Не удалось отправить сообщение #{message_id}")
+        
+        time.sleep(SEND_INTERVAL)
 
 def main():
     """Основная функция"""
@@ -136,6 +105,8 @@ def main():
     
     check_interval = 60  # Проверка каждую минуту
     
+    init_db()
+    
     try:
         while True:
             process_scheduled_messages()
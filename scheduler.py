@@ -3,10 +3,12 @@ import time
 import threading
 from telegram.ext import Application
 from database import get_pending_scheduled_messages, mark_scheduled_message_sent
-from config import load_config
+from config import get_config
+from metrics import observe, SCHEDULER_LAG
+from outbound import PRIORITY_LOW, priority_args
 
 logger = logging.getLogger(__name__)
-config = load_config()
+config = get_config()
 
 class MessageScheduler:
     """Планировщик сообщений"""
@@ -65,7 +67,8 @@ class MessageScheduler:
                 self.application.create_task(
                     self._send_scheduled_message(
                         user_id=message["user_id"],
-                        content=message["content"]
+                        content=message["content"],
+                        scheduled_time=message["scheduled_time"]
                     )
                 )
                 
@@ -76,13 +79,18 @@ class MessageScheduler:
             except Exception as e:
                 logger.error(f"Ошибка при отправке запланированного сообщения #{message['id']}: {e}")
     
-    async def _send_scheduled_message(self, user_id: int, content: str):
+    async def _send_scheduled_message(self, user_id: int, content: str, scheduled_time: int = None):
         """Отправка запланированного сообщения"""
         try:
-            await self.application.bot.send_message(
+            if scheduled_time:
+                observe(SCHEDULER_LAG, max(time.time() - scheduled_time, 0.0))
+            
+            bot = self.application.bot
+            await bot.send_message(
                 chat_id=user_id,
                 text=f"⏰ *Запланированное сообщение*\n\n{content}",
-                parse_mode="Markdown"
+                parse_mode="Markdown",
+                **priority_args(bot, PRIORITY_LOW)
             )
         except Exception as e:
             logger.error(f"Ошибка при отправке сообщения пользователю {user_id}: {e}")
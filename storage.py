@@ -0,0 +1,322 @@
+"""
+Интерфейс хранилища данных бота.
+
+Реализация по умолчанию - функции модуля database (SQLite). Альтернативные
+бэкенды (например, storage_postgres.PostgresStorage) реализуют этот интерфейс,
+и database подменяет свои функции их методами при DB_BACKEND != "sqlite".
+"""
+
+import time
+from abc import ABC, abstractmethod
+from typing import List, Dict, Optional, Iterator, Tuple
+from config import get_config
+
+config = get_config()
+
+# Настройки пользователя хранятся в отдельных столбцах таблицы users
+SETTINGS_COLUMNS = {
+    "model": "TEXT",
+    "temperature": "REAL",
+    "max_tokens": "INTEGER",
+    "conversation_mode": "TEXT",
+    "language": "TEXT"
+}
+
+# Столбцы usage_stats для оценки кеширования промптов (добавлены к существующей схеме)
+USAGE_COLUMNS = {
+    "prompt_tokens": "INTEGER",
+    "cached_tokens": "INTEGER",
+    "latency_ms": "INTEGER",
+    "conversation_mode": "TEXT"
+}
+
+def default_settings() -> Dict:
+    """Настройки нового пользователя"""
+    return {
+        "model": config.DEFAULT_MODEL,
+        "temperature": config.DEFAULT_TEMP,
+        "max_tokens": config.DEFAULT_MAX_TOKENS,
+        "conversation_mode": "friendly",
+        "language": "ru"
+    }
+
+def settings_from_row(values: Tuple) -> Dict:
+    """Настройки из значений столбцов SETTINGS_COLUMNS (пустые заменяются значениями по умолчанию)"""
+    settings = default_settings()
+    for column, value in zip(SETTINGS_COLUMNS, values):
+        if value is not None:
+            settings[column] = value
+    return settings
+
+def split_settings(settings: Dict) -> Dict:
+    """Оставить только настройки, для которых есть столбцы"""
+    unknown = set(settings) - set(SETTINGS_COLUMNS)
+    if unknown:
+        raise ValueError(f"Неизвестные настройки пользователя: {', '.join(sorted(unknown))}")
+    return {column: settings[column] for column in SETTINGS_COLUMNS if column in settings}
+
+def search_terms(query: str) -> List[str]:
+    """Слова поискового запроса без служебных символов полнотекстового синтаксиса"""
+    cleaned = "".join(c if c.isalnum() else " " for c in query)
+    return cleaned.split()[:16]
+
+def weekday(timestamp: int) -> str:
+    """День недели (0 - воскресенье) в UTC, как strftime('%w') в SQLite"""
+    return str((time.gmtime(timestamp).tm_wday + 1) % 7)
+
+def format_chat_history(rows: List[Tuple]) -> List[Dict]:
+    """
+    Преобразование строк истории в формат сообщений OpenRouter API
+    
+    Args:
+        rows: Строки (role, content, timestamp, message_type, media_id, processed_text),
+              от новых к старым
+    
+    Returns:
+        Список сообщений от старых к новым
+    """
+    chat_messages = []
+    
+    for msg in reversed(rows):
+        role, content, timestamp, message_type, media_id, processed_text = msg
+        
+        if role not in ["user", "assistant", "system"]:
+            continue
+        
+        # Формируем содержимое сообщения в зависимости от типа
+        message_content = []
+        
+        if message_type in ("text", "voice"):
+            message_content.append({
+                "type": "text",
+                "text": content
+            })
+        elif message_type == "image" and processed_text:
+            # Если есть изображение и оно было обработано
+            message_content.append({
+                "type": "text",
+                "text": content or "Что на этом изображении?"
+            })
+            message_content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"file://{processed_text}"  # Путь к файлу изображения
+                }
+            })
+        
+        if message_content:
+            chat_messages.append({
+                "role": role,
+                "content": message_content
+            })
+    
+    return chat_messages
+
+def format_prompt_cache_stats(rows: List[Tuple]) -> List[Dict]:
+    """
+    Преобразование агрегатов usage_stats в отчет о кешировании промптов
+    
+    Args:
+        rows: Строки (conversation_mode, model, requests, prompt_tokens, cached_tokens,
+              avg_latency_ms, avg_cached_latency_ms)
+    
+    Returns:
+        Список словарей с долей токенов, прочитанных из кеша
+    """
+    report = []
+    
+    for mode, model, requests, prompt_tokens, cached_tokens, avg_latency, avg_cached_latency in rows:
+        prompt_tokens = int(prompt_tokens or 0)
+        cached_tokens = int(cached_tokens or 0)
+        report.append({
+            "conversation_mode": mode or "-",
+            "model": model,
+            "requests": requests,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "cached_ratio": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+            "avg_latency_ms": round(float(avg_latency)) if avg_latency is not None else None,
+            "avg_cached_latency_ms": round(float(avg_cached_latency)) if avg_cached_latency is not None else None
+        })
+    
+    return report
+
+class Storage(ABC):
+    """Операции хранилища, которые должен реализовать бэкенд"""
+    
+    @abstractmethod
+    def init_db(self) -> None:
+        """Создание схемы"""
+    
+    @abstractmethod
+    def flush_writes(self) -> None:
+        """Записать отложенные вставки"""
+    
+    @abstractmethod
+    def shutdown_db(self) -> None:
+        """Освобождение ресурсов при остановке"""
+    
+    @abstractmethod
+    def get_write_metrics(self) -> Dict:
+        """Метрики записи"""
+    
+    @abstractmethod
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """Получить информацию о пользователе"""
+    
+    @abstractmethod
+    def create_or_update_user(self, user_id: int, username: str, first_name: str, last_name: str) -> None:
+        """Создать или обновить пользователя"""
+    
+    @abstractmethod
+    def update_user_settings(self, user_id: int, settings: Dict) -> None:
+        """Обновить настройки пользователя"""
+    
+    @abstractmethod
+    def get_users_per_setting(self, column: str) -> Dict:
+        """Количество пользователей по значению настройки"""
+    
+    @abstractmethod
+    def add_message(self, user_id: int, role: str, content: str,
+                    message_type: str = "text", media_id: str = None) -> Optional[int]:
+        """Добавить сообщение в историю"""
+    
+    @abstractmethod
+    def get_chat_history(self, user_id: int, limit: int = 10) -> List[Dict]:
+        """Получить историю чата пользователя"""
+    
+    @abstractmethod
+    def get_messages_since(self, user_id: int, after_id: int = 0, limit: int = 50) -> List[Dict]:
+        """Сообщения пользователя после указанного id (от старых к новым)"""
+    
+    @abstractmethod
+    def get_chat_summary(self, user_id: int) -> Optional[Dict]:
+        """Сохраненное резюме разговора"""
+    
+    @abstractmethod
+    def save_chat_summary(self, user_id: int, summary: str, last_message_id: int) -> None:
+        """Сохранить резюме разговора"""
+    
+    @abstractmethod
+    def add_media(self, user_id: int, file_id: str, file_unique_id: str,
+                  file_path: str, media_type: str, processed_text: str = None) -> int:
+        """Добавить медиафайл"""
+    
+    @abstractmethod
+    def get_media(self, file_unique_id: str) -> Optional[Dict]:
+        """Получить информацию о медиафайле"""
+    
+    @abstractmethod
+    def add_usage_stats(self, user_id: int, model: str, tokens_used: int, request_type: str,
+                        prompt_tokens: int = 0, cached_tokens: int = 0, latency_ms: int = None,
+                        conversation_mode: str = None) -> None:
+        """Добавить статистику использования"""
+    
+    @abstractmethod
+    def get_prompt_cache_stats(self, since: int = None) -> List[Dict]:
+        """Эффективность кеширования промптов по режимам разговора и моделям"""
+    
+    @abstractmethod
+    def get_user_stats(self, user_id: int) -> Dict:
+        """Получить статистику использования для пользователя"""
+    
+    @abstractmethod
+    def get_tokens_used_since(self, since: int) -> Dict[int, int]:
+        """Токены по пользователям начиная с момента since"""
+    
+    @abstractmethod
+    def rebuild_stats_rollups(self, user_id: int = None) -> None:
+        """Пересчитать предрасчитанную статистику"""
+    
+    @abstractmethod
+    def add_scheduled_message(self, user_id: int, content: str, scheduled_time: int) -> int:
+        """Добавить запланированное сообщение"""
+    
+    @abstractmethod
+    def get_pending_scheduled_messages(self) -> List[Dict]:
+        """Получить запланированные сообщения, которые нужно отправить"""
+    
+    @abstractmethod
+    def mark_scheduled_message_sent(self, message_id: int) -> None:
+        """Отметить запланированное сообщение как отправленное"""
+    
+    @abstractmethod
+    def clear_chat_history(self, user_id: int) -> None:
+        """Очистить историю чата пользователя"""
+    
+    @abstractmethod
+    def iter_chat_history(self, user_id: int, batch_size: int = 500) -> Iterator[Tuple]:
+        """Построчное чтение истории чата (role, content, timestamp, message_type)"""
+    
+    @abstractmethod
+    def search_messages(self, user_id: int, query: str, limit: int = 10) -> List[Dict]:
+        """Полнотекстовый поиск по истории пользователя"""
+    
+    @abstractmethod
+    def rebuild_search_index(self) -> None:
+        """Перестроить полнотекстовый индекс"""
+    
+    @abstractmethod
+    def add_group_message(self, chat_id: int, thread_id: int, user_id: int, role: str, content: str) -> int:
+        """Добавить сообщение в историю группового чата"""
+    
+    @abstractmethod
+    def get_group_history(self, chat_id: int, thread_id: int, limit: int = 10) -> List[Dict]:
+        """Получить историю группового чата (темы)"""
+    
+    @abstractmethod
+    def clear_group_history(self, chat_id: int, thread_id: int) -> None:
+        """Очистить историю группового чата (темы)"""
+    
+    @abstractmethod
+    def get_users_over_message_limit(self, keep: int) -> List[int]:
+        """Пользователи, у которых сообщений больше keep"""
+    
+    @abstractmethod
+    def delete_old_messages_batch(self, user_id: int, keep: int, batch_size: int = 500) -> int:
+        """Удалить пачку старых сообщений пользователя"""
+    
+    @abstractmethod
+    def delete_old_group_messages_batch(self, keep: int, batch_size: int = 500) -> int:
+        """Удалить пачку сообщений групповых чатов сверх последних keep в каждом"""
+    
+    @abstractmethod
+    def delete_old_usage_stats_batch(self, before_timestamp: int, batch_size: int = 500) -> int:
+        """Удалить пачку старых строк usage_stats"""
+    
+    @abstractmethod
+    def get_orphaned_media(self, created_before: int, batch_size: int = 500) -> List[Dict]:
+        """Медиафайлы без ссылок из сообщений"""
+    
+    @abstractmethod
+    def delete_media_records(self, media_ids: List[int]) -> None:
+        """Удалить записи о медиафайлах"""
+    
+    @abstractmethod
+    def get_media_file_paths(self) -> set:
+        """Пути ко всем известным медиафайлам"""
+    
+    @abstractmethod
+    def incremental_vacuum(self, pages: int = 1000) -> int:
+        """Освободить место после удаления, возвращает остаток свободных страниц"""
+    
+    @abstractmethod
+    def enable_incremental_vacuum(self) -> bool:
+        """Включить постепенное освобождение места (однократная операция обслуживания)"""
+    
+    # Функции модуля database, которые бэкенд подменяет своими методами
+    OPERATIONS = (
+        "init_db", "flush_writes", "shutdown_db", "get_write_metrics",
+        "get_user", "create_or_update_user", "update_user_settings", "get_users_per_setting",
+        "add_message", "get_chat_history", "get_messages_since", "get_chat_summary", "save_chat_summary",
+        "add_media", "get_media",
+        "add_usage_stats", "get_prompt_cache_stats", "get_user_stats", "get_tokens_used_since",
+        "rebuild_stats_rollups",
+        "add_scheduled_message", "get_pending_scheduled_messages", "mark_scheduled_message_sent",
+        "clear_chat_history", "iter_chat_history", "search_messages", "rebuild_search_index",
+        "add_group_message", "get_group_history", "clear_group_history",
+        "get_users_over_message_limit", "delete_old_messages_batch", "delete_old_group_messages_batch",
+        "delete_old_usage_stats_batch",
+        "get_orphaned_media", "delete_media_records", "get_media_file_paths", "incremental_vacuum",
+        "enable_incremental_vacuum"
+    )
@@ -0,0 +1,729 @@
+import json
+import time
+import uuid
+import logging
+from typing import List, Dict, Optional, Iterator, Tuple
+from storage import (
+    Storage, SETTINGS_COLUMNS, default_settings, settings_from_row, split_settings, search_terms, weekday,
+    USAGE_COLUMNS, format_chat_history, format_prompt_cache_stats
+)
+from config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+# Полнотекстовый поиск: словарь simple подходит для смешанных русских и английских текстов
+PG_SEARCH_VECTOR = "to_tsvector('simple', coalesce(content, ''))"
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGINT PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        settings TEXT,
+        created_at BIGINT,
+        last_active BIGINT,
+        model TEXT,
+        temperature DOUBLE PRECISION,
+        max_tokens INTEGER,
+        conversation_mode TEXT,
+        language TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT,
+        role TEXT,
+        content TEXT,
+        timestamp BIGINT,
+        message_type TEXT,
+        media_id TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS media (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT,
+        file_id TEXT,
+        file_unique_id TEXT,
+        file_path TEXT,
+        media_type TEXT,
+        processed_text TEXT,
+        created_at BIGINT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS scheduled_messages (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT,
+        content TEXT,
+        scheduled_time BIGINT,
+        is_sent INTEGER DEFAULT 0,
+        created_at BIGINT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS usage_stats (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT,
+        model TEXT,
+        tokens_used INTEGER,
+        request_type TEXT,
+        timestamp BIGINT,
+        prompt_tokens INTEGER,
+        cached_tokens INTEGER,
+        latency_ms INTEGER,
+        conversation_mode TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        user_id BIGINT PRIMARY KEY,
+        summary TEXT,
+        last_message_id BIGINT NOT NULL DEFAULT 0,
+        updated_at BIGINT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_user_totals (
+        user_id BIGINT PRIMARY KEY,
+        message_count BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_user_models (
+        user_id BIGINT,
+        model TEXT,
+        tokens_used BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, model)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_user_requests (
+        user_id BIGINT,
+        request_type TEXT,
+        request_count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, request_type)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_user_weekdays (
+        user_id BIGINT,
+        day TEXT,
+        message_count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_archive_messages (
+        user_id BIGINT,
+        day TEXT,
+        message_count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_archive_usage (
+        user_id BIGINT,
+        model TEXT,
+        request_type TEXT,
+        tokens_used BIGINT NOT NULL DEFAULT 0,
+        request_count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, model, request_type)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS group_messages (
+        id BIGSERIAL PRIMARY KEY,
+        chat_id BIGINT,
+        thread_id BIGINT NOT NULL DEFAULT 0,
+        user_id BIGINT,
+        role TEXT,
+        content TEXT,
+        timestamp BIGINT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_users_model ON users (model)",
+    "CREATE INDEX IF NOT EXISTS idx_users_conversation_mode ON users (conversation_mode)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_media_id ON messages (media_id)",
+    f"CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN ({PG_SEARCH_VECTOR})",
+    "CREATE INDEX IF NOT EXISTS idx_media_file_unique_id ON media (file_unique_id)",
+    "CREATE INDEX IF NOT EXISTS idx_usage_stats_timestamp ON usage_stats (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_group_messages_chat ON group_messages (chat_id, thread_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_scheduled_pending ON scheduled_messages (scheduled_time) WHERE is_sent = 0"
+]
+
+# Типы столбцов SQLite и их аналоги в PostgreSQL
+PG_COLUMN_TYPES = {"TEXT": "TEXT", "REAL": "DOUBLE PRECISION", "INTEGER": "INTEGER"}
+
+# День недели в UTC в том же формате, что strftime('%w') в SQLite
+PG_WEEKDAY = "EXTRACT(DOW FROM to_timestamp(timestamp) AT TIME ZONE 'UTC')::int::text"
+
+class PostgresStorage(Storage):
+    """Хранилище в PostgreSQL с пулом соединений (для запуска нескольких экземпляров бота)"""
+    
+    def __init__(self, dsn: str = None, min_size: int = None, max_size: int = None):
+        """Инициализация пула соединений"""
+        try:
+            from psycopg_pool import ConnectionPool
+        except ImportError:
+            raise RuntimeError("Для DB_BACKEND=postgres установите пакеты psycopg и psycopg-pool")
+        
+        dsn = dsn or config.DATABASE_URL
+        if not dsn:
+            raise RuntimeError("Для DB_BACKEND=postgres необходимо указать DATABASE_URL")
+        
+        self.pool = ConnectionPool(
+            dsn,
+            min_size=min_size or config.DB_POOL_MIN_SIZE,
+            max_size=max_size or config.DB_POOL_MAX_SIZE,
+            open=True
+        )
+    
+    def init_db(self) -> None:
+        """Создание схемы"""
+        with self.pool.connection() as conn:
+            # Столбцы настроек для схемы, созданной до их появления
+            for column, column_type in SETTINGS_COLUMNS.items():
+                conn.execute(f"""
+                ALTER TABLE IF EXISTS users ADD COLUMN IF NOT EXISTS {column} {PG_COLUMN_TYPES[column_type]}
+                """)
+            
+            # Столбцы статистики кеширования промптов
+            for column, column_type in USAGE_COLUMNS.items():
+                conn.execute(f"""
+                ALTER TABLE IF EXISTS usage_stats ADD COLUMN IF NOT EXISTS {column} {PG_COLUMN_TYPES[column_type]}
+                """)
+            
+            for statement in SCHEMA:
+                conn.execute(statement)
+            
+            self._migrate_user_settings(conn)
+    
+    def _migrate_user_settings(self, conn) -> None:
+        """Перенос настроек из JSON в users.settings в отдельные столбцы"""
+        rows = conn.execute("""
+        SELECT user_id, settings FROM users
+        WHERE settings IS NOT NULL AND settings != '' AND model IS NULL
+        """).fetchall()
+        
+        updates = []
+        for user_id, settings_json in rows:
+            try:
+                settings = json.loads(settings_json)
+            except json.JSONDecodeError:
+                logger.warning(f"Некорректные настройки пользователя {user_id}, используются значения по умолчанию")
+                continue
+            updates.append(tuple(settings.get(column) for column in SETTINGS_COLUMNS) + (user_id,))
+        
+        if updates:
+            assignments = ", ".join(f"{column} = %s" for column in SETTINGS_COLUMNS)
+            with conn.cursor() as cursor:
+                cursor.executemany(f"UPDATE users SET {assignments} WHERE user_id = %s", updates)
+            logger.info(f"Настройки {len(updates)} пользователей перенесены в отдельные столбцы")
+    
+    def flush_writes(self) -> None:
+        """Отложенной записи нет: каждая операция фиксируется сразу"""
+    
+    def shutdown_db(self) -> None:
+        """Закрытие пула соединений"""
+        self.pool.close()
+    
+    def get_write_metrics(self) -> Dict:
+        """Метрики пула соединений"""
+        return self.pool.get_stats()
+    
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """Получить информацию о пользователе"""
+        with self.pool.connection() as conn:
+            user_data = conn.execute(f"""
+            SELECT user_id, username, first_name, last_name, created_at, last_active, {", ".join(SETTINGS_COLUMNS)}
+            FROM users WHERE user_id = %s
+            """, (user_id,)).fetchone()
+        
+        if not user_data:
+            return None
+        
+        columns = ['user_id', 'username', 'first_name', 'last_name', 'created_at', 'last_active']
+        user_dict = dict(zip(columns, user_data))
+        user_dict['settings'] = settings_from_row(user_data[len(columns):])
+        
+        return user_dict
+    
+    def create_or_update_user(self, user_id: int, username: str, first_name: str, last_name: str) -> None:
+        """Создать или обновить пользователя"""
+        current_time = int(time.time())
+        settings = default_settings()
+        
+        with self.pool.connection() as conn:
+            conn.execute(f"""
+            INSERT INTO users (user_id, username, first_name, last_name, created_at, last_active, {", ".join(settings)})
+            VALUES (%s, %s, %s, %s, %s, %s, {", ".join(["%s"] * len(settings))})
+            ON CONFLICT (user_id) DO UPDATE SET
+                username = EXCLUDED.username,
+                first_name = EXCLUDED.first_name,
+                last_name = EXCLUDED.last_name,
+                last_active = EXCLUDED.last_active
+            """, (user_id, username, first_name, last_name, current_time, current_time, *settings.values()))
+    
+    def update_user_settings(self, user_id: int, settings: Dict) -> None:
+        """Обновить настройки пользователя (меняются только переданные столбцы)"""
+        settings = split_settings(settings)
+        assignments = "".join(f"{column} = %s, " for column in settings)
+        
+        with self.pool.connection() as conn:
+            conn.execute(f"""
+            UPDATE users SET {assignments}last_active = %s WHERE user_id = %s
+            """, (*settings.values(), int(time.time()), user_id))
+    
+    def get_users_per_setting(self, column: str) -> Dict:
+        """Количество пользователей по значению настройки (например, по модели)"""
+        if column not in SETTINGS_COLUMNS:
+            raise ValueError(f"Неизвестная настройка: {column}")
+        
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"SELECT {column}, COUNT(*) FROM users GROUP BY {column} ORDER BY 2 DESC").fetchall()
+        
+        return dict(rows)
+    
+    def add_message(self, user_id: int, role: str, content: str,
+                    message_type: str = "text", media_id: str = None) -> Optional[int]:
+        """Добавить сообщение в историю"""
+        current_time = int(time.time())
+        
+        with self.pool.connection() as conn:
+            message_id = conn.execute("""
+            INSERT INTO messages (user_id, role, content, timestamp, message_type, media_id)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING id
+            """, (user_id, role, content, current_time, message_type, media_id)).fetchone()[0]
+            
+            conn.execute("""
+            INSERT INTO stats_user_totals (user_id, message_count) VALUES (%s, 1)
+            ON CONFLICT (user_id) DO UPDATE SET message_count = stats_user_totals.message_count + 1
+            """, (user_id,))
+            conn.execute("""
+            INSERT INTO stats_user_weekdays (user_id, day, message_count) VALUES (%s, %s, 1)
+            ON CONFLICT (user_id, day) DO UPDATE SET message_count = stats_user_weekdays.message_count + 1
+            """, (user_id, weekday(current_time)))
+        
+        return message_id
+    
+    def get_chat_history(self, user_id: int, limit: int = 10) -> List[Dict]:
+        """Получить историю чата пользователя"""
+        with self.pool.connection() as conn:
+            messages = conn.execute("""
+            SELECT m.role, m.content, m.timestamp, m.message_type, m.media_id, med.processed_text
+            FROM messages m
+            LEFT JOIN media med ON m.media_id = med.file_unique_id
+            WHERE m.user_id = %s
+            ORDER BY m.timestamp DESC, m.id DESC
+            LIMIT %s
+            """, (user_id, limit)).fetchall()
+        
+        return format_chat_history(messages)
+    
+    def get_messages_since(self, user_id: int, after_id: int = 0, limit: int = 50) -> List[Dict]:
+        """Первые limit сообщений пользователя с id больше after_id (от старых к новым)"""
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+            SELECT id, role, content, message_type FROM messages
+            WHERE user_id = %s AND id > %s
+            ORDER BY id
+            LIMIT %s
+            """, (user_id, after_id, limit)).fetchall()
+        
+        columns = ["id", "role", "content", "message_type"]
+        return [dict(zip(columns, row)) for row in rows]
+    
+    def get_chat_summary(self, user_id: int) -> Optional[Dict]:
+        """Сохраненное резюме разговора пользователя"""
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT summary, last_message_id, updated_at FROM chat_summaries WHERE user_id = %s", (user_id,)
+            ).fetchone()
+        
+        return dict(zip(["summary", "last_message_id", "updated_at"], row)) if row else None
+    
+    def save_chat_summary(self, user_id: int, summary: str, last_message_id: int) -> None:
+        """Сохранить резюме разговора и последнее учтенное сообщение"""
+        with self.pool.connection() as conn:
+            conn.execute("""
+            INSERT INTO chat_summaries (user_id, summary, last_message_id, updated_at) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET
+                summary = EXCLUDED.summary,
+                last_message_id = EXCLUDED.last_message_id,
+                updated_at = EXCLUDED.updated_at
+            """, (user_id, summary, last_message_id, int(time.time())))
+    
+    def add_media(self, user_id: int, file_id: str, file_unique_id: str,
+                  file_path: str, media_type: str, processed_text: str = None) -> int:
+        """Добавить медиафайл"""
+        with self.pool.connection() as conn:
+            return conn.execute("""
+            INSERT INTO media (user_id, file_id, file_unique_id, file_path, media_type, processed_text, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+            """, (user_id, file_id, file_unique_id, file_path, media_type, processed_text,
+                  int(time.time()))).fetchone()[0]
+    
+    def get_media(self, file_unique_id: str) -> Optional[Dict]:
+        """Получить информацию о медиафайле"""
+        columns = ['id', 'user_id', 'file_id', 'file_unique_id', 'file_path', 'media_type', 'processed_text', 'created_at']
+        
+        with self.pool.connection() as conn:
+            media_data = conn.execute(
+                f"SELECT {', '.join(columns)} FROM media WHERE file_unique_id = %s", (file_unique_id,)
+            ).fetchone()
+        
+        return dict(zip(columns, media_data)) if media_data else None
+    
+    def add_usage_stats(self, user_id: int, model: str, tokens_used: int, request_type: str,
+                        prompt_tokens: int = 0, cached_tokens: int = 0, latency_ms: int = None,
+                        conversation_mode: str = None) -> None:
+        """Добавить статистику использования"""
+        with self.pool.connection() as conn:
+            conn.execute("""
+            INSERT INTO usage_stats (user_id, model, tokens_used, request_type, timestamp,
+                                     prompt_tokens, cached_tokens, latency_ms, conversation_mode)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (user_id, model, tokens_used, request_type, int(time.time()),
+                  prompt_tokens, cached_tokens, latency_ms, conversation_mode))
+            
+            conn.execute("""
+            INSERT INTO stats_user_models (user_id, model, tokens_used) VALUES (%s, %s, %s)
+            ON CONFLICT (user_id, model) DO UPDATE SET tokens_used = stats_user_models.tokens_used + EXCLUDED.tokens_used
+            """, (user_id, model, tokens_used))
+            conn.execute("""
+            INSERT INTO stats_user_requests (user_id, request_type, request_count) VALUES (%s, %s, 1)
+            ON CONFLICT (user_id, request_type) DO UPDATE SET request_count = stats_user_requests.request_count + 1
+            """, (user_id, request_type))
+    
+    def get_prompt_cache_stats(self, since: int = None) -> List[Dict]:
+        """Эффективность кеширования промптов по режимам разговора и моделям"""
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+            SELECT conversation_mode, model, COUNT(*), SUM(prompt_tokens), SUM(cached_tokens),
+                   AVG(latency_ms), AVG(latency_ms) FILTER (WHERE cached_tokens > 0)
+            FROM usage_stats
+            WHERE request_type = 'chat' AND prompt_tokens IS NOT NULL AND timestamp >= %s
+            GROUP BY conversation_mode, model
+            ORDER BY COUNT(*) DESC
+            """, (since or 0,)).fetchall()
+        
+        return format_prompt_cache_stats(rows)
+    
+    def get_user_stats(self, user_id: int) -> Dict:
+        """Получить статистику использования для пользователя"""
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT message_count FROM stats_user_totals WHERE user_id = %s", (user_id,)
+            ).fetchone()
+            tokens_by_model = dict(conn.execute(
+                "SELECT model, tokens_used FROM stats_user_models WHERE user_id = %s", (user_id,)
+            ).fetchall())
+            requests_by_type = dict(conn.execute(
+                "SELECT request_type, request_count FROM stats_user_requests WHERE user_id = %s", (user_id,)
+            ).fetchall())
+            activity_by_day = dict(conn.execute(
+                "SELECT day, message_count FROM stats_user_weekdays WHERE user_id = %s AND message_count > 0",
+                (user_id,)
+            ).fetchall())
+        
+        return {
+            "message_count": row[0] if row else 0,
+            "tokens_by_model": tokens_by_model,
+            "requests_by_type": requests_by_type,
+            "activity_by_day": activity_by_day
+        }
+    
+    def get_tokens_used_since(self, since: int) -> Dict[int, int]:
+        """Токены по пользователям начиная с момента since (для сверки квот)"""
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+            SELECT user_id, SUM(tokens_used) FROM usage_stats
+            WHERE timestamp >= %s
+            GROUP BY user_id
+            """, (since,)).fetchall()
+        
+        return {user_id: int(total or 0) for user_id, total in rows}
+    
+    def rebuild_stats_rollups(self, user_id: int = None) -> None:
+        """Пересчитать предрасчитанную статистику по исходным таблицам и архивным агрегатам"""
+        if user_id is None:
+            where, params = "", ()
+        else:
+            where, params = "WHERE user_id = %s", (user_id,)
+        
+        with self.pool.connection() as conn:
+            for table in ("stats_user_totals", "stats_user_models", "stats_user_requests", "stats_user_weekdays"):
+                conn.execute(f"DELETE FROM {table} {where}", params)
+            
+            conn.execute(f"""
+            INSERT INTO stats_user_totals (user_id, message_count)
+            SELECT user_id, SUM(cnt) FROM (
+                SELECT user_id, COUNT(*) AS cnt FROM messages {where} GROUP BY user_id
+                UNION ALL
+                SELECT user_id, message_count FROM stats_archive_messages {where}
+            ) t GROUP BY user_id
+            """, params * 2)
+            
+            conn.execute(f"""
+            INSERT INTO stats_user_weekdays (user_id, day, message_count)
+            SELECT user_id, day, SUM(cnt) FROM (
+                SELECT user_id, {PG_WEEKDAY} AS day, COUNT(*) AS cnt FROM messages {where} GROUP BY 1, 2
+                UNION ALL
+                SELECT user_id, day, message_count FROM stats_archive_messages {where}
+            ) t GROUP BY user_id, day
+            """, params * 2)
+            
+            conn.execute(f"""
+            INSERT INTO stats_user_models (user_id, model, tokens_used)
+            SELECT user_id, model, SUM(tokens) FROM (
+                SELECT user_id, model, SUM(tokens_used) AS tokens FROM usage_stats {where} GROUP BY user_id, model
+                UNION ALL
+                SELECT user_id, model, tokens_used FROM stats_archive_usage {where}
+            ) t GROUP BY user_id, model
+            """, params * 2)
+            
+            conn.execute(f"""
+            INSERT INTO stats_user_requests (user_id, request_type, request_count)
+            SELECT user_id, request_type, SUM(cnt) FROM (
+                SELECT user_id, request_type, COUNT(*) AS cnt FROM usage_stats {where} GROUP BY user_id, request_type
+                UNION ALL
+                SELECT user_id, request_type, request_count FROM stats_archive_usage {where}
+            ) t GROUP BY user_id, request_type
+            """, params * 2)
+    
+    def add_scheduled_message(self, user_id: int, content: str, scheduled_time: int) -> int:
+        """Добавить запланированное сообщение"""
+        with self.pool.connection() as conn:
+            return conn.execute("""
+            INSERT INTO scheduled_messages (user_id, content, scheduled_time, created_at)
+            VALUES (%s, %s, %s, %s)
+            RETURNING id
+            """, (user_id, content, scheduled_time, int(time.time()))).fetchone()[0]
+    
+    def get_pending_scheduled_messages(self) -> List[Dict]:
+        """Получить запланированные сообщения, которые нужно отправить"""
+        with self.pool.connection() as conn:
+            messages = conn.execute("""
+            SELECT id, user_id, content, scheduled_time
+            FROM scheduled_messages
+            WHERE scheduled_time <= %s AND is_sent = 0
+            """, (int(time.time()),)).fetchall()
+        
+        return [
+            {"id": msg_id, "user_id": user_id, "content": content, "scheduled_time": scheduled_time}
+            for msg_id, user_id, content, scheduled_time in messages
+        ]
+    
+    def mark_scheduled_message_sent(self, message_id: int) -> None:
+        """Отметить запланированное сообщение как отправленное"""
+        with self.pool.connection() as conn:
+            conn.execute("UPDATE scheduled_messages SET is_sent = 1 WHERE id = %s", (message_id,))
+    
+    def clear_chat_history(self, user_id: int) -> None:
+        """Очистить историю чата пользователя"""
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM messages WHERE user_id = %s", (user_id,))
+            
+            # Статистика сообщений считается по сохраненной истории
+            for table in ("stats_user_totals", "stats_user_weekdays", "stats_archive_messages", "chat_summaries"):
+                conn.execute(f"DELETE FROM {table} WHERE user_id = %s", (user_id,))
+    
+    def iter_chat_history(self, user_id: int, batch_size: int = 500) -> Iterator[Tuple]:
+        """Построчное чтение истории чата через серверный курсор"""
+        with self.pool.connection() as conn:
+            # Имя курсора уникально: одновременные выгрузки одного пользователя не конфликтуют
+            with conn.cursor(name=f"export_{user_id}_{uuid.uuid4().hex}") as cursor:
+                cursor.itersize = batch_size
+                cursor.execute("""
+                SELECT role, content, timestamp, message_type
+                FROM messages
+                WHERE user_id = %s
+                ORDER BY timestamp ASC, id ASC
+                """, (user_id,))
+                
+                yield from cursor
+    
+    def search_messages(self, user_id: int, query: str, limit: int = 10) -> List[Dict]:
+        """Полнотекстовый поиск по истории пользователя, результаты по релевантности"""
+        terms = search_terms(query)
+        if not terms:
+            return []
+        
+        # Все слова обязательны, последнее ищется как префикс
+        tsquery = " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+        
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"""
+            SELECT id, role, timestamp,
+                   ts_headline('simple', content, q, 'StartSel=«, StopSel=», MaxWords=16, MinWords=6')
+            FROM (
+                SELECT id, role, timestamp, content, q, ts_rank({PG_SEARCH_VECTOR}, q) AS rank
+                FROM messages, to_tsquery('simple', %s) AS q
+                WHERE user_id = %s AND {PG_SEARCH_VECTOR} @@ q
+                ORDER BY rank DESC
+                LIMIT %s
+            ) found
+            ORDER BY rank DESC
+            """, (tsquery, user_id, limit)).fetchall()
+        
+        return [
+            {"id": msg_id, "role": role, "timestamp": timestamp, "snippet": snippet}
+            for msg_id, role, timestamp, snippet in rows
+        ]
+    
+    def rebuild_search_index(self) -> None:
+        """Перестроить полнотекстовый индекс"""
+        with self.pool.connection() as conn:
+            conn.execute("REINDEX INDEX idx_messages_search")
+        
+        logger.info("Полнотекстовый индекс перестроен")
+    
+    def add_group_message(self, chat_id: int, thread_id: int, user_id: int, role: str, content: str) -> int:
+        """Добавить сообщение в историю группового чата"""
+        with self.pool.connection() as conn:
+            return conn.execute("""
+            INSERT INTO group_messages (chat_id, thread_id, user_id, role, content, timestamp)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING id
+            """, (chat_id, thread_id, user_id, role, content, int(time.time()))).fetchone()[0]
+    
+    def get_group_history(self, chat_id: int, thread_id: int, limit: int = 10) -> List[Dict]:
+        """Получить историю группового чата (темы) в формате OpenRouter API"""
+        with self.pool.connection() as conn:
+            messages = conn.execute("""
+            SELECT role, content, timestamp, 'text', NULL, NULL
+            FROM group_messages
+            WHERE chat_id = %s AND thread_id = %s
+            ORDER BY id DESC
+            LIMIT %s
+            """, (chat_id, thread_id, limit)).fetchall()
+        
+        return format_chat_history(messages)
+    
+    def clear_group_history(self, chat_id: int, thread_id: int) -> None:
+        """Очистить историю группового чата (темы)"""
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM group_messages WHERE chat_id = %s AND thread_id = %s", (chat_id, thread_id))
+    
+    def get_users_over_message_limit(self, keep: int) -> List[int]:
+        """Пользователи, у которых сообщений больше keep"""
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+            SELECT user_id FROM messages GROUP BY user_id HAVING COUNT(*) > %s
+            """, (keep,)).fetchall()
+        
+        return [row[0] for row in rows]
+    
+    def delete_old_messages_batch(self, user_id: int, keep: int, batch_size: int = 500) -> int:
+        """Удалить пачку самых старых сообщений пользователя сверх последних keep"""
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+            DELETE FROM messages WHERE id IN (
+                SELECT id FROM messages
+                WHERE user_id = %s AND id <= (
+                    SELECT id FROM messages WHERE user_id = %s ORDER BY id DESC LIMIT 1 OFFSET %s
+                )
+                ORDER BY id
+                LIMIT %s
+            )
+            RETURNING timestamp
+            """, (user_id, user_id, keep, batch_size)).fetchall()
+            
+            by_day = {}
+            for (timestamp,) in rows:
+                day = weekday(timestamp)
+                by_day[day] = by_day.get(day, 0) + 1
+            
+            for day, count in by_day.items():
+                conn.execute("""
+                INSERT INTO stats_archive_messages (user_id, day, message_count) VALUES (%s, %s, %s)
+                ON CONFLICT (user_id, day) DO UPDATE SET
+                    message_count = stats_archive_messages.message_count + EXCLUDED.message_count
+                """, (user_id, day, count))
+        
+        return len(rows)
+    
+    def delete_old_group_messages_batch(self, keep: int, batch_size: int = 500) -> int:
+        """Удалить пачку сообщений групповых чатов сверх последних keep в каждом чате (теме)"""
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+            DELETE FROM group_messages WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id, thread_id ORDER BY id DESC) AS position
+                    FROM group_messages
+                ) ranked
+                WHERE position > %s
+                LIMIT %s
+            )
+            """, (keep, batch_size))
+            return cursor.rowcount
+    
+    def delete_old_usage_stats_batch(self, before_timestamp: int, batch_size: int = 500) -> int:
+        """Удалить пачку строк usage_stats старше указанного времени, сохранив их агрегаты"""
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+            DELETE FROM usage_stats WHERE id IN (
+                SELECT id FROM usage_stats WHERE timestamp < %s ORDER BY id LIMIT %s
+            )
+            RETURNING user_id, model, request_type, tokens_used
+            """, (before_timestamp, batch_size)).fetchall()
+            
+            aggregated = {}
+            for user_id, model, request_type, tokens_used in rows:
+                key = (user_id, model, request_type)
+                tokens, count = aggregated.get(key, (0, 0))
+                aggregated[key] = (tokens + (tokens_used or 0), count + 1)
+            
+            for (user_id, model, request_type), (tokens, count) in aggregated.items():
+                conn.execute("""
+                INSERT INTO stats_archive_usage (user_id, model, request_type, tokens_used, request_count)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (user_id, model, request_type) DO UPDATE SET
+                    tokens_used = stats_archive_usage.tokens_used + EXCLUDED.tokens_used,
+                    request_count = stats_archive_usage.request_count + EXCLUDED.request_count
+                """, (user_id, model, request_type, tokens, count))
+        
+        return len(rows)
+    
+    def get_orphaned_media(self, created_before: int, batch_size: int = 500) -> List[Dict]:
+        """Медиафайлы, на которые больше не ссылается ни одно сообщение"""
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+            SELECT med.id, med.file_path FROM media med
+            WHERE med.created_at < %s
+              AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.media_id = med.file_unique_id)
+            ORDER BY med.id
+            LIMIT %s
+            """, (created_before, batch_size)).fetchall()
+        
+        return [{"id": media_id, "file_path": file_path} for media_id, file_path in rows]
+    
+    def delete_media_records(self, media_ids: List[int]) -> None:
+        """Удалить записи о медиафайлах"""
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM media WHERE id = ANY(%s)", (list(media_ids),))
+    
+    def get_media_file_paths(self) -> set:
+        """Пути ко всем медиафайлам, известным базе данных"""
+        import os
+        
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT file_path FROM media WHERE file_path IS NOT NULL").fetchall()
+        
+        return {os.path.normpath(row[0]) for row in rows}
+    
+    def incremental_vacuum(self, pages: int = 1000) -> int:
+        """Освобождение места выполняет autovacuum PostgreSQL"""
+        return 0
+    
+    def enable_incremental_vacuum(self) -> bool:
+        """В PostgreSQL не требуется"""
+        return False
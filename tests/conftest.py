@@ -0,0 +1,21 @@
+"""
+Общая настройка тестов.
+
+Модули бота импортируются из корня репозитория (в том числе модули из файлов
+с дефисом в имени, см. benchmarks/bot_modules.py), а конфигурация не видит
+настоящих ключей.
+"""
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+os.environ.setdefault("TELEGRAM_TOKEN", "0:test")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+
+from benchmarks.bot_modules import install
+
+install()
@@ -0,0 +1,130 @@
+"""Разбиение и разметка длинных ответов, страницы ответа"""
+
+import asyncio
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram.error import BadRequest
+from delivery import (
+    TELEGRAM_MESSAGE_LIMIT, PageCache, split_message, prepare_chunks, to_telegram_markdown,
+    page_keyboard, parse_page_callback, get_page, _page_cache, _send_chunk
+)
+
+def fences_balanced(text: str) -> bool:
+    """Все блоки кода закрыты"""
+    return text.count("```") % 2 == 0
+
+def test_short_text_is_one_chunk():
+    assert split_message("Привет!\n\nКак дела?") == ["Привет!\n\nКак дела?"]
+
+def test_chunks_respect_limit_and_keep_paragraphs():
+    paragraphs = [f"Абзац {i} " + "слово " * 30 for i in range(40)]
+    chunks = split_message("\n\n".join(paragraphs), limit=500)
+    
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    # Абзацы не разрезаются, если помещаются в часть целиком
+    assert "\n\n".join(chunks).split("\n\n") == [paragraph.strip("\n") for paragraph in paragraphs]
+
+def test_long_code_block_is_split_into_closed_blocks():
+    code = "```python\n" + "\n".join(f"value_{i} = {i}" for i in range(400)) + "\n```"
+    chunks = split_message(f"Код:\n\n{code}\n\nГотово.", limit=1000)
+    
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    assert all(fences_balanced(chunk) for chunk in chunks)
+    # Каждая часть кода снова оформлена как блок с языком
+    assert all(chunk.count("```python\n") == chunk.count("```") // 2 for chunk in chunks)
+
+def test_unclosed_code_block_is_closed():
+    text = "Начало\n\n```\nprint('оборвано')"
+    
+    assert all(fences_balanced(chunk) for chunk in split_message(text))
+    assert fences_balanced(to_telegram_markdown(text))
+
+@pytest.mark.parametrize("text", [
+    "snake_case_name " * 600,
+    "x*y[z] " * 1200,
+    "```py\n" + "a_b = c_d\n" * 800 + "```",
+    "[ссылка] _курсив_ *жирный* " * 400
+])
+def test_formatted_chunks_fit_after_escaping(text):
+    chunks = prepare_chunks(text)
+    
+    for raw, formatted in chunks:
+        assert len(raw) <= TELEGRAM_MESSAGE_LIMIT
+        assert formatted is None or len(formatted) <= TELEGRAM_MESSAGE_LIMIT
+        assert formatted is None or fences_balanced(formatted)
+
+def test_markdown_disabled_keeps_raw_text():
+    assert prepare_chunks("**жирный**", markdown=False) == [("**жирный**", None)]
+
+def test_markdown_conversion():
+    assert to_telegram_markdown("## Заголовок") == "*Заголовок*"
+    assert to_telegram_markdown("- пункт") == "• пункт"
+    assert to_telegram_markdown("a_b без пары") == "a\\_b без пары"
+
+class FakeBot:
+    """Бот, отклоняющий сообщения с разметкой"""
+    
+    def __init__(self, error: str):
+        self.error = error
+        self.sent = []
+    
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None, **options):
+        if parse_mode is not None:
+            raise BadRequest(self.error)
+        self.sent.append(text)
+        return text
+
+@pytest.mark.parametrize("error", ["Can't parse entities: unexpected end", "Message is too long"])
+def test_send_falls_back_to_raw_text(error):
+    bot = FakeBot(error)
+    
+    asyncio.run(_send_chunk(bot, 1, ("raw *text", "formatted")))
+    
+    assert bot.sent == ["raw *text"]
+
+def test_send_reraises_other_errors():
+    bot = FakeBot("Chat not found")
+    
+    with pytest.raises(BadRequest):
+        asyncio.run(_send_chunk(bot, 1, ("raw", "formatted")))
+
+def test_page_callbacks_round_trip():
+    pages = [(f"страница {i}", None) for i in range(5)]
+    page_id = _page_cache.put(pages)
+    
+    buttons = page_keyboard(page_id, 2, len(pages)).inline_keyboard[0]
+    assert [button.text for button in buttons] == ["◀️", "3/5", "▶️"]
+    
+    for button, expected in zip(buttons, (1, 2, 3)):
+        selection = parse_page_callback(button.callback_data)
+        assert selection == (page_id, expected)
+        chunk, keyboard = get_page(*selection)
+        assert chunk == pages[expected]
+        assert keyboard.inline_keyboard[0][-2 if expected < 4 else -1].text == f"{expected + 1}/5"
+
+def test_first_and_last_page_have_no_outer_buttons():
+    assert [button.text for button in page_keyboard("id", 0, 3).inline_keyboard[0]] == ["1/3", "▶️"]
+    assert [button.text for button in page_keyboard("id", 2, 3).inline_keyboard[0]] == ["◀️", "3/3"]
+
+@pytest.mark.parametrize("data", ["page_", "page_abc", "page_abc_x", "pages_abc_1", "other"])
+def test_malformed_page_callbacks(data):
+    assert parse_page_callback(data) is None
+
+def test_missing_or_expired_pages():
+    assert get_page("unknown", 0) is None
+    
+    cache = PageCache(max_size=2, ttl=-1)
+    assert cache.get(cache.put([("a", None)])) is None
+
+def test_page_cache_evicts_least_recent():
+    cache = PageCache(max_size=2, ttl=60)
+    first = cache.put([("1", None)])
+    second = cache.put([("2", None)])
+    cache.get(first)
+    cache.put([("3", None)])
+    
+    assert cache.get(first) is not None
+    assert cache.get(second) is None
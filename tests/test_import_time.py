@@ -0,0 +1,13 @@
+"""Импорт main не загружает тяжелые необязательные зависимости (см. benchmarks/import_time.py)"""
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from benchmarks.import_time import LAZY_MODULES, measure_import
+
+def test_main_import_keeps_heavy_modules_lazy(tmp_path):
+    result = measure_import("main", str(tmp_path))
+    
+    assert result["total"] > 0
+    assert [name for name in result["loaded"] if name in LAZY_MODULES] == []
@@ -0,0 +1,125 @@
+"""Каталог моделей OpenRouter на локальном ответе /models (benchmarks/fixtures)"""
+
+import os
+import json
+import time
+import pytest
+
+pytest.importorskip("requests")
+
+import model_registry
+from model_registry import DEFAULT_CONTEXT_LENGTH, ModelRegistry
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       "benchmarks", "fixtures", "openrouter_models.json")
+
+VISION_MODEL = "google/gemini-2.0-flash-001"
+TEXT_MODEL = "meta-llama/llama-3.1-8b-instruct:free"
+LIMITED_MODEL = "anthropic/claude-3-haiku:free"
+
+@pytest.fixture
+def registry(tmp_path):
+    """Реестр, загруженный из файла-заглушки"""
+    registry = ModelRegistry(cache_file=str(tmp_path / "models.json"), ttl=3600, fixture=FIXTURE, enabled=True)
+    registry.load()
+    return registry
+
+def fixture_data():
+    """Модели из файла-заглушки"""
+    with open(FIXTURE, "r", encoding="utf-8") as f:
+        return json.load(f)["data"]
+
+def test_fixture_is_loaded(registry):
+    assert len(registry.available_models(item["id"] for item in fixture_data())) == len(fixture_data())
+    assert not registry.is_available("unknown/model")
+    assert not registry.is_stale()
+
+def test_supports_images(registry):
+    assert registry.supports_images(VISION_MODEL)
+    assert not registry.supports_images(TEXT_MODEL)
+    # Неизвестные модели - по префиксу
+    assert registry.supports_images("openai/gpt-4o-2099")
+    assert not registry.supports_images("unknown/model")
+
+def test_context_length(registry):
+    assert registry.context_length(VISION_MODEL) == 1048576
+    assert registry.context_length(TEXT_MODEL) == 131072
+    assert registry.context_length("unknown/model") == DEFAULT_CONTEXT_LENGTH
+
+def test_max_completion_tokens_is_clamped(registry):
+    assert registry.max_completion_tokens(LIMITED_MODEL, 10000) == 4096
+    assert registry.max_completion_tokens(LIMITED_MODEL, 1000) == 1000
+    assert registry.max_completion_tokens("unknown/model", 10000) == 10000
+
+def test_resolve_keeps_available_model(registry):
+    assert registry.resolve(TEXT_MODEL, [VISION_MODEL]) == TEXT_MODEL
+
+def test_resolve_falls_back_to_first_suitable_candidate(registry):
+    assert registry.resolve("unknown/model", ["missing/model", TEXT_MODEL, VISION_MODEL]) == TEXT_MODEL
+    assert registry.resolve(TEXT_MODEL, [TEXT_MODEL, VISION_MODEL], need_images=True) == VISION_MODEL
+    # Подходящей замены нет - остается выбранная модель
+    assert registry.resolve("unknown/model", ["missing/model"]) == "unknown/model"
+
+def test_empty_registry_allows_everything(tmp_path):
+    registry = ModelRegistry(cache_file=str(tmp_path / "models.json"), ttl=3600, fixture="", enabled=False)
+    
+    assert registry.is_available("any/model")
+    assert registry.context_length("any/model") == DEFAULT_CONTEXT_LENGTH
+    assert registry.resolve("any/model", []) == "any/model"
+
+def write_cache(path, fetched_at):
+    """Кеш каталога с заданным временем загрузки"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"fetched_at": fetched_at, "data": fixture_data()}, f)
+
+def test_fresh_cache_is_used_without_refresh(tmp_path, monkeypatch):
+    cache_file = tmp_path / "models.json"
+    write_cache(cache_file, time.time() - 60)
+    registry = ModelRegistry(cache_file=str(cache_file), ttl=3600, fixture="", enabled=True)
+    monkeypatch.setattr(registry, "refresh", lambda: pytest.fail("свежий кеш не должен обновляться"))
+    
+    registry.load()
+    
+    assert not registry.is_stale()
+    assert registry.supports_images(VISION_MODEL)
+
+def test_stale_cache_is_loaded_and_refreshed(tmp_path, monkeypatch):
+    cache_file = tmp_path / "models.json"
+    write_cache(cache_file, time.time() - 7200)
+    registry = ModelRegistry(cache_file=str(cache_file), ttl=3600, fixture="", enabled=True)
+    refreshed = []
+    monkeypatch.setattr(registry, "refresh", lambda: refreshed.append(True))
+    
+    registry.load()
+    
+    assert registry.is_stale()
+    assert refreshed == [True]
+    # Пока обновление не удалось, используются данные из устаревшего кеша
+    assert registry.context_length(TEXT_MODEL) == 131072
+
+def test_refresh_writes_cache(tmp_path, monkeypatch):
+    class Response:
+        def raise_for_status(self):
+            pass
+        
+        def json(self):
+            return {"data": fixture_data()}
+    
+    monkeypatch.setattr(model_registry.requests, "get", lambda *args, **kwargs: Response())
+    cache_file = tmp_path / "cache" / "models.json"
+    registry = ModelRegistry(cache_file=str(cache_file), ttl=3600, fixture="", enabled=True)
+    
+    assert registry.refresh()
+    assert not registry.is_stale()
+    
+    with open(cache_file, "r", encoding="utf-8") as f:
+        cached = json.load(f)
+    assert len(cached["data"]) == len(fixture_data())
+    assert time.time() - cached["fetched_at"] < 60
+
+def test_corrupted_cache_is_ignored(tmp_path):
+    cache_file = tmp_path / "models.json"
+    cache_file.write_text("{not json", encoding="utf-8")
+    registry = ModelRegistry(cache_file=str(cache_file), ttl=3600, fixture="", enabled=True)
+    
+    assert registry._read_cache() is None
@@ -0,0 +1,110 @@
+"""Очередь исходящих запросов: паузы после RetryAfter и индикаторы действий"""
+
+import time
+import asyncio
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram.error import RetryAfter
+from outbound import OutboundQueue, CHAT_ACTION_TTL, GLOBAL_RETRY_AFTER_CHATS
+
+def make_queue() -> OutboundQueue:
+    """Очередь с быстрыми лимитами чатов и без повторов"""
+    return OutboundQueue(global_rate=100, chat_rate=100, chat_burst=1, max_retries=0)
+
+async def request(queue, chat_id, callback, endpoint="sendMessage"):
+    """Запрос через очередь, как его ставит python-telegram-bot"""
+    return await queue.process_request(callback, (), {}, endpoint, {"chat_id": chat_id}, None)
+
+async def flood(seconds: int):
+    raise RetryAfter(seconds)
+
+async def ok():
+    return True
+
+def test_retry_after_blocks_only_its_chat():
+    async def scenario():
+        queue = make_queue()
+        with pytest.raises(RetryAfter):
+            await request(queue, 1, lambda: flood(30))
+        
+        # Другой чат отправляется сразу, чат с RetryAfter ждет паузы
+        assert await asyncio.wait_for(request(queue, 2, ok), timeout=1)
+        assert queue.global_bucket.blocked_for(time.monotonic()) == 0
+        assert queue._chat_bucket(1).blocked_for(time.monotonic()) > 0
+        await queue.shutdown()
+    
+    asyncio.run(scenario())
+
+def test_retry_after_in_several_chats_blocks_everyone():
+    async def scenario():
+        queue = make_queue()
+        for chat_id in range(1, GLOBAL_RETRY_AFTER_CHATS + 1):
+            with pytest.raises(RetryAfter):
+                await request(queue, chat_id, lambda: flood(30))
+        
+        assert queue.global_bucket.blocked_for(time.monotonic()) > 0
+        assert queue.get_metrics()["global_retry_after"] == 1
+        await queue.shutdown()
+    
+    asyncio.run(scenario())
+
+def test_chat_action_does_not_use_chat_bucket():
+    async def scenario():
+        queue = make_queue()
+        queue.chat_rate = 0.01
+        
+        assert await request(queue, 1, ok)
+        # Лимит чата исчерпан, но индикатор отправляется без ожидания
+        assert await asyncio.wait_for(request(queue, 1, ok, endpoint="sendChatAction"), timeout=1)
+        assert queue._chat_bucket(1).wait_time(time.monotonic()) > 0
+        await queue.shutdown()
+    
+    asyncio.run(scenario())
+
+def test_stale_chat_action_is_dropped():
+    async def scenario():
+        queue = make_queue()
+        sent = []
+        
+        async def action():
+            sent.append(True)
+            return True
+        
+        # Чат на паузе после RetryAfter дольше, чем показывается индикатор
+        await queue.initialize()
+        queue._chat_bucket(1).block(time.monotonic() + 60)
+        pending = asyncio.ensure_future(request(queue, 1, action, endpoint="sendChatAction"))
+        await asyncio.sleep(0)
+        for job in queue._lanes[0] + queue._lanes[1] + queue._lanes[2]:
+            job.queued_at -= CHAT_ACTION_TTL + 1
+        queue._wakeup.set()
+        
+        assert await asyncio.wait_for(pending, timeout=1) is False
+        assert sent == []
+        assert queue.get_metrics()["dropped"] == 1
+        await queue.shutdown()
+    
+    asyncio.run(scenario())
+
+def test_send_tasks_are_kept_until_done():
+    async def scenario():
+        queue = make_queue()
+        release = asyncio.Event()
+        
+        async def slow():
+            await release.wait()
+            return True
+        
+        pending = asyncio.ensure_future(request(queue, 1, slow))
+        await asyncio.sleep(0.01)
+        assert len(queue._tasks) == 1
+        
+        release.set()
+        assert await pending
+        await asyncio.sleep(0)
+        assert queue._tasks == set()
+        await queue.shutdown()
+    
+    asyncio.run(scenario())
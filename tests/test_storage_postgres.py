@@ -0,0 +1,127 @@
+"""
+Проверка PostgresStorage на настоящем PostgreSQL.
+
+Сервер берется из TEST_DATABASE_URL, а если переменная не задана -
+запускается встроенный через pgserver (pip install pgserver). Без psycopg
+или без сервера тесты пропускаются.
+    
+    TEST_DATABASE_URL=postgresql://... python -m pytest tests/test_storage_postgres.py
+"""
+
+import os
+import re
+import tempfile
+import pytest
+
+pytest.importorskip("psycopg_pool")
+
+def schema_tables():
+    """Таблицы, которые создает хранилище"""
+    from storage_postgres import SCHEMA
+    
+    return [
+        match.group(1)
+        for statement in SCHEMA
+        for match in re.finditer(r"CREATE TABLE IF NOT EXISTS (\w+)", statement)
+    ]
+
+@pytest.fixture(scope="module")
+def dsn():
+    """Адрес тестовой базы"""
+    url = os.getenv("TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+    
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(tempfile.mkdtemp(prefix="pgtest_"), cleanup_mode="stop")
+    yield server.get_uri()
+    server.cleanup()
+
+@pytest.fixture
+def storage(dsn):
+    """Хранилище с пустыми таблицами"""
+    from storage_postgres import PostgresStorage
+    
+    storage = PostgresStorage(dsn, min_size=1, max_size=4)
+    storage.init_db()
+    with storage.pool.connection() as conn:
+        conn.execute(f"TRUNCATE {', '.join(schema_tables())} RESTART IDENTITY")
+    
+    yield storage
+    storage.shutdown_db()
+
+def test_chat_history(storage):
+    storage.create_or_update_user(1, "user", "Имя", None)
+    storage.add_message(1, "user", "привет")
+    storage.add_message(1, "assistant", "здравствуйте")
+    storage.add_message(2, "user", "чужое сообщение")
+    
+    history = storage.get_chat_history(1, limit=10)
+    assert [item["role"] for item in history] == ["user", "assistant"]
+    assert storage.get_user_stats(1)["message_count"] == 2
+    
+    storage.clear_chat_history(1)
+    assert storage.get_chat_history(1) == []
+    assert len(storage.get_chat_history(2)) == 1
+
+def test_concurrent_exports_of_same_user(storage):
+    for number in range(5):
+        storage.add_message(1, "user", f"сообщение {number}")
+    
+    # Две выгрузки одного пользователя читаются одновременно через серверные курсоры
+    first = storage.iter_chat_history(1, batch_size=2)
+    second = storage.iter_chat_history(1, batch_size=2)
+    rows = list(zip(first, second))
+    
+    assert len(rows) == 5
+    assert all(left == right for left, right in rows)
+
+def test_search_messages(storage):
+    storage.add_message(1, "user", "рецепт борща со сметаной")
+    storage.add_message(1, "user", "погода на завтра")
+    storage.add_message(2, "user", "рецепт пирога")
+    
+    results = storage.search_messages(1, "рецеп")
+    assert len(results) == 1
+    assert "«рецепт»" in results[0]["snippet"]
+
+def test_tokens_used_since(storage):
+    storage.add_usage_stats(1, "model-a", 100, "text")
+    storage.add_usage_stats(1, "model-b", 50, "text")
+    storage.add_usage_stats(2, "model-a", 10, "image")
+    
+    assert storage.get_tokens_used_since(0) == {1: 150, 2: 10}
+
+def test_group_history(storage):
+    for number in range(4):
+        storage.add_group_message(-100, 0, 1, "user", f"реплика {number}")
+    storage.add_group_message(-100, 7, 1, "user", "в теме форума")
+    
+    history = storage.get_group_history(-100, 0, limit=2)
+    assert [item["content"][0]["text"] for item in history] == ["реплика 2", "реплика 3"]
+    
+    assert storage.delete_old_group_messages_batch(keep=1) == 3
+    assert len(storage.get_group_history(-100, 0)) == 1
+    
+    storage.clear_group_history(-100, 0)
+    assert storage.get_group_history(-100, 0) == []
+    assert len(storage.get_group_history(-100, 7)) == 1
+
+def test_scheduled_messages(storage):
+    message_id = storage.add_scheduled_message(1, "напоминание", 0)
+    
+    assert [item["id"] for item in storage.get_pending_scheduled_messages()] == [message_id]
+    
+    storage.mark_scheduled_message_sent(message_id)
+    assert storage.get_pending_scheduled_messages() == []
+
+def test_messages_since_are_read_in_windows_from_oldest(storage):
+    for number in range(5):
+        storage.add_message(1, "user", f"сообщение {number}")
+    
+    first = storage.get_messages_since(1, 0, limit=2)
+    assert [item["content"] for item in first] == ["сообщение 0", "сообщение 1"]
+    
+    second = storage.get_messages_since(1, first[-1]["id"], limit=2)
+    assert [item["content"] for item in second] == ["сообщение 2", "сообщение 3"]
@@ -0,0 +1,86 @@
+"""Буфер отложенной записи: журнал на диске и очередь без потери строк"""
+
+import os
+import sqlite3
+import pytest
+
+pytest.importorskip("dotenv")
+
+import database
+from database import JOURNAL_SUFFIX, WriteBehindBuffer
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Инициализированная база во временном каталоге"""
+    path = str(tmp_path / "bot.db")
+    monkeypatch.setattr(database.config, "DB_PATH", path)
+    monkeypatch.setattr(database, "_write_buffer", None)
+    database.init_db()
+    return path
+
+def make_buffer(db_path: str, **options) -> WriteBehindBuffer:
+    """Буфер с журналом, который сам не сбрасывается"""
+    return WriteBehindBuffer(db_path, flush_ms=3600 * 1000, journal_path=db_path + JOURNAL_SUFFIX, **options)
+
+def message(text: str) -> tuple:
+    return (1, "user", text, 0, "text", None)
+
+def stored_messages(db_path: str):
+    conn = sqlite3.connect(db_path)
+    rows = [row[0] for row in conn.execute("SELECT content FROM messages ORDER BY id")]
+    conn.close()
+    return rows
+
+def crash(buffer: WriteBehindBuffer) -> None:
+    """Завершение без сброса очереди: строки в памяти теряются, остается журнал"""
+    with buffer._lock:
+        buffer._pending = []
+    buffer._is_running = False
+    buffer._wakeup.set()
+    buffer._thread.join()
+    os.close(buffer._journal_fd)
+
+def test_rows_are_recovered_after_crash(db_path):
+    buffer = make_buffer(db_path)
+    buffer.submit("message", message("записано"))
+    buffer.flush()
+    for number in range(3):
+        buffer.submit("message", message(f"в очереди {number}"))
+    crash(buffer)
+    
+    restarted = make_buffer(db_path)
+    assert restarted.recover() == 3
+    assert stored_messages(db_path) == ["записано", "в очереди 0", "в очереди 1", "в очереди 2"]
+    assert os.path.getsize(db_path + JOURNAL_SUFFIX) == 0
+    restarted.stop()
+
+def test_written_rows_are_not_replayed(db_path):
+    buffer = make_buffer(db_path)
+    buffer.submit("message", message("первое"))
+    buffer.submit("message", message("второе"))
+    buffer.flush()
+    # Сбой между фиксацией пакета и очисткой журнала
+    with open(db_path + JOURNAL_SUFFIX, "ab") as f:
+        f.write(buffer._journal_line(("message", message("первое"), 0.0, 1)))
+        f.write(b'[3, "mess')
+    crash(buffer)
+    
+    restarted = make_buffer(db_path)
+    assert restarted.recover() == 0
+    assert stored_messages(db_path) == ["первое", "второе"]
+    
+    # Нумерация продолжается после записанных строк
+    restarted.submit("message", message("третье"))
+    restarted.stop()
+    assert stored_messages(db_path) == ["первое", "второе", "третье"]
+
+def test_full_queue_is_written_synchronously(db_path):
+    buffer = make_buffer(db_path, max_pending=3)
+    for number in range(7):
+        buffer.submit("message", message(str(number)))
+    
+    assert buffer.get_metrics()["sync_flushes"] == 2
+    assert buffer.get_metrics()["pending"] == 1
+    buffer.stop()
+    assert stored_messages(db_path) == [str(number) for number in range(7)]
+    assert buffer.get_metrics()["dropped_rows"] == 0
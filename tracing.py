@@ -0,0 +1,365 @@
+"""
+Трассировка обработки обновлений в стиле OpenTelemetry.
+
+На каждое обновление Telegram создается трасса с корневым спаном обработчика
+и дочерними спанами вызовов хранилища, запросов к OpenRouter (модель, токены)
+и вызовов Bot API. Текущий спан хранится в contextvars, поэтому связь
+сохраняется через await, asyncio.to_thread и очередь исходящих запросов.
+
+Трассы отбираются при создании корневого спана с вероятностью
+TRACING_SAMPLE_RATE; для неотобранных обновлений спаны не создаются. Готовые
+спаны пакетами пишутся в файл (JSON Lines в формате OTLP/JSON, по строке на
+пакет) или отправляются на OTLP/HTTP-коллектор. Файл можно разобрать без
+коллектора: python maintenance.py traces --slowest 10
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+ENABLED = config.TRACING_ENABLED
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+EXPORT_QUEUE_SIZE = 10000
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    """Операция внутри трассы"""
+    
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "status", "status_message")
+    
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: int, attributes: Dict[str, Any]):
+        """Начало спана"""
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = dict(attributes)
+        self.status = 0
+        self.status_message = ""
+    
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Установить атрибут спана"""
+        if value is not None:
+            self.attributes[key] = value
+    
+    def record_error(self, error: BaseException) -> None:
+        """Отметить спан как завершившийся ошибкой"""
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+    
+    def end(self) -> None:
+        """Завершение спана и передача его на экспорт"""
+        self.end_ns = time.time_ns()
+        if self.status == 0:
+            self.status = STATUS_OK
+        _processor.submit(self)
+    
+    def to_otlp(self) -> Dict:
+        """Спан в формате OTLP/JSON"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": self.status}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+class _NoopSpan:
+    """Спан неотобранной трассы: все операции пустые"""
+    
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Ничего не делает"""
+    
+    def record_error(self, error: BaseException) -> None:
+        """Ничего не делает"""
+
+NOOP_SPAN = _NoopSpan()
+
+def _otlp_attribute(key: str, value: Any) -> Dict:
+    """Атрибут в формате OTLP/JSON"""
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+class BatchSpanProcessor:
+    """Накопление завершенных спанов и пакетный экспорт в фоновом потоке"""
+    
+    def __init__(self, exporter: str, file_path: str, endpoint: str, batch_size: int, flush_interval: float):
+        """Инициализация обработчика"""
+        self.exporter = exporter
+        self.file_path = file_path
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self.dropped = 0
+    
+    def submit(self, span: Span) -> None:
+        """Поставить спан в очередь экспорта (при переполнении спан отбрасывается)"""
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+            return
+        
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+    
+    def _start(self) -> None:
+        """Запуск фонового потока экспорта"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tracing-export", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+    
+    def _run(self) -> None:
+        """Основной цикл фонового потока: выгрузка раз в flush_interval или по заполнении пакета"""
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+    
+    def flush(self) -> None:
+        """Экспортировать все накопленные спаны"""
+        while True:
+            spans = []
+            while len(spans) < self.batch_size:
+                try:
+                    spans.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            if not spans:
+                return
+            self._export(spans)
+    
+    def _export(self, spans: List[Span]) -> None:
+        """Запись пакета в файл или отправка на коллектор"""
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", config.TRACING_SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": "bot.tracing"},
+                    "spans": [span.to_otlp() for span in spans]
+                }]
+            }]
+        }
+        
+        try:
+            if self.exporter == "otlp":
+                import requests
+                response = requests.post(self.endpoint, json=payload, timeout=10)
+                response.raise_for_status()
+            else:
+                directory = os.path.dirname(self.file_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with self._lock, open(self.file_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.error(f"Ошибка при экспорте {len(spans)} спанов: {e}")
+
+_processor = BatchSpanProcessor(
+    config.TRACING_EXPORTER,
+    config.TRACING_FILE,
+    config.TRACING_OTLP_ENDPOINT,
+    config.TRACING_BATCH_SIZE,
+    config.TRACING_FLUSH_INTERVAL
+)
+
+def current_span():
+    """Текущий спан (или пустой спан вне отобранной трассы)"""
+    return _current_span.get() or NOOP_SPAN
+
+@contextmanager
+def start_span(name: str, kind: int = SPAN_KIND_INTERNAL, root: bool = False, **attributes):
+    """
+    Спан вокруг блока кода
+    
+    Args:
+        name: Имя операции
+        kind: Тип спана (SPAN_KIND_*)
+        root: Начинать новую трассу, если текущей нет (с учетом TRACING_SAMPLE_RATE)
+        attributes: Атрибуты спана
+    """
+    parent = _current_span.get()
+    
+    if not ENABLED or (parent is None and (not root or random.random() >= config.TRACING_SAMPLE_RATE)):
+        yield NOOP_SPAN
+        return
+    
+    if parent is None:
+        span = Span(name, f"{random.getrandbits(128):032x}", None, kind, attributes)
+    else:
+        span = Span(name, parent.trace_id, parent.span_id, kind, attributes)
+    
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+def traced(name: str, kind: int = SPAN_KIND_INTERNAL):
+    """Декоратор: дочерний спан вокруг вызова функции (обычной или async) внутри трассы"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+        
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with start_span(name, kind):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return func(*args, **kwargs)
+            with start_span(name, kind):
+                return func(*args, **kwargs)
+        return wrapper
+    
+    return decorator
+
+def trace_handler(name: str):
+    """Декоратор обработчика обновлений: корневой спан трассы (в том числе для lambda)"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+        
+        @functools.wraps(func)
+        async def wrapper(update, context, *args, **kwargs):
+            attributes = {"handler": name}
+            if getattr(update, "update_id", None) is not None:
+                attributes["telegram.update_id"] = update.update_id
+            if getattr(update, "effective_user", None) is not None:
+                attributes["telegram.user_id"] = update.effective_user.id
+            if getattr(update, "effective_chat", None) is not None:
+                attributes["telegram.chat_id"] = update.effective_chat.id
+            
+            with start_span(f"update.{name}", SPAN_KIND_SERVER, root=True, **attributes):
+                result = func(update, context, *args, **kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+                return result
+        return wrapper
+    
+    return decorator
+
+def create_bot_request(**kwargs):
+    """
+    HTTP-клиент Bot API со спаном на каждый вызов метода (None, если трассировка выключена)
+    
+    Args:
+        kwargs: Параметры HTTPXRequest
+    """
+    if not ENABLED:
+        return None
+    
+    from telegram.request import HTTPXRequest
+    
+    class TracingRequest(HTTPXRequest):
+        """HTTPXRequest, создающий спан telegram.<метод> внутри трассы обновления"""
+        
+        async def do_request(self, url, method, request_data=None, *args, **kw):
+            endpoint = url.rsplit("/", 1)[-1]
+            with start_span(f"telegram.{endpoint}", SPAN_KIND_CLIENT, **{"http.method": method}) as span:
+                code, payload = await super().do_request(url, method, request_data, *args, **kw)
+                span.set_attribute("http.status_code", code)
+                return code, payload
+    
+    return TracingRequest(**kwargs)
+
+def load_traces(path: str = None) -> Dict[str, List[Dict]]:
+    """Спаны из файла экспорта, сгруппированные по трассам"""
+    traces: Dict[str, List[Dict]] = {}
+    with open(path or config.TRACING_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource in json.loads(line).get("resourceSpans", []):
+                for scope in resource.get("scopeSpans", []):
+                    for span in scope.get("spans", []):
+                        traces.setdefault(span["traceId"], []).append(span)
+    return traces
+
+def span_duration_ms(span: Dict) -> float:
+    """Длительность спана в миллисекундах"""
+    return (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+
+def format_trace(spans: List[Dict]) -> str:
+    """Дерево спанов трассы с длительностями и атрибутами"""
+    children: Dict[Optional[str], List[Dict]] = {}
+    span_ids = {span["spanId"] for span in spans}
+    for span in spans:
+        parent = span.get("parentSpanId")
+        # Спан, родитель которого не попал в файл, показываем на верхнем уровне
+        children.setdefault(parent if parent in span_ids else None, []).append(span)
+    
+    lines = []
+    
+    def render(span: Dict, depth: int) -> None:
+        attributes = ", ".join(
+            f"{attribute['key']}={next(iter(attribute['value'].values()))}"
+            for attribute in span.get("attributes", [])
+        )
+        status = " ОШИБКА" if span.get("status", {}).get("code") == STATUS_ERROR else ""
+        lines.append(f"{'  ' * depth}{span['name']} {span_duration_ms(span):.1f} мс{status}" + (f" [{attributes}]" if attributes else ""))
+        for child in sorted(children.get(span["spanId"], []), key=lambda item: int(item["startTimeUnixNano"])):
+            render(child, depth + 1)
+    
+    for root in sorted(children.get(None, []), key=lambda item: int(item["startTimeUnixNano"])):
+        render(root, 0)
+    
+    return "\n".join(lines)
@@ -4,10 +4,10 @@ import json
 import time
 from datetime import datetime
 from typing import Dict, List, Any, Optional
-from config import load_config
+from config import get_config
 
 logger = logging.getLogger(__name__)
-config = load_config()
+config = get_config()
 
 def ensure_directories():
     """Создание необходимых директорий"""
@@ -59,27 +59,333 @@ def estimate_tokens(text: str) -> int:
     
     return latin_chars // 4 + other_chars // 2
 
-def create_backup(backup_dir: str = "backups") -> str:
-    """Создание резервной копии базы данных"""
+# Примерная стоимость изображения и служебной разметки сообщения в токенах
+IMAGE_TOKENS = 1000
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def estimate_message_tokens(message: Dict) -> int:
+    """Примерная оценка токенов сообщения в формате OpenRouter API"""
+    content = message.get("content")
+    if isinstance(content, str):
+        return MESSAGE_OVERHEAD_TOKENS + estimate_tokens(content)
+    
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    for part in content or []:
+        if part.get("type") == "text":
+            tokens += estimate_tokens(part.get("text") or "")
+        elif part.get("type") == "image_url":
+            tokens += IMAGE_TOKENS
+    return tokens
+
+def fit_messages_to_context(messages: List[Dict], max_prompt_tokens: int) -> List[Dict]:
+    """
+    Удаление самых старых сообщений истории, пока запрос не поместится в контекст
+    
+    Системные сообщения в начале и последнее сообщение сохраняются всегда.
+    
+    Args:
+        messages: Сообщения от старых к новым
+        max_prompt_tokens: Сколько токенов модели можно отдать под запрос
+    
+    Returns:
+        Исходный список, если он помещается, иначе укороченная копия
+    """
+    sizes = [estimate_message_tokens(message) for message in messages]
+    total = sum(sizes)
+    if total <= max_prompt_tokens:
+        return messages
+    
+    first = 0
+    while first < len(messages) - 1 and messages[first].get("role") == "system":
+        first += 1
+    
+    drop_until = first
+    while total > max_prompt_tokens and drop_until < len(messages) - 1:
+        total -= sizes[drop_until]
+        drop_until += 1
+    
+    return messages[:first] + messages[drop_until:]
+
+def without_images(messages: List[Dict]) -> List[Dict]:
+    """Копия сообщений без изображений (для моделей, принимающих только текст)"""
+    result = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image_url" for part in content):
+            content = [part for part in content if part.get("type") != "image_url"]
+            if not content:
+                continue
+            message = dict(message, content=content)
+        result.append(message)
+    return result
+
+# Состояние цепочки резервных копий: последняя полная копия и хеши страниц
+# последнего снимка (по ним определяются изменившиеся страницы)
+BACKUP_STATE_FILE = "backup_state.json"
+BACKUP_HASHES_FILE = "backup_state.hashes"
+PAGE_HASH_SIZE = 8
+
+def _snapshot_database(snapshot_file: str) -> int:
+    """Согласованный снимок базы через SQLite backup API, возвращает размер страницы"""
     import sqlite3
+    
+    source = sqlite3.connect(config.DB_PATH)
+    target = sqlite3.connect(snapshot_file)
+    try:
+        # Один шаг (pages=-1) - одна читающая транзакция: копирование не начинается
+        # заново при записи в базу, а в режиме WAL читатель не блокирует запись
+        source.backup(target, pages=-1)
+        return target.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+
+def _page_hashes(snapshot_file: str, page_size: int) -> bytes:
+    """Хеши всех страниц снимка подряд, по PAGE_HASH_SIZE байт на страницу"""
+    import hashlib
+    
+    hashes = bytearray()
+    with open(snapshot_file, "rb") as f:
+        for page in iter(lambda: f.read(page_size), b""):
+            hashes += hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+    return bytes(hashes)
+
+def _read_backup_state(backup_dir: str) -> Optional[Dict]:
+    """Состояние цепочки копий или None, если следующая копия должна быть полной"""
+    try:
+        with open(os.path.join(backup_dir, BACKUP_STATE_FILE), "r", encoding="utf-8") as f:
+            state = json.load(f)
+        with open(os.path.join(backup_dir, BACKUP_HASHES_FILE), "rb") as f:
+            state["hashes"] = f.read()
+    except (OSError, ValueError):
+        return None
+    
+    if not os.path.exists(os.path.join(backup_dir, state.get("base", ""))):
+        return None
+    return state
+
+def _write_backup_state(backup_dir: str, base: str, page_size: int, increments: int, hashes: bytes) -> None:
+    """Атомарная запись состояния цепочки копий"""
+    hashes_file = os.path.join(backup_dir, BACKUP_HASHES_FILE)
+    with open(hashes_file + ".tmp", "wb") as f:
+        f.write(hashes)
+    os.replace(hashes_file + ".tmp", hashes_file)
+    
+    state_file = os.path.join(backup_dir, BACKUP_STATE_FILE)
+    with open(state_file + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"base": base, "page_size": page_size, "increments": increments}, f)
+    os.replace(state_file + ".tmp", state_file)
+
+def _write_increment(snapshot_file: str, increment_file: str, base: str,
+                     page_size: int, old_hashes: bytes, new_hashes: bytes) -> int:
+    """
+    Запись страниц, изменившихся с прошлого снимка
+    
+    Формат: строка JSON-заголовка, затем записи "номер страницы (4 байта,
+    big-endian) + содержимое страницы". Возвращает число записанных страниц.
+    """
+    import gzip
+    
+    page_count = len(new_hashes) // PAGE_HASH_SIZE
+    header = {"base": base, "page_size": page_size, "page_count": page_count}
+    changed = 0
+    
+    with open(snapshot_file, "rb") as src, gzip.open(increment_file, "wb") as dst:
+        dst.write((json.dumps(header) + "\n").encode("utf-8"))
+        for page_number in range(page_count):
+            offset = page_number * PAGE_HASH_SIZE
+            if old_hashes[offset:offset + PAGE_HASH_SIZE] == new_hashes[offset:offset + PAGE_HASH_SIZE]:
+                continue
+            src.seek(page_number * page_size)
+            dst.write(page_number.to_bytes(4, "big"))
+            dst.write(src.read(page_size))
+            changed += 1
+    
+    return changed
+
+def _rotate_backups(backup_dir: str, keep: int) -> None:
+    """Оставить последние keep полных копий и инкрементальные копии, основанные на них"""
+    import glob
+    
+    full_backups = sorted(glob.glob(os.path.join(backup_dir, "backup_*.db.gz")))
+    if keep <= 0 or len(full_backups) <= keep:
+        return
+    
+    oldest_kept = os.path.basename(full_backups[-keep])
+    for old_backup in full_backups[:-keep]:
+        os.remove(old_backup)
+        logger.info(f"Удалена устаревшая резервная копия: {old_backup}")
+    
+    # Инкрементальные копии старше самой старой полной относятся к удаленным цепочкам
+    for increment in glob.glob(os.path.join(backup_dir, "backup_*.inc.gz")):
+        if os.path.basename(increment) < oldest_kept:
+            os.remove(increment)
+
+def create_backup(backup_dir: str = None, keep: int = None, full: bool = False) -> str:
+    """
+    Резервная копия базы данных без остановки бота
+    
+    Каждая BACKUP_FULL_EVERY-я копия - полная (backup_*.db.gz), остальные -
+    инкрементальные (backup_*.inc.gz): только страницы, изменившиеся с
+    предыдущей копии. Восстановление на любой момент копирования - полная
+    копия и ее инкрементальные копии по порядку (restore_backup).
+    
+    Args:
+        backup_dir: Каталог копий
+        keep: Сколько полных копий (вместе с их инкрементальными) хранить
+        full: Сделать полную копию вне очереди
+    
+    Returns:
+        Путь к созданной копии или None в случае ошибки
+    """
+    import gzip
     import shutil
-    from datetime import datetime
+    
+    backup_dir = backup_dir or config.BACKUP_DIR
+    keep = keep if keep is not None else config.BACKUP_KEEP
     
     # Создаем директорию для резервных копий, если она не существует
     os.makedirs(backup_dir, exist_ok=True)
     
-    # Формируем имя файла резервной копии
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = os.path.join(backup_dir, f"backup_{timestamp}.db")
+    snapshot_file = os.path.join(backup_dir, f"backup_{timestamp}.db.tmp")
+    state = None if full else _read_backup_state(backup_dir)
     
-    # Копируем файл базы данных
     try:
-        shutil.copy2(config.DB_PATH, backup_file)
-        logger.info(f"Резервная копия базы данных создана: {backup_file}")
-        return backup_file
+        page_size = _snapshot_database(snapshot_file)
+        hashes = _page_hashes(snapshot_file, page_size)
+        
+        if (state is None or state["page_size"] != page_size
+                or state["increments"] + 1 >= config.BACKUP_FULL_EVERY):
+            backup_file = os.path.join(backup_dir, f"backup_{timestamp}.db.gz")
+            with open(snapshot_file, "rb") as src, gzip.open(backup_file + ".tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(backup_file + ".tmp", backup_file)
+            _write_backup_state(backup_dir, os.path.basename(backup_file), page_size, 0, hashes)
+            logger.info(f"Полная резервная копия базы данных создана: {backup_file} ({get_file_size(backup_file)})")
+        else:
+            backup_file = os.path.join(backup_dir, f"backup_{timestamp}.inc.gz")
+            changed = _write_increment(
+                snapshot_file, backup_file + ".tmp", state["base"], page_size, state["hashes"], hashes
+            )
+            os.replace(backup_file + ".tmp", backup_file)
+            _write_backup_state(backup_dir, state["base"], page_size, state["increments"] + 1, hashes)
+            logger.info(
+                f"Инкрементальная резервная копия создана: {backup_file} "
+                f"({changed} из {len(hashes) // PAGE_HASH_SIZE} страниц, {get_file_size(backup_file)})"
+            )
     except Exception as e:
         logger.error(f"Ошибка при создании резервной копии: {e}")
         return None
+    finally:
+        for temp_file in (snapshot_file, snapshot_file.replace(".db.tmp", ".db.gz.tmp"),
+                          snapshot_file.replace(".db.tmp", ".inc.gz.tmp")):
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+    
+    _rotate_backups(backup_dir, keep)
+    
+    return backup_file
+
+def _read_increment_header(increment_file: str) -> Dict:
+    """Заголовок инкрементальной копии"""
+    import gzip
+    
+    with gzip.open(increment_file, "rb") as f:
+        return json.loads(f.readline())
+
+def _apply_increment(increment_file: str, db_path: str) -> None:
+    """Запись страниц инкрементальной копии в восстановленную базу"""
+    import gzip
+    
+    with gzip.open(increment_file, "rb") as src, open(db_path, "r+b") as dst:
+        header = json.loads(src.readline())
+        page_size = header["page_size"]
+        
+        while True:
+            page_number = src.read(4)
+            if not page_number:
+                break
+            dst.seek(int.from_bytes(page_number, "big") * page_size)
+            dst.write(src.read(page_size))
+        
+        dst.truncate(header["page_count"] * page_size)
+
+def restore_backup(backup_file: str, db_path: str = None) -> bool:
+    """
+    Восстановление базы данных из резервной копии (бот должен быть остановлен)
+    
+    Для инкрементальной копии восстанавливается ее полная копия и применяются
+    все инкрементальные копии цепочки до указанной включительно.
+    """
+    import gzip
+    import glob
+    import shutil
+    
+    db_path = db_path or config.DB_PATH
+    
+    try:
+        increments = []
+        if backup_file.endswith(".inc.gz"):
+            backup_dir = os.path.dirname(backup_file)
+            base = _read_increment_header(backup_file)["base"]
+            increments = [
+                increment for increment in sorted(glob.glob(os.path.join(backup_dir, "backup_*.inc.gz")))
+                if os.path.basename(increment) <= os.path.basename(backup_file)
+                and _read_increment_header(increment)["base"] == base
+            ]
+            backup_file = os.path.join(backup_dir, base)
+        
+        with gzip.open(backup_file, "rb") as src, open(db_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        
+        for increment in increments:
+            _apply_increment(increment, db_path)
+        
+        # Удаляем журналы старой базы, чтобы они не применились к восстановленной
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        
+        logger.info(f"База данных восстановлена из {backup_file}" +
+                    (f" и {len(increments)} инкрементальных копий" if increments else ""))
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при восстановлении резервной копии: {e}")
+        return False
+
+def write_chat_export(user_id: int, format_type: str = "text", export_dir: str = "exports") -> Optional[str]:
+    """
+    Потоковая запись экспорта истории чата в файл gzip
+    
+    Экспорт пишется во временный файл и переименовывается после успешной
+    записи, поэтому при ошибке на диске не остается неполного файла.
+    """
+    import gzip
+    from database import export_chat_history_stream, EXPORT_FORMATS
+    
+    if format_type not in EXPORT_FORMATS:
+        return None
+    
+    os.makedirs(export_dir, exist_ok=True)
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    file_path = os.path.join(export_dir, f"chat_history_{user_id}_{timestamp}.{EXPORT_FORMATS[format_type]}.gz")
+    temp_file = file_path + ".tmp"
+    
+    try:
+        with gzip.open(temp_file, "wt", encoding="utf-8", newline="") as f:
+            for part in export_chat_history_stream(user_id, format_type):
+                f.write(part)
+        os.replace(temp_file, file_path)
+        
+        logger.info(f"Экспорт истории пользователя {user_id} записан: {file_path} ({get_file_size(file_path)})")
+        return file_path
+    except Exception as e:
+        logger.error(f"Ошибка при экспорте истории чата: {e}")
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        return None
 
 def rate_limit(user_id: int, action: str, limit_per_minute: int = 10) -> bool:
     """Ограничение частоты запросов для пользователя"""
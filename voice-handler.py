@@ -1,30 +1,167 @@
 import os
+import io
+import asyncio
 import logging
 import tempfile
-import speech_recognition as sr
-from pydub import AudioSegment
-from telegram import Update
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, TYPE_CHECKING
+from telegram import Update, Message
 from telegram.ext import ContextTypes
-from database import get_user, add_message
-from ai_client import AIClient
-from config import load_config
+from database import get_user, create_or_update_user
+from config import get_config
+from handlers.text_handler import reply_to_text
+from quotas import get_quota_manager, quota_exceeded_text
+from utils import MESSAGE_OVERHEAD_TOKENS
+
+# speech_recognition и pydub импортируются при первом голосовом сообщении:
+# они заметно замедляют запуск, а голосовые приходят не всем ботам
+if TYPE_CHECKING:
+    from pydub import AudioSegment
 
 logger = logging.getLogger(__name__)
-config = load_config()
+config = get_config()
+
+# Параметры разбиения длинных голосовых сообщений на фрагменты по паузам
+CHUNK_MIN_SILENCE_MS = 700      # Минимальная длительность паузы
+CHUNK_SILENCE_OFFSET_DB = 16    # Порог тишины относительно средней громкости
+CHUNK_KEEP_SILENCE_MS = 250     # Сколько тишины оставлять на краях фрагмента
+CHUNK_TARGET_MS = 30_000        # Желаемая длительность фрагмента
+CHUNK_MAX_MS = 55_000           # Жесткий предел (сервис распознавания не принимает > 60 с)
+VOICE_WORKERS = max(2, min(8, os.cpu_count() or 2))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Пул процессов для распознавания фрагментов (создается при первом использовании)"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=VOICE_WORKERS)
+    return _process_pool
+
+def _split_audio(audio: "AudioSegment") -> List["AudioSegment"]:
+    """Разбиение аудио на фрагменты по паузам с ограничением длительности"""
+    from pydub.silence import split_on_silence
+    
+    if len(audio) <= CHUNK_TARGET_MS:
+        return [audio]
+    
+    pieces = split_on_silence(
+        audio,
+        min_silence_len=CHUNK_MIN_SILENCE_MS,
+        silence_thresh=audio.dBFS - CHUNK_SILENCE_OFFSET_DB,
+        keep_silence=CHUNK_KEEP_SILENCE_MS
+    ) or [audio]
+    
+    # Фрагменты без пауз режем на равные части
+    bounded = []
+    for piece in pieces:
+        for start in range(0, len(piece), CHUNK_MAX_MS):
+            bounded.append(piece[start:start + CHUNK_MAX_MS])
+    
+    # Склеиваем короткие соседние фрагменты, чтобы не делать лишних запросов
+    chunks = []
+    for piece in bounded:
+        if chunks and len(chunks[-1]) + len(piece) <= CHUNK_TARGET_MS:
+            chunks[-1] += piece
+        else:
+            chunks.append(piece)
+    
+    return chunks
+
+def _decode_voice(ogg_file_path: str) -> List[bytes]:
+    """Декодирование ogg и подготовка WAV-фрагментов для распознавания"""
+    from pydub import AudioSegment
+    
+    audio = AudioSegment.from_ogg(ogg_file_path)
+    # Моно 16 кГц достаточно для распознавания речи и уменьшает объем данных
+    audio = audio.set_channels(1).set_frame_rate(16000)
+    
+    result = []
+    for chunk in _split_audio(audio):
+        buffer = io.BytesIO()
+        chunk.export(buffer, format="wav")
+        result.append(buffer.getvalue())
+    
+    return result
+
+def _recognize_chunk(wav_data: bytes, speech_lang: str) -> str:
+    """Распознавание одного фрагмента (выполняется в отдельном процессе)"""
+    import speech_recognition as sr
+    
+    recognizer = sr.Recognizer()
+    
+    with sr.AudioFile(io.BytesIO(wav_data)) as source:
+        audio_data = recognizer.record(source)
+    
+    try:
+        return recognizer.recognize_google(audio_data, language=speech_lang)
+    except sr.UnknownValueError:
+        # Во фрагменте нет разборчивой речи - пропускаем его
+        return ""
 
-async def process_voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+async def _recognize_chunks(chunks: List[bytes], speech_lang: str,
+                            context: ContextTypes.DEFAULT_TYPE,
+                            progress_message: Optional[Message] = None) -> str:
+    """Параллельное распознавание фрагментов с выводом промежуточного результата"""
+    loop = asyncio.get_running_loop()
+    pool = _get_process_pool()
+    
+    async def recognize(index: int, wav_data: bytes):
+        text = await loop.run_in_executor(pool, _recognize_chunk, wav_data, speech_lang)
+        return index, text
+    
+    results: List[Optional[str]] = [None] * len(chunks)
+    ready = 0
+    
+    for next_done in asyncio.as_completed([recognize(i, c) for i, c in enumerate(chunks)]):
+        index, text = await next_done
+        results[index] = text
+        
+        # Показываем только непрерывный префикс, чтобы текст шел по порядку
+        prefix = ready
+        while prefix < len(results) and results[prefix] is not None:
+            prefix += 1
+        
+        if prefix == ready:
+            continue
+        ready = prefix
+        
+        if progress_message is None or len(chunks) == 1:
+            continue
+        
+        partial_text = " ".join(t for t in results[:ready] if t)
+        try:
+            await context.bot.edit_message_text(
+                chat_id=progress_message.chat_id,
+                message_id=progress_message.message_id,
+                text=f"🎤 Распознаю голосовое сообщение... ({ready}/{len(chunks)})\n\n{partial_text}"
+            )
+        except Exception as e:
+            logger.debug(f"Не удалось обновить промежуточный результат распознавания: {e}")
+    
+    return " ".join(t for t in results if t)
+
+async def process_voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                progress_message: Optional[Message] = None) -> str:
     """
     Обработка голосового сообщения и преобразование его в текст
     
+    Длинные сообщения разбиваются на фрагменты по паузам, фрагменты
+    распознаются параллельно в пуле процессов и склеиваются по порядку.
+    
     Args:
         update: Объект Update из Telegram
         context: Контекст бота
+        progress_message: Сообщение, в котором показывается промежуточный текст
     
     Returns:
         Распознанный текст или None в случае ошибки
     """
+    import speech_recognition as sr
+    
     user = update.effective_user
     chat_id = update.effective_chat.id
+    ogg_file_path = None
     
     try:
         # Получаем голосовое сообщение
@@ -38,16 +175,9 @@ async def process_voice_message(update: Update, context: ContextTypes.DEFAULT_TY
         # Скачиваем голосовое сообщение
         await voice_file.download_to_drive(ogg_file_path)
         
-        # Конвертируем ogg в wav для распознавания
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_wav:
-            wav_file_path = temp_wav.name
-        
-        # Используем pydub для конвертации
-        audio = AudioSegment.from_ogg(ogg_file_path)
-        audio.export(wav_file_path, format="wav")
-        
-        # Инициализируем распознаватель
-        recognizer = sr.Recognizer()
+        # Декодирование и нарезка выполняются вне цикла событий
+        loop = asyncio.get_running_loop()
+        chunks = await loop.run_in_executor(None, _decode_voice, ogg_file_path)
         
         # Получаем настройки пользователя
         user_info = get_user(user.id)
@@ -67,15 +197,12 @@ async def process_voice_message(update: Update, context: ContextTypes.DEFAULT_TY
         speech_lang = language_map.get(language, 'ru-RU')
         
         # Распознаем речь
-        with sr.AudioFile(wav_file_path) as source:
-            audio_data = recognizer.record(source)
-            text = recognizer.recognize_google(audio_data, language=speech_lang)
+        text = await _recognize_chunks(chunks, speech_lang, context, progress_message)
         
-        # Очистка временных файлов
-        os.remove(ogg_file_path)
-        os.remove(wav_file_path)
+        if not text:
+            raise sr.UnknownValueError()
         
-        logger.info(f"Голосовое сообщение от пользователя {user.id} распознано: {text}")
+        logger.info(f"Голосовое сообщение от пользователя {user.id} распознано ({len(chunks)} фрагм.): {text}")
         
         return text
     
@@ -98,10 +225,9 @@ async def process_voice_message(update: Update, context: ContextTypes.DEFAULT_TY
             text="🎤 Произошла ошибка при обработке голосового сообщения."
         )
     finally:
-        # Удаляем временные файлы, если они существуют
-        for file_path in [ogg_file_path, wav_file_path]:
-            if 'file_path' in locals() and os.path.exists(file_path):
-                os.remove(file_path)
+        # Удаляем временный файл, если он существует
+        if ogg_file_path and os.path.exists(ogg_file_path):
+            os.remove(ogg_file_path)
     
     return None
 
@@ -116,6 +242,25 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
     user = update.effective_user
     chat_id = update.effective_chat.id
     
+    # Создаем или обновляем пользователя
+    create_or_update_user(
+        user_id=user.id,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name
+    )
+    
+    # Получаем настройки пользователя
+    user_info = get_user(user.id)
+    settings = user_info.get('settings', {})
+    
+    # Исчерпанная квота проверяется до скачивания и распознавания; размер
+    # запроса с распознанным текстом проверяется перед обращением к модели
+    quota = get_quota_manager().check(user.id, MESSAGE_OVERHEAD_TOKENS)
+    if not quota.allowed:
+        await context.bot.send_message(chat_id=chat_id, text=quota_exceeded_text(quota))
+        return
+    
     # Отправляем сообщение о начале обработки
     processing_message = await context.bot.send_message(
         chat_id=chat_id,
@@ -123,7 +268,7 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
     )
     
     # Преобразуем голосовое сообщение в текст
-    recognized_text = await process_voice_message(update, context)
+    recognized_text = await process_voice_message(update, context, processing_message)
     
     if not recognized_text:
         await context.bot.edit_message_text(
@@ -145,50 +290,6 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
         text=f"🎤 Распознанный текст: {recognized_text}"
     )
     
-    # Добавляем текст в историю сообщений
-    add_message(
-        user_id=user.id,
-        role="user",
-        content=recognized_text,
-        message_type="voice"
-    )
-    
-    # Отправляем индикатор набора текста
-    await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-    
-    # Получаем настройки пользователя
-    user_info = get_user(user.id)
-    settings = user_info.get('settings', {})
-    
-    # Инициализируем клиент AI
-    ai_client = AIClient()
-    
-    # Генерируем ответ от AI
-    response = ai_client.generate_response(
-        user_id=user.id,
-        messages=[{
-            "role": "user",
-            "content": [{"type": "text", "text": recognized_text}]
-        }],
-        model=settings.get('model', config.DEFAULT_MODEL),
-        temperature=settings.get('temperature', config.DEFAULT_TEMP),
-        max_tokens=settings.get('max_tokens', config.DEFAULT_MAX_TOKENS)
-    )
-    
-    if response:
-        # Добавляем ответ в историю
-        add_message(
-            user_id=user.id,
-            role="assistant",
-            content=response,
-            message_type="text"
-        )
-        
-        # Отправляем ответ пользователю
-        await context.bot.send_message(chat_id=chat_id, text=response)
-    else:
-        # В случае ошибки
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="😔 Извините, произошла ошибка при генерации ответа. Пожалуйста, попробуйте еще раз."
-        )
+    # Дальше распознанный текст обрабатывается как обычная реплика: квота,
+    # история, память и запрос к модели в отдельном потоке
+    await reply_to_text(context, chat_id, user.id, settings, recognized_text, message_type="voice")